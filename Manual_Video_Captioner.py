@@ -1,115 +1,195 @@
+import time
+_STARTED = time.perf_counter()  # For --profile-startup, taken before the heavier imports below
+
 import os
+import sys
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, ttk
 import json
-import vlc
-import cv2
 from pathlib import Path
 import pathlib
-
-class CustomPathEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Path):
-            # Convert the path to a string and replace forward slashes with backslashes for Windows compatibility
-            return str(obj.resolve()).replace("/", "\\")
-        return super().default(obj)
-
-
-def dict_to_object(dct):
-    if "video_path" in dct:
-        dct["video_path"] = Path(dct["video_path"])
-
-    if "frame_index" in dct:
-        try:
-            dct["frame_index"] = int(dct["frame_index"])
-        except ValueError:
-            pass
-
-    if "prompt" in dct:
-        if not isinstance(dct["prompt"], dict):
-            dct["prompt"] = {"prompt": dct["prompt"]}
-
-    return dct
+import argparse
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from manual_video_captioner.captions import CaptionRanges
+from manual_video_captioner.completion import CompletionIndex, SessionFile
+from manual_video_captioner.contact_sheet import ContactSheetCache
+from manual_video_captioner.dedup import DuplicateIndex
+from manual_video_captioner.frames import FrameDecoder
+from manual_video_captioner.file_ops import FileOperation, FileOperationQueue
+from manual_video_captioner.filecache import cache_dir_for
+from manual_video_captioner.locking import LEASE_SECONDS, LeaseManager, lease_dir_for, video_key
+from manual_video_captioner.metadata import MetadataCache
+from manual_video_captioner.prefetch import Prefetcher
+from manual_video_captioner.profiling import StartupProfile
+from manual_video_captioner.scenes import SceneDetector
+from manual_video_captioner.scanner import DEFAULT_EXTENSIONS, DirectoryIndex, parse_extensions, scan_videos
+from manual_video_captioner.search import CaptionIndex
+from manual_video_captioner.store import open_store
+from manual_video_captioner.tags import (ALL_TAGS, OPTION_GROUPS, checkbox_order, legacy_prompt, mask_to_tags,
+                                         tags_to_mask)
+from manual_video_captioner.telemetry import StallMonitor, Telemetry, format_summary, summarize
+
+_IMPORTS_DONE = time.perf_counter()
+
+vlc = None  # libvlc takes a while to load, so it is imported by VideoPlayerWindow on a background thread
+
+# How many clips ahead of the current one get their contact sheet built
+SHEET_LOOKAHEAD = 16
+# The lease on the clip on screen is renewed this often, well before it would expire
+LEASE_RENEW_MS = LEASE_SECONDS * 1000 // 3
+# How often the open stats panel is redrawn
+STATS_REFRESH_MS = 2000
+# How often the Tk thread picks up VLC events and decoded frames
+VLC_EVENT_POLL_MS = 50
+DECODED_FRAME_POLL_MS = 20
+
+STARTUP_PHASES = ("imports", "tk root", "widgets", "vlc init", "caption load", "window shown")
+
+
+def _import_vlc():
+    global vlc
+    if vlc is None:
+        import vlc as vlc_module
+        vlc = vlc_module
+    return vlc
 
 
 class VideoPlayerWindow(tk.Toplevel):
-    def __init__(self, master=None):
+    def __init__(self, master=None, metadata_cache=None, profile=None, telemetry=None):
         super().__init__(master)
+        self.metadata_cache = metadata_cache
+        self.profile = profile or StartupProfile()
+        self.telemetry = telemetry or Telemetry()
         self.title("Video Player")
         self.geometry("800x600")
-        self.vlc_instance = vlc.Instance()
-        self.vlc_player = self.vlc_instance.media_player_new()
 
         self.embed = tk.Frame(self, width=800, height=600)
         self.embed.pack()
-        self.vlc_player.set_hwnd(self.embed.winfo_id())
+
+        # Loading libvlc and creating the instance happen off the Tk thread; vlc_instance and vlc_player
+        # wait for them the first time they are needed. The window id has to be read on the Tk thread.
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vlc-init")
+        self._vlc_future = executor.submit(self._start_vlc, self.embed.winfo_id())
+        executor.shutdown(wait=False)
 
         self.resolution_label = tk.Label(self, text="Resolution: N/A")
         self.resolution_label.pack()
 
-    def set_media(self, media_path, prompts):
+        self.media_path = None
+        self.prompts = {}
+        self._frame_prompts = None
+        self.loop_video = False
+
+        # Playback is driven by VLC events. The callbacks run on libvlc's event thread, where even
+        # event_generate can deadlock against a stop() or set_media() on the Tk thread, so they only queue
+        # the event and the Tk thread picks it up.
+        self.vlc_events = queue.Queue()
+        self.after(VLC_EVENT_POLL_MS, self._drain_vlc_events)
+
+    def _start_vlc(self, window_id):
+        with self.profile.phase("vlc init"):
+            _import_vlc()
+            instance = vlc.Instance()
+            player = instance.media_player_new()
+            player.set_hwnd(window_id)
+            events = player.event_manager()
+            events.event_attach(vlc.EventType.MediaPlayerEndReached, self._post_event, "end reached")
+            events.event_attach(vlc.EventType.MediaPlayerLengthChanged, self._post_event, "length changed")
+        return instance, player
+
+    @property
+    def vlc_instance(self):
+        return self._vlc_future.result()[0]
+
+    @property
+    def vlc_player(self):
+        return self._vlc_future.result()[1]
+
+    def _post_event(self, vlc_event, kind):
+        self.vlc_events.put(kind)
+
+    def _drain_vlc_events(self):
+        while True:
+            try:
+                kind = self.vlc_events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "end reached":
+                self._on_end_reached()
+            elif kind == "length changed":
+                self.update_resolution_label()
+        self.after(VLC_EVENT_POLL_MS, self._drain_vlc_events)
+
+    def _on_end_reached(self):
+        if self.loop_video:
+            # Calling back into libvlc from its own event thread is not allowed, hence the detour through Tk
+            self.vlc_player.stop()
+            self.vlc_player.play()
+
+    def create_media(self, media_path):
+        # Called from the prefetch threads too; parsing starts in the background inside VLC
+        media = self.vlc_instance.media_new(str(media_path))  # Convert Path object to string
+        media.parse_with_options(vlc.MediaParseFlag.local, -1)
+        return media
+
+    def set_media(self, media_path, prompts, media=None):
         self.media_path = media_path
         self.prompts = prompts
-        self.media = self.vlc_instance.media_new(str(media_path))  # Convert Path object to string
-        self.vlc_player.set_media(self.media)
-        self.vlc_player.play()  # Start playing to get video resolution
+        self._frame_prompts = None
+        with self.telemetry.span("media load", media_path):
+            self.media = media if media is not None else self.create_media(media_path)
+            self.vlc_player.set_media(self.media)
+            self.vlc_player.play()  # Start playing to get video resolution
         self.loop_video = True
 
     def play_video(self):
-        if self.loop_video and not self.vlc_player.is_playing():
+        # Looping and the resolution label are handled by the VLC event callbacks
+        self.loop_video = True
+        if not self.vlc_player.is_playing():
             self.vlc_player.play()
 
-        self.after(100, self.play_video)
-
-        # Create frame index entries for each frame
-        self.create_frame_index_entries()
-
-        self.update_resolution_label()
-
     def get_total_frames(self, media_path):
-        try:
-            cap = cv2.VideoCapture(media_path)
-            if cap.isOpened():
-                total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-                cap.release()
-                return total_frames
-        except cv2.error:
-            pass
-        return 0
+        # Frame count and resolution come from a single cached probe per file
+        with self.telemetry.span("probe", media_path):
+            return self.metadata_cache.get(media_path).frame_count
 
-    def create_frame_index_entries(self):
-        self.frame_prompts = {}
-        for frame_index in range(1, self.total_frames + 1):
-            prompt = ""
-            if self.media_path in self.prompts:
-                if frame_index in self.prompts[self.media_path]:
-                    prompt = self.prompts[self.media_path][frame_index]
-            self.frame_prompts[frame_index] = prompt
+    @property
+    def frame_prompts(self):
+        # The current clip's CaptionRanges, fetched once per media or caption change; frames are looked up on demand
+        if self._frame_prompts is None:
+            self._frame_prompts = self.prompts.get(self.media_path) or CaptionRanges()
+        return self._frame_prompts
 
-    def update_resolution_label(self):
-        if self.vlc_player.get_length() > 0:
-            frame_width, frame_height = self.get_video_resolution(self.media.get_mrl())
-            if frame_width and frame_height:
-                self.resolution_label.config(text=f"Resolution: {frame_width}x{frame_height}")
-            else:
-                self.resolution_label.config(text="Resolution: N/A")
+    def captions_changed(self):
+        self._frame_prompts = None
 
-        # If the video is not yet ready, schedule the resolution update after 100ms
-        if not self.vlc_player.get_length():
-            self.after(100, self.update_resolution_label)
+    def update_resolution_label(self):
+        # Runs when VLC reports the clip length, i.e. once the media is ready
+        if self.media_path is None:
+            return
+        frame_width, frame_height = self.get_video_resolution(self.media_path)
+        if frame_width and frame_height:
+            self.resolution_label.config(text=f"Resolution: {frame_width}x{frame_height}")
+        else:
+            self.resolution_label.config(text="Resolution: N/A")
 
     def get_video_resolution(self, media_path):
-        try:
-            cap = cv2.VideoCapture(media_path)
-            if cap.isOpened():
-                frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                cap.release()
-                return frame_width, frame_height
-        except cv2.error:
-            pass
+        with self.telemetry.span("probe", media_path):
+            metadata = self.metadata_cache.get(media_path)
+        if metadata.width and metadata.height:
+            return metadata.width, metadata.height
         return None, None
 
+    def seek_to_frame(self, frame_index):
+        fps = self.metadata_cache.get(self.media_path).fps
+        if fps > 0:
+            self.vlc_player.set_time(int((frame_index - 1) * 1000 / fps))
+
     def stop(self):
         self.loop_video = False
         self.vlc_player.stop()
@@ -118,9 +198,38 @@ class VideoPlayerWindow(tk.Toplevel):
         self.loop_video = True
 
 class VideoReviewApp:
-    def __init__(self, root):
+    def __init__(self, root, store_path=None, prefetch_depth=3, extensions=DEFAULT_EXTENSIONS, profile=None,
+                 scene_workers=2, dedup_workers=2, sheet_workers=2, annotator=None, telemetry=None, cache_dir=None):
         self.root = root
+        self.profile = profile or StartupProfile()
+        widgets_started = time.perf_counter()
         self.root.title("Manual Video Captioner")
+        self.master_json_path = store_path or os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                                           "VIDEO_PROMPTS", "video_prompts.json")
+        # Caches, the scan index and per-annotator files stay on this machine even when the store is on a share;
+        # only the store, its leases and the junk folder live next to it
+        self.cache_dir = cache_dir or cache_dir_for(self.master_json_path)
+        # Frame count, fps, resolution and codec are probed once per file and cached
+        self.metadata_cache = MetadataCache(os.path.join(self.cache_dir, "cache.sqlite"))
+        # Every clip shown is leased to this annotator, so others sharing the tree pass it over
+        self.leases = LeaseManager(lease_dir_for(self.master_json_path), annotator)
+        self.claimed_video = None
+        annotator_name = re.sub(r"[^\w.-]", "_", self.leases.annotator)  # For the per-annotator files below
+        # Timing of the hot paths, kept in a ring buffer and logged to the cache directory, one log per annotator
+        self.telemetry = telemetry or Telemetry(os.path.join(self.cache_dir, f"telemetry-{annotator_name}.log"))
+        # Captioned clips by resolved path and file identity, and the clip each directory was left at
+        self.completion = CompletionIndex()
+        self.session = SessionFile(os.path.join(self.cache_dir, f"session-{annotator_name}.json"))
+        self.scan_directory = None
+        self.resumed_video = None  # The clip put on screen from the session file before the scan found it
+        self.clip_video = None  # The clip whose time is being measured, and when it was first shown
+        self.clip_started = None
+        self.stats_window = None
+        self.extensions = extensions
+        # Directory listings from earlier scans; only directories whose mtime changed are listed again
+        self.scan_index_path = os.path.join(self.cache_dir, "scan_index.json")
+        self.scan_queue = queue.Queue()  # Results from the scan thread, drained on the Tk thread
+        self.scanning = False
         self.video_files = []
         self.current_file_index = 0
         self.current_frame_index = 1
@@ -128,19 +237,112 @@ class VideoReviewApp:
         self.create_option_checkboxes()  # Create checkboxes for user options
 
         self.total_frames = 0
-        self.prompts = {}
         self.skip_delay = 0  # milliseconds DISABLED
-        self.video_player_window = VideoPlayerWindow()
+        self.video_player_window = VideoPlayerWindow(metadata_cache=self.metadata_cache, profile=self.profile,
+                                                     telemetry=self.telemetry)
+        # Prepares the next clips while the current one is being captioned
+        self.prefetcher = Prefetcher(prefetch_depth, self.metadata_cache, self.video_player_window.create_media)
+        # Proposes scene cuts for the current and upcoming clips, computed in worker processes
+        self.scene_detector = SceneDetector(os.path.join(self.cache_dir, "cache.sqlite"), scene_workers)
+        self.scenes = []  # [start_frame, end_frame] of each scene of the current clip, once detected
+        self.current_scene = 0
+        # Keyframe hashes of the scanned clips, so re-encoded or trimmed copies of captioned clips can be spotted
+        self.duplicate_index = DuplicateIndex(os.path.join(self.cache_dir, "cache.sqlite"), workers=dedup_workers)
+        self.dedup_workers = dedup_workers
+        self.dedup_stop = threading.Event()  # Of the running hashing pass; a new scan or closing the app sets it
+        # Thumbnail grids of the current and upcoming clips, so short clips can be captioned without watching them
+        self.contact_sheets = ContactSheetCache(os.path.join(self.cache_dir, "contact_sheets"), sheet_workers)
+        self._sheet_photo = None
+        self.work_queue_window = None
+        self.work_queue_updates = queue.Queue()
+        self.work_queue_files = []
 
         self.label = tk.Label(root, text="Enter your prompt for the current video:")
         self.label.pack()
 
-        self.entry = tk.Entry(root, width=50)
-        self.entry.pack()
+        entry_row = tk.Frame(root)
+        entry_row.pack()
+        self.entry = tk.Entry(entry_row, width=50)
+        self.entry.pack(side='left', anchor='n')
+        self.sheet_label = tk.Label(entry_row)
+        self.sheet_label.pack(side='left', padx=5)
+        # With this ticked clips are not played; the annotator works from the contact sheet
+        self.sheet_only = tk.IntVar()
+        self.sheet_only_checkbox = tk.Checkbutton(root, text="Caption from contact sheets (do not play clips)",
+                                                  variable=self.sheet_only, command=self._toggle_sheet_only)
+        self.sheet_only_checkbox.pack()
+        self.entry.bind("<KeyRelease>", self._update_completions)
+        self.entry.bind("<Down>", self._focus_completions)
+        self.entry.bind("<Escape>", lambda event: self._hide_completions())
+
+        # Earlier prompts and tags that start with what has been typed; Down to pick one, Return to use it
+        self.caption_index = CaptionIndex()
+        self.completion_frame = tk.Frame(root)
+        self.completion_frame.pack()
+        self.completion_list = tk.Listbox(self.completion_frame, width=50, height=5)
+        self.completion_list.bind("<Return>", self._accept_completion)
+        self.completion_list.bind("<Double-Button-1>", self._accept_completion)
+        self.completion_list.bind("<Escape>", lambda event: self._hide_completions(focus_entry=True))
 
         self.frame_label = tk.Label(root, text="Frame: 1/1")
         self.frame_label.pack()
 
+        # Frame stepper and scrubber. Frames come from a decoder thread per clip (see FrameDecoder), started the
+        # first time the stepper is used on the clip; captions made here go to the frame shown, or to the range
+        # marked with Start/End.
+        self.frame_decoder = None
+        self.frame_decoder_video = None
+        self.decoded_frames = queue.Queue()
+        self._frame_photo = None
+        self.range_start = None
+        self.range_end = None
+        self.frame_image_label = tk.Label(root)
+        self.frame_image_label.pack()
+        self.decoded_frame_polling = False
+
+        scrub_frame = tk.Frame(root)
+        scrub_frame.pack()
+        self.previous_frame_button = tk.Button(scrub_frame, text="<",
+                                               command=lambda: self.step_to(self.current_frame_index - 1))
+        self.previous_frame_button.pack(side='left')
+        self.frame_scale = tk.Scale(scrub_frame, from_=1, to=1, orient='horizontal', length=400, showvalue=False,
+                                    command=self._on_scale)
+        self.frame_scale.pack(side='left')
+        self.next_frame_button = tk.Button(scrub_frame, text=">",
+                                           command=lambda: self.step_to(self.current_frame_index + 1))
+        self.next_frame_button.pack(side='left')
+
+        range_frame = tk.Frame(root)
+        range_frame.pack()
+        tk.Button(range_frame, text="Start here", command=lambda: self.mark_range(start=True)).pack(side='left')
+        tk.Button(range_frame, text="End here", command=lambda: self.mark_range(start=False)).pack(side='left')
+        self.range_label = tk.Label(range_frame, text="Range: this frame")
+        self.range_label.pack(side='left')
+        self.caption_range_button = tk.Button(range_frame, text="Caption range", command=self._caption_range)
+        self.caption_range_button.pack(side='left')
+
+        self.frame_caption_label = tk.Label(root, text="")
+        self.frame_caption_label.pack()
+
+        self.scene_label = tk.Label(root, text="Scenes: N/A")
+        self.scene_label.pack()
+
+        # Ticking this confirms the proposed scenes: Submit then captions one scene at a time
+        self.use_scenes = tk.IntVar()
+        self.scene_checkbox = tk.Checkbutton(root, text="Caption each scene separately", variable=self.use_scenes,
+                                             command=self.update_scene_label)
+        self.scene_checkbox.pack()
+
+        self.duplicate_label = tk.Label(root, text="")
+        self.duplicate_label.pack()
+        self.skip_duplicates = tk.IntVar()
+        self.skip_duplicates_checkbox = tk.Checkbutton(root, text="Skip near-duplicates of captioned clips",
+                                                       variable=self.skip_duplicates)
+        self.skip_duplicates_checkbox.pack()
+
+        self.claim_label = tk.Label(root, text="")
+        self.claim_label.pack()
+
         self.resolution_label = tk.Label(root, text="Resolution: N/A")
         self.resolution_label.pack()
 
@@ -156,115 +358,115 @@ class VideoReviewApp:
         self.restart_button = tk.Button(root, text="Replay clip", command=self._restart_video, state='normal')
         self.restart_button.pack()
 
+        self.undo_junk_button = tk.Button(root, text="Undo junk", command=self._undo_junk, state='normal')
+        self.undo_junk_button.pack()
+
+        self.file_op_label = tk.Label(root, text="")
+        self.file_op_label.pack()
+
+        # Junk moves run on a background worker; its updates are drained on the Tk thread
+        self.file_op_updates = queue.Queue()
+        self.file_ops = FileOperationQueue(on_update=lambda operation, state: self.file_op_updates.put((operation, state)))
+        self.file_op_polling = False
+        self.junk_history = []  # Finished or pending junk moves, newest last, for "Undo junk"
+
         self.directory_button = tk.Button(root, text="Select Directory", command=self.load_videos)
         self.directory_button.pack()
 
-        self.master_json_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "VIDEO_PROMPTS",
-                                             "video_prompts.json")
-        self.load_prompts_from_json()
+        self.work_queue_button = tk.Button(root, text="Work queue", command=self.open_work_queue)
+        self.work_queue_button.pack()
+
+        self.stats_button = tk.Button(root, text="Stats", command=self.open_stats_panel)
+        self.stats_button.pack()
+
+        # The master JSON with its edit journal, an SQLite database for .sqlite/.db paths, or one file
+        # per video for .shards directories (for several annotators at once)
+        self.prompts = open_store(self.master_json_path, self.leases.annotator)
 
         self.update_frame_label()
 
         self.total_frames_label = tk.Label(root, text="Total Frames: 0")
         self.total_frames_label.pack()
 
+        self.load_label = tk.Label(root, text="Loading captions...")
+        self.load_label.pack()
+        self.load_progress = ttk.Progressbar(root, mode='indeterminate', length=200)
+        self.load_progress.pack()
+        self.profile.add("widgets", time.perf_counter() - widgets_started)
+
+        # Captions are read on a background thread so the window comes up right away; nothing that
+        # touches them is enabled until the load has finished
+        self.load_queue = queue.Queue()
+        self.load_thread = threading.Thread(target=self._load_prompts, daemon=True)
+        self.load_prompts_from_json()
+        self.root.after(LEASE_RENEW_MS, self._renew_claim)
+        # Measures how long the Tk loop is kept from responding, and writes out the telemetry now and then
+        self.stall_monitor = StallMonitor(self.root, self.telemetry)
+        self.stall_monitor.start()
+
 
     def create_option_checkboxes(self):
         option_frame = tk.Frame(self.root)
         option_frame.pack()
 
-        # Sample options for motion and categories
-        motion_options = [
-            "Zooming In", "Zooming Out", "Panning Left", "Panning Right", "Tilting Up", "Tilting Down",
-            "Steady Shot", "Handheld Camera", "Fast Motion", "Slow Motion", "Time-lapse",
-            "Fade In", "Fade Out", "Split Screen", "Visual Effects",
-            "CGI/3D Animation", "Stop Motion",
-        ]
-
-        categories_options = [
-            "People", "Landscapes", "Characters", "Animals", "Food", "Travel", "Sports", "Music", "Documentary",
-            "News", "Fashion", "Comedy", "Art", "Nature", "Science", "Technology",
-            "Architecture", "Transportation",
-        ]
-
-        other_options = [
-            "Underwater Footage", "Aerial Footage", "Low Light Conditions", "Night Scene", "Day Scene", "Indoor",
-            "Outdoor", "Close-up Shots", "Wide-angle Shots", "High-speed Action", "Slow-paced Scenes",
-             "B-roll Footage", "Crowd Shots", "Product Shots",
-        ]
-
-
-
-        # Create checkboxes for motion options in two columns
-        motion_label = tk.Label(option_frame, text="Motion:")
-        motion_label.pack(anchor='w')
-        num_motion_options = len(motion_options)
-        num_columns = 8
-        num_rows = (num_motion_options + num_columns - 1) // num_columns
-        for i in range(num_rows):
-            motion_column_frame = tk.Frame(option_frame)
-            motion_column_frame.pack(side='left')
-            for j in range(num_columns):
-                index = i + j * num_rows
-                if index < num_motion_options:
-                    option_text = motion_options[index]
-                    option_var = tk.IntVar()
-                    checkbox = tk.Checkbutton(motion_column_frame, text=option_text, variable=option_var)
-                    checkbox.pack(anchor='w')
-                    self.options.append((option_var, option_text))
-
-        # Create checkboxes for categories options in two columns
-        categories_label = tk.Label(option_frame, text="Categories:")
-        categories_label.pack(anchor='w')
-        num_categories_options = len(categories_options)
-        num_columns = 8
-        num_rows = (num_categories_options + num_columns - 1) // num_columns
-        for i in range(num_rows):
-            categories_column_frame = tk.Frame(option_frame)
-            categories_column_frame.pack(side='left')
-            for j in range(num_columns):
-                index = i + j * num_rows
-                if index < num_categories_options:
-                    option_text = categories_options[index]
-                    option_var = tk.IntVar()
-                    checkbox = tk.Checkbutton(categories_column_frame, text=option_text, variable=option_var)
-                    checkbox.pack(anchor='w')
-                    self.options.append((option_var, option_text))
-
-        # Create checkboxes for other options in two columns
-        other_label = tk.Label(option_frame, text="Other:")
-        other_label.pack(anchor='w')
-        num_other_options = len(other_options)
-        num_columns = 8
-        num_rows = (num_other_options + num_columns - 1) // num_columns
-        for i in range(num_rows):
-            other_column_frame = tk.Frame(option_frame)
-            other_column_frame.pack(side='left')
-            for j in range(num_columns):
-                index = i + j * num_rows
-                if index < num_other_options:
-                    option_text = other_options[index]
-                    option_var = tk.IntVar()
-                    checkbox = tk.Checkbutton(other_column_frame, text=option_text, variable=option_var)
-                    checkbox.pack(anchor='w')
-                    self.options.append((option_var, option_text))
-
-                
-
-    def update_prompt_for_frame(self, prompt):
+        # One grid per group instead of a Frame per column keeps the number of widgets Tk has to create down
+        for title, group_options in OPTION_GROUPS:
+            self._create_option_group(option_frame, title, group_options)
+
+    def _create_option_group(self, parent, title, group_options, num_columns=8):
+        group_frame = tk.Frame(parent)
+        group_frame.pack(side='left', anchor='n')
+        tk.Label(group_frame, text=title).grid(row=0, column=0, sticky='w')
+        num_rows = (len(group_options) + num_columns - 1) // num_columns
+        # Options run down each column; checkbox_order is also the order tags are listed in legacy prompts
+        for option_text in checkbox_order(group_options, num_columns):
+            row, column = divmod(group_options.index(option_text), num_rows)
+            option_var = tk.IntVar()
+            checkbox = tk.Checkbutton(group_frame, text=option_text, variable=option_var)
+            checkbox.grid(row=row + 1, column=column, sticky='w')
+            self.options.append((option_var, option_text))
+
+    def update_prompt_for_frame(self, prompt, tags=0):
         video_file = self.video_files[self.current_file_index]
         frame_index = self.current_frame_index
 
-        if video_file not in self.prompts:
-            self.prompts[video_file] = {}
+        self.record_caption("assign", video_file, frame_index, frame_index, prompt, tags)
 
-        self.prompts[video_file][frame_index] = {"prompt": prompt}
-        self.save_to_json()  # Save the updated prompts to the JSON file
-        self.video_player_window.set_media(video_file, self.prompts)  # Update the video player window with the new prompt
+    def record_caption(self, op, video_file, start_frame, end_frame, prompt, tags=0):
+        # tags is the bit mask of the ticked options (see manual_video_captioner.tags)
+        try:
+            with self.telemetry.span("save", video_file):
+                self.prompts.record(op, video_file, start_frame, end_frame, prompt, tags)
+        except OSError as e:
+            messagebox.showerror("Error", f"Failed to save the prompt: {e}")
+        self.video_player_window.captions_changed()  # Let the player window pick up the new captions
+        if not self.prompts.completes:
+            self.caption_index.update(video_file, self.prompts.get(video_file) or CaptionRanges())
+        self.completion.mark_done(video_file)
+        # From now on copies of this clip count as duplicates of a captioned one
+        hashes = self.duplicate_index.hashes(video_file)
+        if hashes is not None:
+            self.duplicate_index.add(video_file, hashes)
 
     def on_closing(self):
-        self.save_to_json()
-        self.withdraw()
+        # Closing a half-loaded JSON store would compact a partial snapshot over the master JSON
+        self.load_thread.join()
+        self.dedup_stop.set()
+        if self.frame_decoder is not None:
+            self.frame_decoder.close()
+        self.prefetcher.shutdown()
+        self.scene_detector.shutdown()
+        self.contact_sheets.shutdown()
+        self.file_ops.shutdown(wait=True)  # Let queued junk moves finish
+        self.session.close()
+        self._release_claim()
+        try:
+            self.prompts.close()
+        except OSError as e:
+            messagebox.showerror("Error", f"Failed to write the video prompts file, edits are kept in the journal: {e}")
+        self.stall_monitor.stop()
+        self.telemetry.close()
+        self.root.destroy()
 
     def create_frame_index_entries(self):
         self.frame_prompts = {}
@@ -272,142 +474,375 @@ class VideoReviewApp:
         if video_file in self.prompts:
             self.frame_prompts = self.prompts[video_file]
 
-    def save_to_json(self):
-        data = {"name": "My Videos", "data": []}
-        for video_file, frame_prompts in self.prompts.items():
-            data_item = {"video_path": str(video_file), "num_frames": len(frame_prompts), "data": []}  # Convert Path object to string
-            for frame_index, prompt in frame_prompts.items():
-                data_item["data"].append(prompt)  # Append the inner dictionary directly
-            data["data"].append(data_item)
+    def save_to_json(self, wait=False):
+        # Writes the master JSON in the background (a no-op for the SQLite store)
+        try:
+            with self.telemetry.span("save"):
+                self.prompts.flush(wait)
+        except OSError as e:
+            messagebox.showwarning("Warning", f"Failed to write the video prompts file, edits are kept in the journal: {e}")
 
-        master_json_dir = Path(self.master_json_path).parent
-        master_json_dir.mkdir(parents=True, exist_ok=True)  # Create directory if it doesn't exist
+    def load_prompts_from_json(self):
+        self.submit_button['state'] = 'disabled'
+        self.directory_button['state'] = 'disabled'
+        self.load_progress.start()
+        self.load_thread.start()
+        self.root.after(100, self._poll_load)
 
-        with open(self.master_json_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4, cls=CustomPathEncoder)  # Use the custom path encoder
+    def _load_prompts(self):
+        result = ("done", True)
+        try:
+            with self.profile.phase("caption load"):
+                found = self.prompts.load(progress=lambda count: self.load_queue.put(("progress", count)))
+            result = ("done", found)
+        except json.JSONDecodeError:
+            result = ("invalid", None)
+        except TimeoutError as e:
+            result = ("locked", e)
+        except OSError as e:
+            result = ("error", e)
+        # The done checks are needed as soon as a directory can be picked; autocomplete can follow once the
+        # UI is enabled, from a snapshot of the videos taken now (updates made meanwhile are queued up by the index)
+        self.completion.build(self.prompts.captioned())
+        items = None if self.prompts.completes else list(self.prompts.items())
+        self.load_queue.put(result)
+        if items is not None:
+            self.caption_index.build(items)
+
+    def _poll_load(self):
+        while True:
+            try:
+                kind, payload = self.load_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == "progress":
+                self.load_label.config(text=f"Loading captions... {payload} videos")
+                continue
+
+            self.load_progress.stop()
+            self.load_progress.pack_forget()
+            self.load_label.pack_forget()
+            if kind == "locked":
+                # Another window has the master JSON open; saving from here would overwrite its work
+                messagebox.showerror("Error", f"The video prompts file is in use by another session ({payload}). "
+                                              "Close it, or give each annotator a .shards store to work together.")
+                return
+            self.submit_button['state'] = 'normal'
+            self.directory_button['state'] = 'normal'
+            if kind == "invalid":
+                messagebox.showwarning("Warning", "Invalid JSON format in the video prompts file.")
+            elif kind == "error":
+                messagebox.showerror("Error", f"Failed to read the video prompts file: {payload}")
+            elif not payload:
+                messagebox.showinfo("Info", "No video prompts file found. Starting with an empty prompt list.")
+            return
 
+        self.root.after(100, self._poll_load)
 
 
-    def load_prompts_from_json(self):
-        if os.path.exists(self.master_json_path):
-            with open(self.master_json_path, 'r', encoding='utf-8') as f:
-                try:
-                    data = json.load(f, object_hook=dict_to_object)
-
-                    for item in data["data"]:
-                        video_path = item["video_path"]
-                        frame_prompts = {}
-                        for frame_data in item["data"]:
-                            if "frame_index" in frame_data and "prompt" in frame_data:
-                                frame_index = frame_data["frame_index"]
-                                prompt = frame_data["prompt"]
-                                frame_prompts[frame_index] = prompt
-                        self.prompts[video_path] = frame_prompts
-                except json.JSONDecodeError:
-                    messagebox.showwarning("Warning", "Invalid JSON format in the video prompts file.")
-        else:
-            messagebox.showinfo("Info", "No video prompts file found. Starting with an empty prompt list.")
-
+    def waiting_for_scan(self):
+        # Every clip found so far is done and the scan has not found the next one yet
+        return self.scanning and self.current_file_index >= len(self.video_files)
 
     def enable_buttons(self):
+        if self.waiting_for_scan():
+            return  # _poll_scan enables them once it shows the next clip
         self.submit_button['state'] = 'normal'
         self.skip_button['state'] = 'normal'
         self.junk_button['state'] = 'normal'
         self.restart_button['state'] = 'normal'
 
-    def disable_buttons_temporarily(self):
+    def disable_buttons(self):
         self.submit_button['state'] = 'disabled'
         self.skip_button['state'] = 'disabled'
         self.junk_button['state'] = 'disabled'
         self.restart_button['state'] = 'disabled'
+
+    def disable_buttons_temporarily(self):
+        self.disable_buttons()
         self.root.after(self.skip_delay, self.enable_buttons)
 
     def load_videos(self):
-        directory = filedialog.askdirectory(title="Select directory")
-        if not directory:
-            messagebox.showinfo("Info", "No directory selected.")
+        if self.scanning:
+            messagebox.showinfo("Info", "Still scanning the previous directory.")
             return
 
-        self.video_files = self.walk_directory_for_videos(directory)
-        if len(self.video_files) == 0:
-            messagebox.showinfo("Info", "No video files found in the selected directory and its subdirectories.")
+        directory = filedialog.askdirectory(title="Select directory", initialdir=self.session.last_directory)
+        if not directory:
+            messagebox.showinfo("Info", "No directory selected.")
             return
 
+        self.video_files = []
         self.current_file_index = 0
         self.current_frame_index = 1
         self.total_frames = 0
+        self.scan_directory = directory
 
-        self.display_current_video()
+        # Back at the clip the last session on this directory ended on, before the scan has found anything
+        self.resumed_video = self.session.position(directory)
+        if self.resumed_video is not None:
+            self.resumed_video = self.completion.canonical(self.resumed_video)
+            self.video_files = [self.resumed_video]
+            self.display_current_video()
 
-    def walk_directory_for_videos(self, directory):
-        video_files = set()
-        for root, _, files in os.walk(directory):
-            for file in files:
-                if file.lower().endswith(('.mp4', '.avi')):
-                    video_files.add(os.path.join(root, file))
-        return list(video_files)
+        # Scan on a background thread; the first clips are shown while the rest of the tree is still being walked
+        self.scanning = True
+        threading.Thread(target=self._scan_directory, args=(directory,), daemon=True).start()
+        self.root.after(50, self._poll_scan)
+
+    def _scan_directory(self, directory):
+        try:
+            # Paths are swapped for the keys the store has the clips under here, off the Tk thread
+            video_files = self.walk_directory_for_videos(
+                directory, on_found=lambda found: self.scan_queue.put(("found", self.completion.canonical_many(found))))
+            self.scan_queue.put(("done", self.completion.canonical_many(video_files)))
+        except OSError as e:
+            self.scan_queue.put(("error", e))
+
+    def _poll_scan(self):
+        while True:
+            try:
+                kind, payload = self.scan_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == "found":
+                # Nothing on screen yet, or the annotator already got through everything found so far
+                waiting = self.current_file_index >= len(self.video_files)
+                # Captioned clips wait for the end of the scan, behind everything still to do
+                self.video_files.extend(video_file for video_file in payload
+                                        if video_file != self.resumed_video and not self.completion.is_done(video_file))
+                if waiting and self.current_file_index < len(self.video_files):
+                    self.display_current_video()
+                    self.enable_buttons()
+            elif kind == "done":
+                self.scanning = False
+                self._finish_scan(payload)
+                return
+            else:
+                self.scanning = False
+                messagebox.showerror("Error", f"Failed to scan the directory: {payload}")
+                return
+
+        self.root.after(50, self._poll_scan)
+
+    def _finish_scan(self, video_files):
+        if len(video_files) == 0:
+            messagebox.showinfo("Info", "No video files found in the selected directory and its subdirectories.")
+            return
+
+        # Keep the clips already reviewed or on screen in place; the rest follow in sorted order, the ones still
+        # to caption first
+        reviewed = self.video_files[:self.current_file_index + 1]
+        reviewed_set = set(reviewed)
+        self.video_files = reviewed + self.completion.unfinished_first(
+            [video_file for video_file in video_files if video_file not in reviewed_set])
+        if self.current_file_index >= len(self.video_files):
+            # The annotator got through every clip before the scan ended
+            messagebox.showinfo("Info", "All videos have been reviewed.")
+            self.current_file_index = len(self.video_files) - 1
+            self.display_current_video()
+        elif self.current_file_index >= len(reviewed):
+            self.display_current_video()  # Every clip found was captioned already
+        self.enable_buttons()
+        next_index = self.current_file_index + 1
+        self.prefetcher.schedule(self.video_files[next_index:next_index + self.prefetcher.depth])
+
+        if self.dedup_workers > 0:
+            # The pass over the previous directory, if still running, makes way for this one with its pool
+            self.dedup_stop.set()
+            self.dedup_stop = threading.Event()
+            threading.Thread(target=self._hash_videos, args=(list(self.video_files), self.dedup_stop),
+                             daemon=True).start()
+
+    def _hash_videos(self, video_files, stop):
+        # Background pass: caches keyframe hashes for every clip and indexes the captioned ones first,
+        # so display_current_video can check each clip against them with a quick index lookup
+        captioned = [video_file for video_file in video_files if self.completion.is_done(video_file)]
+        rest = [video_file for video_file in video_files if not self.completion.is_done(video_file)]
+        try:
+            for batch in (captioned, rest):
+                for video_file, hashes in self.duplicate_index.hash_files(batch, stop):
+                    if stop.is_set():
+                        return
+                    if self.completion.is_done(video_file):
+                        self.duplicate_index.add(video_file, hashes)
+        except (OSError, BrokenProcessPool):
+            pass  # Duplicates are a hint only; clips that were not hashed are simply not flagged
+
+    def duplicate_of(self, video_file):
+        """The captioned clip video_file is a near-duplicate of, or None (also while it is not hashed yet)."""
+        hashes = self.duplicate_index.hashes(video_file)
+        if hashes is None:
+            return None
+        return self.duplicate_index.find(video_file, hashes)
+
+    def walk_directory_for_videos(self, directory, on_found=None):
+        index = DirectoryIndex(self.scan_index_path, self.extensions)
+        return scan_videos(directory, self.extensions, index, on_found=on_found)
 
     def get_current_video_prompt(self):
         video_file = self.video_files[self.current_file_index]
-        if video_file in self.prompts and 1 in self.prompts[video_file]:
-            return self.prompts[video_file][1]["prompt"]
+        if video_file in self.prompts:
+            return self.prompts[video_file].get(1, "")
         return ""
 
     def display_current_video(self):
-        if self.current_file_index < len(self.video_files):
+        started = time.perf_counter()
+        # Pass over clips another annotator holds or has captioned since the store was loaded, and
+        # near-duplicates if asked to. Never skip the last clip, so there is always something on screen.
+        claimed = None  # The clip the loop stopped at holds our lease already
+        while self.current_file_index < len(self.video_files) - 1:
             video_file = self.video_files[self.current_file_index]
-            self.video_player_window.set_media(video_file, self.prompts)
-            self.total_frames = self.video_player_window.get_total_frames(video_file)
-            self.update_frame_label()
+            if self.skip_duplicates.get() and self.duplicate_of(video_file) is not None:
+                self.current_file_index += 1
+            elif self._claim(video_file) is not None or self._refresh_captions(video_file):
+                self.current_file_index += 1
+            else:
+                claimed = video_file
+                break
 
-            # Get the prompt for the current video frame
+        if self.current_file_index < len(self.video_files):
             video_file = self.video_files[self.current_file_index]
-            frame_index = self.current_frame_index
-            if video_file in self.prompts and frame_index in self.prompts[video_file]:
-                prompt = self.prompts[video_file][frame_index]
-                self.entry.delete(0, 'end')  # Clear the prompt entry
-                self.entry.insert(0, prompt)  # Set the prompt for the current video frame
+            holder = self._claim(video_file) if video_file != claimed else None
+            if holder is not None:
+                self.claim_label.config(text=f"{holder['annotator'] or 'Another annotator'} is working on this clip")
             else:
-                # No prompt found for the current frame, set the entry to an empty string
-                self.entry.delete(0, 'end')  # Clear the prompt entry
+                self.claim_label.config(text="")
+            original = self.duplicate_of(video_file)
+            if original is not None:
+                self.duplicate_label.config(
+                    text=f"Near-duplicate of {os.path.basename(str(original))} (already captioned)")
+            else:
+                self.duplicate_label.config(text="")
+            media = self.prefetcher.take_media(video_file)  # None when the clip was not prefetched in time
+            if self.sheet_only.get():
+                self.video_player_window.stop()
+            else:
+                self.video_player_window.set_media(video_file, self.prompts, media)
+            self.total_frames = self.video_player_window.get_total_frames(video_file)
+            self.current_frame_index = 1
+            self._open_frame_decoder(video_file)
+            self.update_frame_label()
+            next_index = self.current_file_index + 1
+            upcoming = self.video_files[next_index:next_index + self.prefetcher.depth]
+            self.prefetcher.schedule(upcoming)
+            self.scene_detector.schedule([video_file] + upcoming)
+            self.contact_sheets.schedule(self.video_files[self.current_file_index:next_index + SHEET_LOOKAHEAD])
+            self._poll_contact_sheet(video_file)
+            self.scenes = []
+            self.current_scene = 0
+            self._poll_scenes(video_file)
+
+            # Get the prompt and tags for the current video frame (empty when it has none)
+            self.show_caption_for_frame(video_file, self.current_frame_index)
 
             self.entry.focus_set()  # Set focus to the prompt entry
+            self.telemetry.record("display", time.perf_counter() - started, video_file)
+            if self.clip_video != video_file:  # Replaying a clip does not start it over
+                self.clip_video = video_file
+                self.clip_started = started
+                if self.scan_directory is not None:
+                    self.session.save(self.scan_directory, video_file)
+
+    def _finish_clip(self, outcome):
+        # outcome is "clip" when it was captioned, "skipped clip" otherwise
+        if self.clip_video is not None:
+            self.telemetry.record(outcome, time.perf_counter() - self.clip_started, self.clip_video)
+            self.clip_video = None
 
     def _submit(self):
         video_file = self.video_files[self.current_file_index]
         prompt = self.entry.get()
+        # The ticked options are stored as a bit mask next to the typed prompt
+        tags = tags_to_mask(self.selected_options())
 
-        # Get the selected options from the GUI
-        selected_options = []
-        for option_var, option_text in self.options:
-            if option_var.get() == 1:
-                selected_options.append(option_text)
+        self.entry.delete(0, 'end')
+        self._hide_completions()
+        self.clear_options()  # Clear the selected options
 
-        # Concatenate the user-entered prompt with the selected options, separated by commas
-        if selected_options:
-            prompt += ", " + ", ".join(selected_options)
+        if self.use_scenes.get() and len(self.scenes) > 1:
+            self._submit_scene(video_file, prompt, tags)
+            return
 
-        if video_file not in self.prompts:
-            self.prompts[video_file] = {}
+        # Caption every frame that has no caption yet with a single range
+        if self.total_frames > 0:
+            self.record_caption("fill", video_file, 1, self.total_frames, prompt, tags)
+        self._finish_clip("clip")
+        # The player window shares self.prompts, so there is no need to reload the clip before moving on
+        self.next_video()
+        
+
+    def _submit_scene(self, video_file, prompt, tags):
+        start_frame, end_frame = self.scenes[self.current_scene]
+        last_scene = self.current_scene == len(self.scenes) - 1
+        if last_scene and self.total_frames > end_frame:
+            end_frame = self.total_frames  # The probed frame count can be a little off from the decoded one
+        self.record_caption("assign", video_file, start_frame, end_frame, prompt, tags)
+        if last_scene:
+            self._finish_clip("clip")
+            self.next_video()
+            return
+
+        # Move on to the next scene of the same clip
+        self.current_scene += 1
+        self.show_frame(self.scenes[self.current_scene][0])
+        self.video_player_window.seek_to_frame(self.current_frame_index)
+        self.update_scene_label()
+        self.show_caption_for_frame(video_file, self.current_frame_index)
 
-        for frame_index in range(1, self.total_frames + 1):
-            if frame_index not in self.prompts[video_file]:
-                frame_prompt = {
-                    "frame_index": frame_index,
-                    "prompt": prompt
-                }
-                self.prompts[video_file][frame_index] = frame_prompt
+    def caption_at(self, video_file, frame_index):
+        """The CaptionRange covering a frame, or None."""
+        if video_file not in self.prompts:
+            return None
+        return self.prompts[video_file].range_at(frame_index)
 
+    def show_caption_for_frame(self, video_file, frame_index):
+        # Put a frame's caption back into the entry and the checkboxes, ready to be edited
+        caption_range = self.caption_at(video_file, frame_index)
         self.entry.delete(0, 'end')
-        self.clear_options()  # Clear the selected options
-        self.save_to_json()  # Write data to the JSON file after submitting the prompt
-        self.video_player_window.set_media(video_file, self.prompts)  # Update the video player window with the new prompt
-        self.next_video()
-        
+        self.clear_options()
+        if caption_range is None:
+            return
+        self.entry.insert(0, caption_range.prompt)
+        ticked = set(mask_to_tags(caption_range.tags))
+        for option_var, option_text in self.options:
+            if option_text in ticked:
+                option_var.set(1)
+
+    def _poll_scenes(self, video_file):
+        # Picks up the scenes of the clip on screen once a worker has found them
+        if self.current_file_index >= len(self.video_files) or self.video_files[self.current_file_index] != video_file:
+            return
+        scenes = self.scene_detector.scenes(video_file)
+        if scenes is not None:
+            self.scenes = scenes
+        elif self.scene_detector.pending(video_file):
+            self.root.after(200, self._poll_scenes, video_file)
+        self.update_scene_label()
+
+    def update_scene_label(self):
+        if not self.scenes:
+            detecting = (self.current_file_index < len(self.video_files)
+                         and self.scene_detector.pending(self.video_files[self.current_file_index]))
+            self.scene_label.config(text="Scenes: detecting..." if detecting else "Scenes: N/A")
+        elif len(self.scenes) == 1:
+            self.scene_label.config(text="Scenes: 1 (no cuts found)")
+        elif self.use_scenes.get():
+            start_frame, end_frame = self.scenes[self.current_scene]
+            self.scene_label.config(text=f"Scene {self.current_scene + 1}/{len(self.scenes)}: "
+                                         f"frames {start_frame}-{end_frame}")
+        else:
+            proposed = ", ".join(f"{start_frame}-{end_frame}" for start_frame, end_frame in self.scenes[:6])
+            if len(self.scenes) > 6:
+                proposed += ", ..."
+            self.scene_label.config(text=f"Scenes: {len(self.scenes)} proposed ({proposed})")
 
     def _skip_video(self):
         self.disable_buttons_temporarily()
         self.video_player_window.stop()
+        self._finish_clip("skipped clip")
         self.next_video()
 
     def _move_to_junk(self):
@@ -419,11 +854,12 @@ class VideoReviewApp:
         # Stop the video player window if it's currently playing the video.
         self.video_player_window.stop()
 
-        # Wait for a short delay to ensure the video player is fully stopped.
-        self.root.after(200)
-
-        # Move the video file to the junk folder.
-        self.copy_to_junk_folder(video_file_path)
+        # Queue the move to the junk folder. The worker retries while the player still holds the file,
+        # so there is no need to wait for it to let go here.
+        if self.copy_to_junk_folder(video_file_path) is None:
+            return
+        self._finish_clip("skipped clip")
+        self.completion.mark_done(video_file)
 
         # Update the video_files list and remove the moved video from the list.
         self.video_files.pop(self.current_file_index)
@@ -432,10 +868,13 @@ class VideoReviewApp:
         if self.current_file_index < len(self.video_files):
             self.display_current_video()
             self.current_frame_index = 1  # Reset the current_frame_index when moving to the next video
+        elif self.scanning:
+            self.disable_buttons()  # The scan may still find more; _poll_scan shows it
+            return
         else:
             # Show a message when all videos have been reviewed.
             messagebox.showinfo("Info", "All videos have been reviewed.")
-            self.root.destroy()  # Close the application window when all videos have been reviewed
+            self.on_closing()  # Close the application window when all videos have been reviewed
 
         # Enable buttons after moving to the next video.
         self.enable_buttons()
@@ -449,20 +888,23 @@ class VideoReviewApp:
 
             # Get the prompt for the current video frame
             video_file = self.video_files[self.current_file_index]
-            if video_file in self.prompts and self.current_frame_index in self.prompts[video_file]:
-                prompt = self.prompts[video_file][self.current_frame_index]["prompt"]
-                self.entry.delete(0, 'end')  # Clear the prompt entry
-                self.entry.insert(0, prompt)  # Set the prompt for the current video frame
+            if self.caption_at(video_file, self.current_frame_index) is not None:
+                self.show_caption_for_frame(video_file, self.current_frame_index)
         else:
             self.current_frame_index = 1
             self.current_file_index += 1
             self.display_current_video()
 
     def next_video(self):
-        self.current_file_index += 1
+        # Never past the end: that is where _poll_scan looks for a clip to show next
+        self.current_file_index = min(self.current_file_index + 1, len(self.video_files))
         if self.current_file_index < len(self.video_files):
             self.display_current_video()
             self.current_frame_index = 1  # Reset the current_frame_index when moving to the next video
+        elif self.scanning:
+            # The next clip is shown as soon as the scan finds it; until then there is nothing to act on
+            self.video_player_window.stop()
+            self.disable_buttons()
         else:
             messagebox.showinfo("Info", "All videos have been reviewed.")
             self.current_file_index = len(self.video_files) - 1
@@ -477,36 +919,430 @@ class VideoReviewApp:
         self.display_current_video()
 
     def copy_to_junk_folder(self, video_file):
+        # The worker picks a free name in the junk folder (adding _1, _2, ...) and copies across drives with progress
         junk_folder = Path(self.master_json_path).parent / "junk"
-        junk_folder.mkdir(parents=True, exist_ok=True)  # Create directory if it doesn't exist
+        try:
+            operation = self.file_ops.move(video_file, junk_folder)
+        except queue.Full:
+            messagebox.showwarning("Warning", "Too many junk moves are still pending, try again in a moment.")
+            return None
+
+        # The caller drops the junked clip from video_files, so there is nothing to probe afterwards
+        self.total_frames = 0  # Reset the total_frames
+        self.junk_history.append(operation)
+        self._poll_file_ops()
+        return operation
+
+    def _undo_junk(self):
+        if not self.junk_history:
+            messagebox.showinfo("Info", "Nothing to undo.")
+            return
+        operation = self.junk_history[-1]
+        if operation.state != FileOperation.DONE:
+            messagebox.showinfo("Info", "The last junk move has not finished yet, try again in a moment.")
+            return
+        try:
+            self.file_ops.undo(operation)
+        except queue.Full:
+            messagebox.showwarning("Warning", "Too many file moves are still pending, try again in a moment.")
+            return
+        self.junk_history.pop()
+        self._poll_file_ops()
 
-        filename = video_file.name
-        filename_no_ext = video_file.stem
+    def _poll_file_ops(self):
+        if self.file_op_polling:
+            return
+        self.file_op_polling = True
+        self._drain_file_ops()
+
+    def _drain_file_ops(self):
+        while True:
+            try:
+                operation, state = self.file_op_updates.get_nowait()
+            except queue.Empty:
+                break
+            self._on_file_op_update(operation, state)
+
+        if self.file_ops.pending or not self.file_op_updates.empty():
+            self.root.after(100, self._drain_file_ops)
+        else:
+            self.file_op_polling = False
+
+    def _on_file_op_update(self, operation, state):
+        name = os.path.basename(operation.source)
+        if state == FileOperation.RUNNING:
+            self.file_op_label.config(text=f"Moving {name}: {operation.progress:.0%}")
+        elif state == FileOperation.DONE and operation.undo_of is None:
+            self.file_op_label.config(text=f"Moved {name} to junk")
+        elif state == FileOperation.DONE:
+            # Undone: put the clip back in front of the annotator
+            self.file_op_label.config(text=f"Restored {name}")
+            self._reinsert_video(self._restored_video(operation.destination), self.current_file_index)
+        elif state == FileOperation.FAILED:
+            self.file_op_label.config(text="")
+            if operation.undo_of is None:
+                if operation in self.junk_history:
+                    self.junk_history.remove(operation)
+                # The clip never left its folder, so queue it up again right after the current one
+                self._reinsert_video(self._restored_video(operation.source), self.current_file_index + 1)
+                messagebox.showerror("Error", f"Failed to move the video file to junk: {operation.error}")
+            else:
+                messagebox.showerror("Error", f"Failed to restore the video file from junk: {operation.error}")
+
+    def _restored_video(self, video_file):
+        # A clip back from junk counts as done only if it was captioned. Returns the key the store has it under.
+        video_file = self.completion.canonical(video_file)
+        if not len(self.prompts.get(video_file) or CaptionRanges()):
+            self.completion.discard(video_file)
+        return video_file
+
+    def _reinsert_video(self, video_file, index):
+        index = min(index, len(self.video_files))
+        self.video_files.insert(index, video_file)
+        if index == self.current_file_index:
+            self.video_player_window.stop()
+            self.current_frame_index = 1
+            self.display_current_video()
 
-        # Check if the file already exists in the junk folder
-        file_number = 1
-        new_filename = filename
-        while (junk_folder / new_filename).exists():
-            new_filename = f"{filename_no_ext}_{file_number}{video_file.suffix}"
-            file_number += 1
 
-        # Move the video file to the junk folder with the new filename
-        new_file_path = junk_folder / new_filename
+    def _claim(self, video_file):
+        # Lease video_file to this annotator and let go of the clip held before. Returns the lease of the
+        # annotator holding it instead, or None.
         try:
-            # Use shutil.move to move the file (allows moving between different disk drives)
-            import shutil
-            shutil.move(video_file, new_file_path)
-
-            # Update the video_files list and the total_frames for the current video
-            self.total_frames = 0  # Reset the total_frames
-            for i, file in enumerate(self.video_files):
-                if file == video_file:
-                    self.video_files[i] = new_file_path
-                    self.total_frames = self.video_player_window.get_total_frames(new_file_path)
-                    break
-        except OSError as e:
-            messagebox.showerror("Error", f"Failed to move the video file to junk: {e}")
+            holder = self.leases.claim(video_file)
+        except OSError:
+            return None  # Lease directory unreachable: carry on as a single annotator would
+        if holder is None:
+            if self.claimed_video is not None and self.claimed_video != video_file:
+                self._release_claim()
+            self.claimed_video = video_file
+        return holder
+
+    def _release_claim(self):
+        if self.claimed_video is None:
+            return
+        try:
+            self.leases.release(self.claimed_video)
+        except OSError:
+            pass  # It expires on its own
+        self.claimed_video = None
+
+    def _renew_claim(self):
+        if self.claimed_video is not None:
+            video_file = self.claimed_video
+            holder = self._claim(video_file)
+            if holder is not None:
+                # Our lease ran out (e.g. the machine slept) and someone else took the clip
+                self.claimed_video = None
+                self.claim_label.config(text=f"{holder['annotator'] or 'Another annotator'} took over this clip")
+        self.root.after(LEASE_RENEW_MS, self._renew_claim)
+
+    def _refresh_captions(self, video_file):
+        try:
+            refreshed = self.prompts.refresh(video_file)
+        except (OSError, ValueError):
+            return False
+        if refreshed and len(self.prompts.get(video_file) or CaptionRanges()):
+            self.completion.mark_done(video_file)  # Captioned by another annotator
+        return refreshed
+
+    def open_work_queue(self):
+        if self.work_queue_window is not None and self.work_queue_window.winfo_exists():
+            self.work_queue_window.lift()
+            self.refresh_work_queue()
+            return
+        window = tk.Toplevel(self.root)
+        window.title("Work queue")
+        self.work_queue_label = tk.Label(window, text="")
+        self.work_queue_label.pack()
+        self.work_queue_list = tk.Listbox(window, width=80, height=20)
+        self.work_queue_list.pack(fill='both', expand=True)
+        # Double-click a clip to caption it next
+        self.work_queue_list.bind("<Double-Button-1>", self._open_from_work_queue)
+        tk.Button(window, text="Refresh", command=self.refresh_work_queue).pack()
+        self.work_queue_window = window
+        self.refresh_work_queue()
+
+    def refresh_work_queue(self):
+        # Statting every clip's shard and lease can take a while on a network share, so it runs off the Tk thread
+        self.work_queue_label.config(text="Checking clips...")
+        threading.Thread(target=self._collect_work_queue, args=(list(self.video_files),), daemon=True).start()
+        self.root.after(100, self._poll_work_queue)
+
+    def _collect_work_queue(self, video_files):
+        try:
+            leases = self.leases.active()
+        except OSError:
+            leases = {}
+        captioned = 0
+        waiting = []  # (video_file, annotator holding it or None)
+        for video_file in video_files:
+            self._refresh_captions(video_file)
+            if video_file in self.prompts:
+                captioned += 1
+                continue
+            lease = leases.get(video_key(video_file))
+            if lease is not None and lease["annotator"] == self.leases.annotator:
+                lease = None  # Our own clip on screen
+            waiting.append((video_file, lease["annotator"] if lease is not None else None))
+        # Unclaimed clips first, in scan order
+        waiting.sort(key=lambda entry: entry[1] is not None)
+        self.work_queue_updates.put((len(video_files), captioned, waiting))
+
+    def _poll_work_queue(self):
+        try:
+            total, captioned, waiting = self.work_queue_updates.get_nowait()
+        except queue.Empty:
+            self.root.after(100, self._poll_work_queue)
+            return
+        if self.work_queue_window is None or not self.work_queue_window.winfo_exists():
+            return
+        claimed = sum(1 for _, annotator in waiting if annotator is not None)
+        self.work_queue_label.config(text=f"{total} clips: {captioned} captioned, {claimed} claimed by others, "
+                                          f"{len(waiting) - claimed} unclaimed")
+        self.work_queue_list.delete(0, 'end')
+        self.work_queue_files = []
+        for video_file, annotator in waiting:
+            status = f"claimed by {annotator}" if annotator is not None else "unclaimed"
+            self.work_queue_list.insert('end', f"{os.path.basename(str(video_file))}  ({status})")
+            if annotator is not None:
+                self.work_queue_list.itemconfig('end', foreground='grey')
+            self.work_queue_files.append(video_file)
+
+    def _open_from_work_queue(self, event=None):
+        selection = self.work_queue_list.curselection()
+        if not selection or self.submit_button['state'] == 'disabled':
+            return
+        video_file = self.work_queue_files[selection[0]]
+        try:
+            holder = self.leases.claim(video_file)
+        except OSError:
+            holder = None
+        if holder is not None:
+            messagebox.showinfo("Info", f"{holder['annotator'] or 'Another annotator'} is working on this clip.")
+            return
+        if video_file not in self.video_files:
+            return  # Junked since the queue was listed
+        self.video_player_window.stop()
+        self.current_file_index = self.video_files.index(video_file)
+        self.display_current_video()
+
+    def open_stats_panel(self):
+        if self.stats_window is not None and self.stats_window.winfo_exists():
+            self.stats_window.lift()
+            return
+        self.stats_window = tk.Toplevel(self.root)
+        self.stats_window.title("Stats")
+        self.stats_label = tk.Label(self.stats_window, font=("Courier", 9), justify='left', anchor='w')
+        self.stats_label.pack(fill='both', expand=True)
+        self._refresh_stats_panel()
+
+    def _refresh_stats_panel(self):
+        # Redrawn from the in-memory ring buffer while the panel is open
+        if self.stats_window is None or not self.stats_window.winfo_exists():
+            return
+        self.stats_label.config(text=format_summary(summarize(self.telemetry.snapshot())))
+        self.root.after(STATS_REFRESH_MS, self._refresh_stats_panel)
+
+    def selected_options(self):
+        return [option_text for option_var, option_text in self.options if option_var.get() == 1]
+
+    def _open_frame_decoder(self, video_file):
+        # The decoder itself is started by the first step_to() for the clip, so clips captioned without the
+        # stepper are only ever decoded by VLC
+        if self.frame_decoder is not None:
+            self.frame_decoder.close()
+        self.frame_decoder = None
+        self.frame_decoder_video = video_file
+        self.range_start = self.range_end = None
+        self.update_range_label()
+        self.frame_scale.config(to=max(1, self.total_frames))
+        self.frame_image_label.config(image="")
+        self._frame_photo = None
+        self.show_frame(1)
+
+    def _poll_contact_sheet(self, video_file):
+        if self.current_file_index >= len(self.video_files) or self.video_files[self.current_file_index] != video_file:
+            return
+        sheet_path = self.contact_sheets.sheet(video_file)
+        if sheet_path is not None:
+            try:
+                self._sheet_photo = tk.PhotoImage(file=sheet_path)
+            except tk.TclError:
+                self._sheet_photo = None
+            self.sheet_label.config(image=self._sheet_photo or "", text="")
+            return
+        self._sheet_photo = None
+        if self.contact_sheets.pending(video_file):
+            self.sheet_label.config(image="", text="Building contact sheet...")
+            self.root.after(200, self._poll_contact_sheet, video_file)
+        else:
+            self.sheet_label.config(image="", text="")
+
+    def _toggle_sheet_only(self):
+        if self.current_file_index >= len(self.video_files):
+            return
+        if self.sheet_only.get():
+            self.video_player_window.stop()
+        else:
+            self.video_player_window.set_media(self.video_files[self.current_file_index], self.prompts)
+
+    def _post_decoded_frame(self, video_file, frame_index, data):
+        # Runs on the decoder thread, so only queues the frame; it is drawn on the Tk thread
+        self.decoded_frames.put((video_file, frame_index, data))
+
+    def _poll_decoded_frames(self):
+        if self.decoded_frame_polling:
+            return
+        self.decoded_frame_polling = True
+        self._drain_decoded_frames()
+
+    def _drain_decoded_frames(self):
+        latest = None
+        while True:
+            try:
+                video_file, frame_index, data = self.decoded_frames.get_nowait()
+            except queue.Empty:
+                break
+            # Frames from the decoder of a clip that is no longer shown are dropped
+            if (self.current_file_index < len(self.video_files)
+                    and video_file == self.video_files[self.current_file_index]
+                    and frame_index == self.current_frame_index):
+                latest = data
+        if latest is not None:
+            self._render_frame(latest)
+
+        if self.frame_decoder is not None or not self.decoded_frames.empty():
+            self.root.after(DECODED_FRAME_POLL_MS, self._drain_decoded_frames)
+        else:
+            self.decoded_frame_polling = False
+
+    def _render_frame(self, data):
+        self._frame_photo = tk.PhotoImage(data=data, format="PPM")
+        self.frame_image_label.config(image=self._frame_photo)
+
+    def step_to(self, frame_index):
+        """Step or scrub to frame_index of the current clip, decoding it for the frame view."""
+        if self.frame_decoder is None and self.frame_decoder_video is not None and self.total_frames > 0:
+            video_file = self.frame_decoder_video
+            self.frame_decoder = FrameDecoder(
+                video_file, lambda frame_index, data: self._post_decoded_frame(video_file, frame_index, data))
+            self._poll_decoded_frames()
+        self.show_frame(frame_index)
+
+    def _on_scale(self, value):
+        # Also called when show_frame() moves the scale itself, for the frame that is already shown
+        frame_index = int(float(value))
+        if frame_index != self.current_frame_index:
+            self.step_to(frame_index)
+
+    def show_frame(self, frame_index):
+        """Go to frame_index of the current clip; captions made now apply to that frame.
+
+        The frame itself is only shown once the stepper has started a decoder for the clip.
+        """
+        if (self.frame_decoder_video is None or self.total_frames <= 0
+                or self.current_file_index >= len(self.video_files)):
+            return
+        frame_index = min(max(1, frame_index), self.total_frames)
+        self.current_frame_index = frame_index
+        self.update_frame_label()
+        if int(self.frame_scale.get()) != frame_index:
+            self.frame_scale.set(frame_index)
+        video_file = self.video_files[self.current_file_index]
+        caption_range = self.caption_at(video_file, frame_index)
+        if caption_range is not None:
+            caption = legacy_prompt(caption_range.prompt, caption_range.tags)
+            self.frame_caption_label.config(text=f"Caption here: {caption}")
+        else:
+            self.frame_caption_label.config(text="No caption on this frame")
+        if self.frame_decoder is None:
+            return
+        data = self.frame_decoder.show(frame_index)
+        if data is not None:
+            self._render_frame(data)  # Cached, no need to wait for the decoder thread
+
+    def mark_range(self, start):
+        if start:
+            self.range_start = self.current_frame_index
+        else:
+            self.range_end = self.current_frame_index
+        self.update_range_label()
+
+    def update_range_label(self):
+        if self.range_start is None and self.range_end is None:
+            self.range_label.config(text="Range: this frame")
+        else:
+            start_frame, end_frame = self._marked_range()
+            self.range_label.config(text=f"Range: {start_frame}-{end_frame}")
+
+    def _marked_range(self):
+        # A missing mark defaults to the frame on screen; the marks may be set in either order
+        start_frame = self.range_start if self.range_start is not None else self.current_frame_index
+        end_frame = self.range_end if self.range_end is not None else self.current_frame_index
+        return min(start_frame, end_frame), max(start_frame, end_frame)
+
+    def _caption_range(self):
+        if self.current_file_index >= len(self.video_files) or self.total_frames <= 0:
+            return
+        prompt = self.entry.get()
+        tags = tags_to_mask(self.selected_options())
+        if self.range_start is None and self.range_end is None:
+            self.update_prompt_for_frame(prompt, tags)
+        else:
+            start_frame, end_frame = self._marked_range()
+            self.record_caption("assign", self.video_files[self.current_file_index], start_frame, end_frame,
+                                prompt, tags)
+            self.range_start = self.range_end = None
+            self.update_range_label()
+        self.show_frame(self.current_frame_index)  # Refresh the caption shown for this frame
+
+    def _update_completions(self, event=None):
+        if event is not None and event.keysym in ("Down", "Up", "Return", "Escape", "Tab"):
+            return
+        text = self.entry.get()
+        # SQLite stores answer from their own table; the others from the in-memory index
+        completions = (self.prompts if self.prompts.completes else self.caption_index).complete(text)
+        if not completions or completions == [text]:
+            self._hide_completions()
+            return
+        self.completion_list.delete(0, 'end')
+        for completion in completions:
+            self.completion_list.insert('end', completion)
+        self.completion_list.config(height=len(completions))
+        self.completion_list.pack()
+
+    def _focus_completions(self, event=None):
+        if not self.completion_list.winfo_ismapped():
+            return None
+        self.completion_list.focus_set()
+        self.completion_list.selection_clear(0, 'end')
+        self.completion_list.selection_set(0)
+        self.completion_list.activate(0)
+        return "break"
+
+    def _accept_completion(self, event=None):
+        selection = self.completion_list.curselection()
+        if not selection:
+            return "break"
+        completion = self.completion_list.get(selection[0])
+        if completion in ALL_TAGS:
+            # A tag is ticked rather than typed, so the prompt stays in the same form as with the checkboxes
+            for option_var, option_text in self.options:
+                if option_text == completion:
+                    option_var.set(1)
+            self.entry.delete(0, 'end')
+        else:
+            self.entry.delete(0, 'end')
+            self.entry.insert(0, completion)
+        self._hide_completions(focus_entry=True)
+        return "break"
 
+    def _hide_completions(self, focus_entry=False):
+        self.completion_list.pack_forget()
+        if focus_entry:
+            self.entry.focus_set()
+            self.entry.icursor('end')
 
     def clear_options(self):
         # Clear the selected options by resetting each IntVar associated with the checkboxes to 0 (unchecked state)
@@ -529,8 +1365,49 @@ class VideoReviewApp:
 
 
 if __name__ == "__main__":
-    root = tk.Tk()
-    app = VideoReviewApp(root)
+    parser = argparse.ArgumentParser(description="Caption video files while you preview them in VLC.")
+    parser.add_argument("--store", help="Caption store to use: a master JSON file, an SQLite database "
+                                        "(.sqlite/.db), or a directory of per-video files (.shards) that "
+                                        "several annotators can share. Defaults to VIDEO_PROMPTS/video_prompts.json.")
+    parser.add_argument("--prefetch", type=int, default=3, metavar="N",
+                        help="Number of upcoming clips to prepare in the background (default: 3).")
+    parser.add_argument("--extensions", type=parse_extensions, default=DEFAULT_EXTENSIONS,
+                        help="Comma separated video file extensions to look for (default: .mp4,.avi).")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Print how long each part of the start took to stderr.")
+    parser.add_argument("--scene-workers", type=int, default=2, metavar="N",
+                        help="Worker processes that detect scene cuts ahead of the annotator; 0 turns it off "
+                             "(default: 2).")
+    parser.add_argument("--sheet-workers", type=int, default=2, metavar="N",
+                        help="Worker processes that build contact sheets ahead of the annotator; 0 turns it off "
+                             "(default: 2).")
+    parser.add_argument("--dedup-workers", type=int, default=2, metavar="N",
+                        help="Worker processes that hash keyframes to spot near-duplicate clips; 0 turns it off "
+                             "(default: 2).")
+    parser.add_argument("--no-telemetry-log", action="store_true",
+                        help="Keep timing data in memory only (for the Stats panel) instead of also logging it to "
+                             "telemetry-<annotator>.log in the cache directory (see --cache-dir).")
+    parser.add_argument("--cache-dir", help="Where caches, the scan index, telemetry and the session file go "
+                                            "(default: a directory for the store under this machine's user cache "
+                                            "directory). Keep it on a local drive.")
+    parser.add_argument("--annotator", help="Name recorded in leases and shards so other annotators see who holds "
+                                            "a clip (default: user@host).")
+    args = parser.parse_args()
+
+    profile = StartupProfile(_STARTED, STARTUP_PHASES, sys.stderr if args.profile_startup else None)
+    profile.add("imports", _IMPORTS_DONE - _STARTED)
+    with profile.phase("tk root"):
+        root = tk.Tk()
+
+    def on_map(event):
+        # <Map> is also reported for every child widget; only the first one of the root window counts
+        if event.widget is root and "window shown" not in profile.phases:
+            profile.mark("window shown")
+
+    root.bind("<Map>", on_map)
+    app = VideoReviewApp(root, args.store, args.prefetch, args.extensions, profile, args.scene_workers,
+                         args.dedup_workers, args.sheet_workers, args.annotator,
+                         Telemetry() if args.no_telemetry_log else None, args.cache_dir)
     app.video_player_window.master = app  # Set the VideoReviewApp as the master of the VideoPlayerWindow
     root.protocol("WM_DELETE_WINDOW", app.on_closing)
     root.mainloop()
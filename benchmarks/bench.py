@@ -0,0 +1,320 @@
+"""Headless benchmarks for loading, saving, submitting and scanning, on synthetic caption stores and trees.
+
+    python benchmarks/bench.py --videos 10,1000,100000 --output results.json
+    python benchmarks/bench.py --output new.json --compare results.json
+
+Every case builds a directory tree of empty clips and a caption store for
+them, then drives the real VideoReviewApp with Tk, VLC and OpenCV replaced
+by the stand-ins in stubs.py. Times are the best of --repeat runs; peak
+memory comes from a separate run under tracemalloc, which would otherwise
+slow the timed runs down.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import stubs  # noqa: E402
+
+stubs.install()
+
+import Manual_Video_Captioner as gui  # noqa: E402
+from manual_video_captioner.captions import CaptionRanges, dict_to_object  # noqa: E402
+from manual_video_captioner.cli import write_captions  # noqa: E402
+from manual_video_captioner.tags import TAG_VOCABULARY  # noqa: E402
+
+# (frames per clip, caption ranges per clip) of each frame count profile
+FRAME_PROFILES = {
+    "short": (300, 2),
+    "long": (20000, 20),
+    "very-long": (500000, 200),
+}
+STORE_FILES = {"json": "video_prompts.json", "sqlite": "captions.sqlite", "shards": "captions.shards"}
+CLIPS_PER_DIRECTORY = 100
+SUBMITS = 200
+
+_WORDS = ("a", "dog", "runs", "across", "the", "beach", "at", "sunset", "close", "up", "of", "city", "street",
+          "night", "rain", "slow", "pan", "over", "mountains", "crowd")
+
+
+def make_tree(root, videos):
+    """videos empty .mp4 files, CLIPS_PER_DIRECTORY to a directory, two levels deep. Returns their paths."""
+    paths = []
+    for i in range(videos):
+        directory = os.path.join(root, f"d{i // (CLIPS_PER_DIRECTORY * 10):03d}",
+                                 f"s{i // CLIPS_PER_DIRECTORY % 10:02d}")
+        if i % CLIPS_PER_DIRECTORY == 0:
+            os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"clip{i:06d}.mp4")
+        open(path, "wb").close()
+        paths.append(path)
+    return paths
+
+
+def synthetic_ranges(rng, frames, ranges):
+    captions = CaptionRanges()
+    cuts = sorted(rng.sample(range(2, frames + 1), ranges - 1)) if ranges > 1 else []
+    starts = [1] + cuts
+    ends = [cut - 1 for cut in cuts] + [frames]
+    for start_frame, end_frame in zip(starts, ends):
+        prompt = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(3, 12)))
+        tags = 0
+        for _ in range(rng.randint(0, 4)):
+            tags |= 1 << rng.randrange(len(TAG_VOCABULARY))
+        captions.assign(start_frame, end_frame, prompt, tags)
+    return captions
+
+
+def make_store(path, video_files, profile, seed=0):
+    rng = random.Random(seed)
+    frames, ranges = FRAME_PROFILES[profile]
+    write_captions(path, ((video_file, synthetic_ranges(rng, frames, ranges)) for video_file in video_files))
+
+
+def open_app(store_path):
+    # The background pools are off: they would start processes that import the real OpenCV
+    app = gui.VideoReviewApp(gui.tk.Tk(), store_path, prefetch_depth=0, scene_workers=0, dedup_workers=0,
+                             sheet_workers=0, annotator="bench",
+                             cache_dir=os.path.join(os.path.dirname(store_path), "cache"))
+    app.load_thread.join()
+    app._poll_load()
+    return app
+
+
+def close_app(app):
+    app.on_closing()
+
+
+# Each benchmark times its own part with timer and may return how many operations that covered
+
+
+def bench_load(case, timer):
+    # Window set-up plus load_prompts_from_json, up to the point where Submit is enabled
+    with timer:
+        app = open_app(case["store"])
+    close_app(app)
+
+
+def bench_dict_to_object(case, timer):
+    # The master JSON parsed in one go with the GUI's object hook (json stores only)
+    with timer, open(case["store"], "r", encoding="utf-8") as f:
+        json.load(f, object_hook=dict_to_object)
+
+
+def bench_save(case, timer):
+    app = open_app(case["store"])
+    app.video_files = list(case["tree"])
+    app.record_caption("assign", app.video_files[0], 1, 1, "edited", 0)
+    with timer:
+        app.save_to_json(wait=True)
+    close_app(app)
+
+
+def bench_submit(case, timer):
+    app = open_app(case["store"])
+    app.video_files = list(case["new_clips"])
+    app.display_current_video()
+    with timer:
+        for i in range(min(SUBMITS, len(app.video_files) - 1)):
+            app.entry.insert(0, f"new caption {i}")
+            app._submit()
+    close_app(app)
+    return min(SUBMITS, len(app.video_files) - 1)
+
+
+def bench_scan(case, timer):
+    app = open_app(case["store"])
+    if os.path.exists(app.scan_index_path):
+        os.remove(app.scan_index_path)
+    with timer:
+        app.walk_directory_for_videos(case["tree_root"])
+    close_app(app)
+
+
+def bench_rescan(case, timer):
+    # Second scan of an unchanged tree, answered from the directory index
+    app = open_app(case["store"])
+    app.walk_directory_for_videos(case["tree_root"])
+    with timer:
+        app.walk_directory_for_videos(case["tree_root"])
+    close_app(app)
+
+
+class _Timer:
+    def __init__(self):
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.seconds += time.perf_counter() - self._started
+
+
+def _run_once(function, case):
+    timer = _Timer()
+    gc.collect()
+    operations = function(case, timer)
+    return timer.seconds, operations
+
+
+BENCHMARKS = {
+    "load": bench_load,
+    "dict_to_object": bench_dict_to_object,
+    "save": bench_save,
+    "submit": bench_submit,
+    "scan": bench_scan,
+    "rescan": bench_rescan,
+}
+
+
+def _prepare_case(workdir, store_kind, videos, profile):
+    case_dir = os.path.join(workdir, f"{store_kind}-{videos}-{profile}")
+    tree_root = os.path.join(case_dir, "clips")
+    tree = make_tree(tree_root, videos)
+    # Clips with no captions yet, for submit
+    new_clips = make_tree(os.path.join(case_dir, "new"), min(SUBMITS + 1, videos + 1))
+    store = os.path.join(case_dir, "store", STORE_FILES[store_kind])
+    make_store(store, tree, profile)
+    return {"store": store, "store_kind": store_kind, "tree": tree, "tree_root": tree_root, "new_clips": new_clips}
+
+
+def run(store_kinds, sizes, profiles, names, repeat, memory, workdir):
+    results = []
+    for store_kind in store_kinds:
+        for videos in sizes:
+            for profile in profiles:
+                case = _prepare_case(workdir, store_kind, videos, profile)
+                for name in names:
+                    function = BENCHMARKS[name]
+                    if function is bench_dict_to_object and store_kind != "json":
+                        continue
+                    times = []
+                    operations = None
+                    for _ in range(repeat):
+                        seconds, operations = _run_once(function, case)
+                        times.append(seconds)
+                    result = {"name": name, "store": store_kind, "videos": videos, "frames": profile,
+                              "seconds": min(times), "runs": times}
+                    if isinstance(operations, int) and operations:
+                        result["per_operation"] = min(times) / operations
+                    if memory:
+                        tracemalloc.start()
+                        _run_once(function, case)
+                        result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+                        tracemalloc.stop()
+                    results.append(result)
+                    print(_format(result), file=sys.stderr)
+                shutil.rmtree(os.path.join(workdir, f"{store_kind}-{videos}-{profile}"), ignore_errors=True)
+    return results
+
+
+def _format(result):
+    text = f"{result['name']:>15} {result['store']:>6} {result['videos']:>7} videos {result['frames']:>9}: " \
+           f"{result['seconds'] * 1000:10.1f} ms"
+    if "per_operation" in result:
+        text += f" ({result['per_operation'] * 1000:.2f} ms each)"
+    if "peak_bytes" in result:
+        text += f", peak {result['peak_bytes'] / 2 ** 20:.1f} MiB"
+    return text
+
+
+def _metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"python": platform.python_version(), "platform": platform.platform(), "commit": commit,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def _key(result):
+    return result["name"], result["store"], result["videos"], result["frames"]
+
+
+def compare(baseline, results, threshold):
+    """Print how results moved against a baseline run. Returns the number of cases slower than threshold."""
+    before = {_key(result): result for result in baseline["results"]}
+    regressions = 0
+    for result in results:
+        old = before.get(_key(result))
+        if old is None:
+            continue
+        ratio = result["seconds"] / old["seconds"] if old["seconds"] else float("inf")
+        line = f"{_format(result)}  x{ratio:.2f} time"
+        if "peak_bytes" in result and old.get("peak_bytes"):
+            line += f", x{result['peak_bytes'] / old['peak_bytes']:.2f} memory"
+        if ratio > threshold:
+            regressions += 1
+            line += "  SLOWER"
+        print(line)
+    return regressions
+
+
+def _int_list(text):
+    return [int(value) for value in text.split(",")]
+
+
+def _choices(allowed):
+    def parse(text):
+        values = [value.strip() for value in text.split(",")]
+        unknown = [value for value in values if value not in allowed]
+        if unknown:
+            raise argparse.ArgumentTypeError(f"unknown: {', '.join(unknown)} (choose from {', '.join(allowed)})")
+        return values
+    return parse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time loading, saving, submitting and scanning on synthetic data.")
+    parser.add_argument("--videos", type=_int_list, default=[10, 1000, 10000],
+                        help="Comma separated store sizes in videos (default: 10,1000,10000).")
+    parser.add_argument("--frames", type=_choices(FRAME_PROFILES), default=["short", "long"],
+                        help=f"Comma separated frame count profiles: {', '.join(FRAME_PROFILES)} "
+                             "(default: short,long).")
+    parser.add_argument("--stores", type=_choices(STORE_FILES), default=["json"],
+                        help=f"Comma separated store kinds: {', '.join(STORE_FILES)} (default: json).")
+    parser.add_argument("--only", type=_choices(BENCHMARKS), default=list(BENCHMARKS),
+                        help=f"Comma separated benchmarks to run: {', '.join(BENCHMARKS)} (default: all).")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case; the best one counts.")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the extra run that measures peak memory.")
+    parser.add_argument("--output", help="Write the results here as JSON.")
+    parser.add_argument("--compare", help="Results JSON of an earlier run to compare against.")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="With --compare, exit with status 1 if a case got slower than this factor.")
+    parser.add_argument("--workdir", help="Where to generate the data (default: a temporary directory).")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="caption-bench-")
+    try:
+        results = run(args.stores, args.videos, args.frames, args.only, args.repeat, not args.no_memory, workdir)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    document = {"meta": _metadata(), "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(document, f, indent=4)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
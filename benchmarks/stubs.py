@@ -0,0 +1,188 @@
+"""Stand-ins for tkinter, vlc and cv2, so the GUI module can be imported and driven on a headless box.
+
+Only for the benchmarks: widgets remember just enough (entry text, variable
+values, widget options) for the captioning code paths to run, VLC does
+nothing, and OpenCV reports every file as a FRAME_COUNT-frame clip that
+cannot be decoded. The timings therefore cover this project's code, not
+VLC or video decoding.
+"""
+import sys
+import types
+
+FRAME_COUNT = 300
+FPS = 30.0
+
+
+def _noop(*args, **kwargs):
+    return None
+
+
+class _Widget:
+    def __init__(self, *args, **kwargs):
+        self._options = dict(kwargs)
+
+    def __getattr__(self, name):
+        # pack, grid, bind, after, title, lift, ... all accept anything and do nothing
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return _noop
+
+    def __getitem__(self, key):
+        return self._options.get(key, "")
+
+    def __setitem__(self, key, value):
+        self._options[key] = value
+
+    def config(self, **kwargs):
+        self._options.update(kwargs)
+
+    configure = config
+
+    def cget(self, key):
+        return self._options.get(key, "")
+
+    def winfo_id(self):
+        return 0
+
+    def winfo_exists(self):
+        return True
+
+
+class _Entry(_Widget):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._text = ""
+
+    def get(self):
+        return self._text
+
+    def insert(self, index, text):
+        self._text = self._text + text if index == 'end' else text + self._text
+
+    def delete(self, first, last=None):
+        self._text = ""
+
+
+class _Listbox(_Widget):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._items = []
+
+    def insert(self, index, text):
+        self._items.append(text)
+
+    def delete(self, first, last=None):
+        self._items = []
+
+    def size(self):
+        return len(self._items)
+
+    def curselection(self):
+        return ()
+
+
+class _Scale(_Widget):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._value = kwargs.get("from_", 0)
+
+    def get(self):
+        return self._value
+
+    def set(self, value):
+        self._value = value
+
+
+class _Variable:
+    def __init__(self, master=None, value=0):
+        self._value = value
+
+    def get(self):
+        return self._value
+
+    def set(self, value):
+        self._value = value
+
+
+class _TclError(Exception):
+    pass
+
+
+def _tkinter():
+    tk = types.ModuleType("tkinter")
+    for name in ("Tk", "Toplevel", "Frame", "Label", "Button", "Checkbutton", "PhotoImage"):
+        setattr(tk, name, type(name, (_Widget,), {}))
+    tk.Entry = _Entry
+    tk.Listbox = _Listbox
+    tk.Scale = _Scale
+    tk.IntVar = tk.StringVar = _Variable
+    tk.TclError = _TclError
+
+    filedialog = types.ModuleType("tkinter.filedialog")
+    filedialog.askdirectory = lambda **kwargs: ""
+    messagebox = types.ModuleType("tkinter.messagebox")
+    for name in ("showinfo", "showwarning", "showerror"):
+        setattr(messagebox, name, _noop)
+    ttk = types.ModuleType("tkinter.ttk")
+    ttk.Progressbar = type("Progressbar", (_Widget,), {})
+    tk.filedialog, tk.messagebox, tk.ttk = filedialog, messagebox, ttk
+    return {"tkinter": tk, "tkinter.filedialog": filedialog, "tkinter.messagebox": messagebox, "tkinter.ttk": ttk}
+
+
+class _Anything:
+    # Every attribute and call returns the same object: enough for the VLC calls the GUI makes
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return self
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+
+def _vlc():
+    vlc = types.ModuleType("vlc")
+    anything = _Anything()
+    vlc.Instance = anything
+    vlc.EventType = anything
+    vlc.MediaParseFlag = anything
+    return {"vlc": vlc}
+
+
+class _VideoCapture:
+    def __init__(self, path):
+        self.path = path
+
+    def isOpened(self):
+        return True
+
+    def get(self, prop):
+        return {7: FRAME_COUNT, 5: FPS, 3: 1280, 4: 720, 6: 0x34363268}.get(prop, 0)
+
+    def set(self, prop, value):
+        return True
+
+    def read(self):
+        return False, None
+
+    def grab(self):
+        return False
+
+    def release(self):
+        pass
+
+
+def _cv2():
+    cv2 = types.ModuleType("cv2")
+    cv2.VideoCapture = _VideoCapture
+    cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT = 3, 4
+    cv2.CAP_PROP_FPS, cv2.CAP_PROP_FOURCC, cv2.CAP_PROP_FRAME_COUNT = 5, 6, 7
+    cv2.CAP_PROP_POS_FRAMES = 1
+    cv2.error = type("error", (Exception,), {})
+    return {"cv2": cv2}
+
+
+def install():
+    """Put the stand-ins in sys.modules, replacing the real modules if they were installed."""
+    for modules in (_tkinter(), _vlc(), _cv2()):
+        sys.modules.update(modules)
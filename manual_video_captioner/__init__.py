@@ -0,0 +1,7 @@
+"""Dataset side of the Manual Video Captioner.
+
+Nothing in this package imports tkinter, vlc or cv2 at module level, so the
+caption data can be loaded and saved without the GUI. cv2 in particular is
+only imported inside the functions that decode video, so the dataset tools
+other than dedup run without OpenCV installed.
+"""
@@ -0,0 +1,353 @@
+import bisect
+import json
+import re
+from collections import namedtuple
+from pathlib import Path
+
+from .tags import TAG_SCHEMA_VERSION, convert_mask, legacy_prompt, split_legacy_prompt
+
+
+class CustomPathEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, Path):
+            # Convert the path to a string and replace forward slashes with backslashes for Windows compatibility
+            return str(obj.resolve()).replace("/", "\\")
+        return super().default(obj)
+
+
+def dict_to_object(dct):
+    if "video_path" in dct:
+        dct["video_path"] = Path(dct["video_path"])
+
+    if "frame_index" in dct:
+        try:
+            dct["frame_index"] = int(dct["frame_index"])
+        except ValueError:
+            pass
+
+    if "prompt" in dct:
+        if not isinstance(dct["prompt"], dict):
+            dct["prompt"] = {"prompt": dct["prompt"]}
+
+    return dct
+
+
+# One caption applied to every frame from start_frame to end_frame (both inclusive, 1-based).
+# tags is the bit mask of the ticked options (see tags.py); prompt is the typed text alone.
+CaptionRange = namedtuple("CaptionRange", ["start_frame", "end_frame", "prompt", "tags"], defaults=(0,))
+
+
+class CaptionRanges:
+    """The captions of one video, stored as sorted, non-overlapping frame spans.
+
+    Frame lookups bisect on the span starts, so memory and lookup cost depend on
+    the number of distinct captions rather than on the length of the video.
+    Neighbouring spans with the same caption are merged as they are written.
+    """
+
+    def __init__(self, ranges=()):
+        self._starts = []
+        self._ranges = []
+        for caption_range in ranges:
+            self.assign(*caption_range)
+
+    @classmethod
+    def from_frames(cls, frame_prompts):
+        """Build ranges from a {frame_index: prompt} mapping (the old per-frame layout).
+
+        The values may also be (prompt, tags) pairs.
+        """
+        ranges = cls()
+        run = None
+        for frame_index, caption in sorted(frame_prompts.items()):
+            if not isinstance(caption, tuple):
+                caption = (caption,)
+            if run is not None and run[1] + 1 == frame_index and run[2] == caption:
+                run[1] = frame_index
+                continue
+            if run is not None:
+                ranges.append(CaptionRange(run[0], run[1], *run[2]))
+            run = [frame_index, frame_index, caption]
+        if run is not None:
+            ranges.append(CaptionRange(run[0], run[1], *run[2]))
+        return ranges
+
+    def __len__(self):
+        return len(self._ranges)
+
+    def __iter__(self):
+        return iter(self._ranges)
+
+    def __eq__(self, other):
+        if not isinstance(other, CaptionRanges):
+            return NotImplemented
+        return self._ranges == other._ranges
+
+    def __repr__(self):
+        return f"CaptionRanges({self._ranges!r})"
+
+    def __contains__(self, frame_index):
+        return self._find(frame_index) is not None
+
+    def __getitem__(self, frame_index):
+        position = self._find(frame_index)
+        if position is None:
+            raise KeyError(frame_index)
+        return self._ranges[position].prompt
+
+    def get(self, frame_index, default=None):
+        position = self._find(frame_index)
+        if position is None:
+            return default
+        return self._ranges[position].prompt
+
+    def range_at(self, frame_index):
+        """The CaptionRange covering frame_index, or None."""
+        position = self._find(frame_index)
+        return self._ranges[position] if position is not None else None
+
+    @property
+    def num_frames(self):
+        # Highest frame that carries a caption
+        return self._ranges[-1].end_frame if self._ranges else 0
+
+    def copy(self):
+        ranges = CaptionRanges()
+        ranges._starts = list(self._starts)
+        ranges._ranges = list(self._ranges)
+        return ranges
+
+    def assign(self, start_frame, end_frame, prompt, *extra):
+        """Caption every frame in [start_frame, end_frame], replacing existing captions there."""
+        start_frame, end_frame = int(start_frame), int(end_frame)
+        if start_frame < 1 or end_frame < start_frame:
+            raise ValueError(f"Invalid frame range {start_frame}-{end_frame}")
+
+        first, last = self._overlapping(start_frame, end_frame)
+        replacement = []
+        if first < last and self._ranges[first].start_frame < start_frame:
+            replacement.append(self._ranges[first]._replace(end_frame=start_frame - 1))
+        replacement.append(CaptionRange(start_frame, end_frame, prompt, *extra))
+        if first < last and self._ranges[last - 1].end_frame > end_frame:
+            replacement.append(self._ranges[last - 1]._replace(start_frame=end_frame + 1))
+
+        self._ranges[first:last] = replacement
+        self._starts[first:last] = [r.start_frame for r in replacement]
+        # Walk right to left so merging does not shift the positions still to be checked
+        for position in range(first + len(replacement), first - 1, -1):
+            self._merge_neighbours(position)
+
+    def fill(self, start_frame, end_frame, prompt, *extra):
+        """Caption the frames in [start_frame, end_frame] that have no caption yet."""
+        start_frame, end_frame = int(start_frame), int(end_frame)
+        if end_frame < start_frame:
+            return
+        first, last = self._overlapping(start_frame, end_frame)
+        gaps = []
+        next_free = start_frame
+        for caption_range in self._ranges[first:last]:
+            if caption_range.start_frame > next_free:
+                gaps.append((next_free, caption_range.start_frame - 1))
+            next_free = caption_range.end_frame + 1
+        if next_free <= end_frame:
+            gaps.append((next_free, end_frame))
+        for gap_start, gap_end in gaps:
+            self.assign(gap_start, gap_end, prompt, *extra)
+
+    def _find(self, frame_index):
+        position = bisect.bisect_right(self._starts, frame_index) - 1
+        if position >= 0 and self._ranges[position].end_frame >= frame_index:
+            return position
+        return None
+
+    def _overlapping(self, start_frame, end_frame):
+        # Slice bounds of the ranges that share at least one frame with [start_frame, end_frame]
+        first = bisect.bisect_right(self._starts, start_frame) - 1
+        if first < 0 or self._ranges[first].end_frame < start_frame:
+            first += 1
+        last = bisect.bisect_right(self._starts, end_frame)
+        return first, max(first, last)
+
+    def _merge_neighbours(self, position):
+        # Merge the range at `position` with the one before it when they touch and carry the same caption
+        if position <= 0 or position >= len(self._ranges):
+            return
+        previous, current = self._ranges[position - 1], self._ranges[position]
+        if previous.end_frame + 1 == current.start_frame and previous[2:] == current[2:]:
+            self._ranges[position - 1] = previous._replace(end_frame=current.end_frame)
+            del self._ranges[position]
+            del self._starts[position]
+
+    def append(self, caption_range):
+        """Add a range after all existing ones; for readers that already get them in frame order."""
+        self._ranges.append(caption_range)
+        self._starts.append(caption_range.start_frame)
+
+
+def _prompt_text(prompt):
+    # dict_to_object wraps prompts in {"prompt": ...}, and older saves nested that more than once
+    while isinstance(prompt, dict):
+        prompt = prompt.get("prompt", "")
+    return prompt
+
+
+def _caption_from_json(caption, tag_schema):
+    # (prompt, tags) of a stored range or frame
+    prompt = _prompt_text(caption["prompt"])
+    if tag_schema is None:
+        return split_legacy_prompt(prompt)  # From before tag masks: the tags are part of the prompt text
+    return prompt, convert_mask(int(caption.get("tags", 0)), tag_schema)
+
+
+def ranges_from_item(item, tag_schema=None):
+    """Read the captions of one entry of the master JSON "data" list, in either layout.
+
+    tag_schema is the "tag_schema" version of the document the entry comes
+    from; None for documents written before tag masks, whose prompts end in
+    the tag names.
+    """
+    if "ranges" in item:
+        return CaptionRanges(
+            (r["start_frame"], r["end_frame"]) + _caption_from_json(r, tag_schema) for r in item["ranges"]
+        )
+
+    # Old layout: one {"frame_index", "prompt"} dict per frame. Saves made after a reload dropped
+    # the frame_index, but the list was always written in frame order, so fall back to the position.
+    frame_prompts = {}
+    for position, frame_data in enumerate(item.get("data", []), start=1):
+        if "prompt" in frame_data:
+            frame_index = frame_data.get("frame_index", position)
+            frame_prompts[int(frame_index)] = _caption_from_json(frame_data, tag_schema)
+    return CaptionRanges.from_frames(frame_prompts)
+
+
+def _range_to_json(caption_range, legacy_prompts):
+    if legacy_prompts:
+        # The old form: tags written out at the end of the prompt, no mask
+        return {"start_frame": caption_range.start_frame, "end_frame": caption_range.end_frame,
+                "prompt": legacy_prompt(caption_range.prompt, caption_range.tags)}
+    entry = {"start_frame": caption_range.start_frame, "end_frame": caption_range.end_frame,
+             "prompt": caption_range.prompt}
+    if caption_range.tags:
+        entry["tags"] = caption_range.tags
+    return entry
+
+
+def item_from_ranges(video_file, ranges, legacy_prompts=False):
+    return {
+        "video_path": str(video_file),  # Convert Path object to string
+        "num_frames": ranges.num_frames,
+        "ranges": [_range_to_json(r, legacy_prompts) for r in ranges],
+    }
+
+
+def prompts_to_document(prompts, name="My Videos", journal_seq=None, legacy_prompts=False):
+    document = {"name": name}
+    if not legacy_prompts:
+        document["tag_schema"] = TAG_SCHEMA_VERSION
+    if journal_seq is not None:
+        # Written ahead of "data" so a streaming reader knows it before the first video
+        document["journal_seq"] = journal_seq
+    document["data"] = [item_from_ranges(video_file, ranges, legacy_prompts) for video_file, ranges in prompts.items()]
+    return document
+
+
+def document_to_prompts(document):
+    prompts = {}
+    for item in document["data"]:
+        prompts[item["video_path"]] = ranges_from_item(item, document.get("tag_schema"))
+    return prompts
+
+
+_WHITESPACE = re.compile(r"\s*")
+
+
+class _StreamReader:
+    # Just enough of a JSON tokenizer to walk the top-level object of the master JSON;
+    # every value is decoded with json's raw_decode as soon as it is complete in the buffer.
+
+    def __init__(self, f, object_hook, chunk_size):
+        self.f = f
+        self.decoder = json.JSONDecoder(object_hook=object_hook)
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self, size=None):
+        if self.eof:
+            return False
+        # Drop what has been consumed before growing the buffer
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        chunk = self.f.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer += chunk
+        return True
+
+    def peek(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read_more():
+                raise json.JSONDecodeError("Unexpected end of file", self.buffer, self.pos)
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting {char!r}", self.buffer, self.pos)
+        self.pos += 1
+
+    def skip(self, char):
+        if self.peek() == char:
+            self.pos += 1
+            return True
+        return False
+
+    def value(self):
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number running into the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            size *= 2  # Grow the reads so one huge value is not re-parsed once per chunk
+            self.read_more(size)
+
+
+def iter_document(f, header=None, object_hook=None, chunk_size=1 << 20):
+    """Yield the entries of a master JSON's "data" list one at a time from the open text file f.
+
+    Only one entry is held in memory at a time. The other top-level fields
+    ("name", "journal_seq") are stored in header as they are read.
+    """
+    if header is None:
+        header = {}
+    reader = _StreamReader(f, object_hook, chunk_size)
+    reader.expect("{")
+    if reader.skip("}"):
+        return
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        if key == "data":
+            reader.expect("[")
+            if not reader.skip("]"):
+                while True:
+                    yield reader.value()
+                    if reader.skip("]"):
+                        break
+                    reader.expect(",")
+        else:
+            header[key] = reader.value()
+        if reader.skip("}"):
+            return
+        reader.expect(",")
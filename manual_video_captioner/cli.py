@@ -0,0 +1,405 @@
+"""Headless dataset tools: python -m manual_video_captioner export|export-shards|merge|validate|stats|search|dedup|queue|report.
+
+These read and write the same master JSON (with its journal), SQLite and
+sharded stores as the GUI, through the same code, and never import tkinter or vlc.
+Only dedup needs cv2, which it imports in its worker processes. Files are
+streamed one video at a time.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .captions import CaptionRanges, _prompt_text, iter_document
+from .dedup import DEFAULT_DISTANCE, DuplicateIndex
+from .filecache import cache_dir_for
+from .journal import write_document
+from .locking import LeaseManager, lease_dir_for, video_key
+from .search import CaptionIndex
+from .scanner import DEFAULT_EXTENSIONS, parse_extensions, scan_videos
+from .shards import FORMATS, export_shards
+from .tags import TAG_VOCABULARY, filter_masks, tag_counts, tags_to_mask
+from .telemetry import format_summary, read_log, summarize
+from .store import SQLITE_SUFFIXES, ShardedCaptionStore, SqliteCaptionStore, is_sharded, iter_captions
+
+BATCH_SIZE = 1000
+
+
+def _is_sqlite(path):
+    return os.path.splitext(path)[1].lower() in SQLITE_SUFFIXES
+
+
+def write_captions(path, items, legacy_prompts=False):
+    """Write (video_path, CaptionRanges) pairs to a master JSON, an SQLite store (.sqlite/.db) or a sharded
+    store (.shards).
+
+    legacy_prompts writes a master JSON with the tags at the end of the prompts instead of as masks.
+    """
+    if not _is_sqlite(path) and not is_sharded(path):
+        write_document(path, items, legacy_prompts=legacy_prompts)
+        return
+    if legacy_prompts:
+        raise ValueError("--legacy-prompts only applies to master JSON files")
+
+    store = SqliteCaptionStore(path) if _is_sqlite(path) else ShardedCaptionStore(path)
+    try:
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= BATCH_SIZE:
+                store.update_many(batch)
+                batch = []
+        store.update_many(batch)
+    finally:
+        store.close()
+
+
+def cmd_export(args):
+    try:
+        write_captions(args.destination, iter_captions(args.source), args.legacy_prompts)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    return 0
+
+
+def cmd_export_shards(args):
+    manifest = export_shards(iter_captions(args.source), args.out_dir, args.format, args.shard_size, args.collapse)
+    print(f"{manifest['records']} records in {len(manifest['shards'])} shard(s)", file=sys.stderr)
+    return 0
+
+
+def _read_annotator_file(path):
+    # Runs in a worker process: parse one file into compact tuples, which are cheap to send back
+    return [(str(video_path), list(ranges)) for video_path, ranges in iter_captions(path)]
+
+
+def _read_annotator_files(executor, sources, jobs):
+    # (source, videos) in the order given, so --prefer is deterministic. Unlike executor.map(), which
+    # submits every source at once, only as many files as there are workers are parsed ahead of the merge,
+    # so at most that many are held in memory however many sources there are.
+    pending = deque()
+    for source in sources:
+        pending.append((source, executor.submit(_read_annotator_file, source)))
+        if len(pending) >= jobs:
+            source, future = pending.popleft()
+            yield source, future.result()
+    while pending:
+        source, future = pending.popleft()
+        yield source, future.result()
+
+
+def cmd_merge(args):
+    # Videos are merged inside a temporary SQLite store, so memory stays bounded by the few files being
+    # parsed rather than by the whole dataset; the result is then streamed out to the destination.
+    jobs = args.jobs or os.cpu_count() or 1
+    workdir = tempfile.mkdtemp(prefix="caption-merge-")
+    merged = SqliteCaptionStore(os.path.join(workdir, "merged.sqlite"))
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for source, videos in _read_annotator_files(executor, args.sources, jobs):
+                batch = []
+                for video_path, caption_ranges in videos:
+                    ranges = merged.get(video_path) or CaptionRanges()
+                    for caption_range in caption_ranges:
+                        if args.prefer == "last":
+                            ranges.assign(*caption_range)
+                        else:
+                            ranges.fill(*caption_range)
+                    batch.append((video_path, ranges))
+                    if len(batch) >= BATCH_SIZE:
+                        merged.update_many(batch)
+                        batch = []
+                merged.update_many(batch)
+                print(f"merged {source}: {len(videos)} videos", file=sys.stderr)
+
+        write_captions(args.destination, merged.items())
+    finally:
+        merged.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+def _raw_ranges(item):
+    # The ranges exactly as written in the file, before CaptionRanges tidies them up; only the
+    # {"prompt": {"prompt": ...}} wrapping of older saves is undone, as when loading
+    if "ranges" in item:
+        return [(r.get("start_frame"), r.get("end_frame"), _prompt_text(r.get("prompt")), r.get("tags", 0))
+                for r in item["ranges"]]
+    # Old per-frame layout; entries without a frame_index count by position, as when loading
+    ranges = []
+    for position, frame in enumerate(item.get("data", []), start=1):
+        frame_index = frame.get("frame_index", position)
+        ranges.append((frame_index, frame_index, _prompt_text(frame.get("prompt")), frame.get("tags", 0)))
+    return ranges
+
+
+def _iter_raw(path):
+    # A master JSON that so far only has a journal is read through iter_captions too, which also
+    # reports a store that is not there at all
+    if _is_sqlite(path) or is_sharded(path) or not os.path.exists(path):
+        for video_path, ranges in iter_captions(path):
+            yield {"video_path": video_path, "ranges": [r._asdict() for r in ranges]}
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from iter_document(f)
+
+
+def validate_file(path):
+    """Yield a description of every problem found in a caption store."""
+    seen = set()
+    try:
+        for position, item in enumerate(_iter_raw(path)):
+            video_path = item.get("video_path")
+            where = f"{path}: entry {position} ({video_path})"
+            if not video_path:
+                yield f"{path}: entry {position} has no video_path"
+                continue
+            if video_path in seen:
+                yield f"{where}: video listed more than once"
+            seen.add(video_path)
+
+            previous_end = 0
+            for start_frame, end_frame, prompt, tags in _raw_ranges(item):
+                if not isinstance(start_frame, int) or not isinstance(end_frame, int):
+                    yield f"{where}: frame numbers missing or not integers: {start_frame!r}-{end_frame!r}"
+                    continue
+                if start_frame < 1 or end_frame < start_frame:
+                    yield f"{where}: invalid frame range {start_frame}-{end_frame}"
+                elif start_frame <= previous_end:
+                    yield f"{where}: frame range {start_frame}-{end_frame} overlaps or is out of order"
+                if not isinstance(tags, int) or tags < 0 or tags >> len(TAG_VOCABULARY):
+                    yield f"{where}: invalid tag mask {tags!r} for frames {start_frame}-{end_frame}"
+                    tags = 0
+                if (not isinstance(prompt, str) or not prompt.strip()) and not tags:
+                    yield f"{where}: empty prompt for frames {start_frame}-{end_frame}"
+                previous_end = max(previous_end, end_frame)
+    except json.JSONDecodeError as e:
+        yield f"{path}: invalid JSON: {e}"
+
+
+def cmd_validate(args):
+    problems = 0
+    for path in args.sources:
+        for problem in validate_file(path):
+            problems += 1
+            print(problem)
+    print(f"{problems} problem(s) found", file=sys.stderr)
+    return 1 if problems else 0
+
+
+def collect_stats(path, tags=()):
+    """Counts over a caption store; with tags, only over the caption ranges carrying all of them.
+
+    "tags" maps each tag to the number of captioned frames carrying it.
+    """
+    stats = {"videos": 0, "ranges": 0, "captioned_frames": 0, "distinct_prompts": 0}
+    # One row per caption range, so the tag counts and filters below run over flat arrays
+    video_ids, masks, frames, prompts = [], [], [], []
+    for video_id, (_, ranges) in enumerate(iter_captions(path)):
+        for caption_range in ranges:
+            video_ids.append(video_id)
+            masks.append(caption_range.tags)
+            frames.append(caption_range.end_frame - caption_range.start_frame + 1)
+            prompts.append(caption_range.prompt)
+
+    keep = filter_masks(masks, all_of=tags_to_mask(tags)) if tags else range(len(masks))
+    stats["videos"] = len({video_ids[i] for i in keep})
+    stats["ranges"] = len(keep)
+    stats["captioned_frames"] = sum(frames[i] for i in keep)
+    stats["distinct_prompts"] = len({prompts[i] for i in keep})
+    stats["tags"] = tag_counts([masks[i] for i in keep], [frames[i] for i in keep])
+    return stats
+
+
+def cmd_stats(args):
+    unknown = [tag for tag in args.tag if tag not in TAG_VOCABULARY]
+    if unknown:
+        print(f"Unknown tag(s): {', '.join(unknown)}", file=sys.stderr)
+        return 2
+    stats = collect_stats(args.source, args.tag)
+    if args.json:
+        print(json.dumps(stats))
+    else:
+        for key, value in stats.items():
+            if key != "tags":
+                print(f"{key}: {value}")
+        for tag, frames in sorted(stats["tags"].items(), key=lambda item: -item[1]):
+            print(f"tag {tag}: {frames} frames")
+    return 0
+
+
+def cmd_search(args):
+    index = CaptionIndex()
+    index.build(iter_captions(args.source))
+    matches = index.search(args.tag, args.text)
+    for video_path in matches:
+        print(video_path)
+    print(f"{len(matches)} of {len(index)} videos match", file=sys.stderr)
+    return 0
+
+
+def cmd_dedup(args):
+    cache_path = args.cache or os.path.join(cache_dir_for(args.store or args.directory), "cache.sqlite")
+    captioned = []
+    if args.store:
+        captioned = [str(video_path) for video_path, _ in iter_captions(args.store)
+                     if os.path.exists(str(video_path))]
+    video_files = [str(video_file) for video_file in scan_videos(args.directory, args.extensions)]
+
+    index = DuplicateIndex(cache_path, args.distance, workers=args.jobs)
+    try:
+        hashes = dict(index.hash_files(list(dict.fromkeys(captioned + video_files))))
+        # Captioned clips go in first, so copies of them are reported against the captioned one
+        for video_file in captioned:
+            if video_file in hashes:
+                index.add(video_file, hashes[video_file])
+        captioned_keys = set(captioned)
+        duplicates = 0
+        for video_file in video_files:
+            if video_file in captioned_keys or video_file not in hashes:
+                continue
+            original = index.find(video_file, hashes[video_file])
+            if original is None:
+                index.add(video_file, hashes[video_file])  # Later copies of it are reported against this one
+                continue
+            duplicates += 1
+            status = "captioned" if original in captioned_keys else "uncaptioned"
+            print(f"{video_file}\t{original}\t{status}")
+    finally:
+        index.close()
+    print(f"{duplicates} near-duplicate(s) among {len(video_files)} videos", file=sys.stderr)
+    return 0
+
+
+def cmd_queue(args):
+    # Clips still to do: neither captioned in the store nor claimed by an annotator right now
+    captioned = {video_key(video_path) for video_path, ranges in iter_captions(args.store) if len(ranges)}
+    leases = LeaseManager(args.leases or lease_dir_for(args.store)).active()
+    video_files = scan_videos(args.directory, args.extensions)
+    counts = {"captioned": 0, "claimed": 0, "unclaimed": 0}
+    for video_file in video_files:
+        key = video_key(video_file)
+        if key in captioned:
+            counts["captioned"] += 1
+        elif key in leases:
+            counts["claimed"] += 1
+            if args.all:
+                print(f"{video_file}\tclaimed by {leases[key]['annotator']}")
+        else:
+            counts["unclaimed"] += 1
+            print(f"{video_file}\tunclaimed" if args.all else video_file)
+    print(f"{len(video_files)} videos: " + ", ".join(f"{count} {status}" for status, count in counts.items()),
+          file=sys.stderr)
+    return 0
+
+
+def cmd_report(args):
+    # Several logs (e.g. one per annotator, or a rotated .1 next to the current one) are summarized together
+    spans = []
+    for log_path in args.logs:
+        spans.extend(read_log(log_path))
+    summary = summarize(spans, clips=args.clips)
+    if args.json:
+        print(json.dumps(summary, indent=4))
+    else:
+        print(format_summary(summary))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m manual_video_captioner",
+                                     description="Dataset tools for Manual Video Captioner caption stores. "
+                                                 "A store is a master JSON file, an SQLite database (.sqlite/.db) "
+                                                 "or a directory of per-video shards (.shards).")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Convert a caption store to another file or format.")
+    export.add_argument("source")
+    export.add_argument("destination")
+    export.add_argument("--legacy-prompts", action="store_true",
+                        help="Write the tags at the end of each prompt, as versions without tag masks expect.")
+    export.set_defaults(func=cmd_export)
+
+    export_shards_parser = commands.add_parser("export-shards",
+                                               help="Write training shards (JSONL or WebDataset tar) and a manifest.")
+    export_shards_parser.add_argument("source")
+    export_shards_parser.add_argument("out_dir")
+    export_shards_parser.add_argument("--format", choices=FORMATS, default="jsonl")
+    export_shards_parser.add_argument("--shard-size", type=int, default=10000, help="Records per shard.")
+    export_shards_parser.add_argument("--collapse", action="store_true",
+                                      help="One record per clip instead of one per frame.")
+    export_shards_parser.set_defaults(func=cmd_export_shards)
+
+    merge = commands.add_parser("merge", help="Merge the caption stores of several annotators into one.")
+    merge.add_argument("destination")
+    merge.add_argument("sources", nargs="+")
+    merge.add_argument("--prefer", choices=("first", "last"), default="first",
+                       help="Which source wins where captions overlap (default: the first one listed).")
+    merge.add_argument("--jobs", type=int, default=None, help="Worker processes used to parse the sources.")
+    merge.set_defaults(func=cmd_merge)
+
+    validate = commands.add_parser("validate", help="Check caption stores for broken or suspicious entries.")
+    validate.add_argument("sources", nargs="+")
+    validate.set_defaults(func=cmd_validate)
+
+    stats = commands.add_parser("stats", help="Count videos, caption ranges, captioned frames, prompts and tags.")
+    stats.add_argument("source")
+    stats.add_argument("--tag", action="append", default=[],
+                       help="Only count caption ranges carrying this tag; repeatable.")
+    stats.add_argument("--json", action="store_true", help="Print the numbers as one JSON object.")
+    stats.set_defaults(func=cmd_stats)
+
+    search = commands.add_parser("search", help="List the videos whose captions carry the given tags and words.")
+    search.add_argument("source")
+    search.add_argument("--tag", action="append", default=[], help="Checkbox tag the captions must carry; repeatable.")
+    search.add_argument("--text", help="Words that must all appear in the typed part of a caption.")
+    search.set_defaults(func=cmd_search)
+
+    dedup = commands.add_parser("dedup", help="List clips that are near-duplicates of a captioned or earlier clip.")
+    dedup.add_argument("directory", help="Directory to scan for videos.")
+    dedup.add_argument("--store", help="Caption store whose clips count as the originals.")
+    dedup.add_argument("--distance", type=int, default=DEFAULT_DISTANCE,
+                       help="Bits two keyframe hashes may differ in and still match (default: %(default)s).")
+    dedup.add_argument("--jobs", type=int, default=None, help="Worker processes used to hash the videos.")
+    dedup.add_argument("--cache", help="Where keyframe hashes are cached (default: cache.sqlite in this machine's "
+                                       "cache directory for the store, or for the directory without one).")
+    dedup.add_argument("--extensions", type=parse_extensions, default=DEFAULT_EXTENSIONS,
+                       help="Comma separated video file extensions to look for (default: .mp4,.avi).")
+    dedup.set_defaults(func=cmd_dedup)
+
+    queue = commands.add_parser("queue", help="List the clips under a directory that nobody has captioned or "
+                                              "claimed yet.")
+    queue.add_argument("store")
+    queue.add_argument("directory", help="Directory to scan for videos.")
+    queue.add_argument("--leases", help="Lease directory (default: leases next to the store).")
+    queue.add_argument("--all", action="store_true", help="Also list the clips claimed by an annotator.")
+    queue.add_argument("--extensions", type=parse_extensions, default=DEFAULT_EXTENSIONS,
+                       help="Comma separated video file extensions to look for (default: .mp4,.avi).")
+    queue.set_defaults(func=cmd_queue)
+
+    report = commands.add_parser("report", help="Summarize GUI telemetry logs: time per clip, clips per hour and "
+                                                "UI stalls.")
+    report.add_argument("logs", nargs="+", help="telemetry-<annotator>.log files from the GUI's cache directory for "
+                                                "the store: a <store name>-<hash> directory under "
+                                                "~/.cache/manual_video_captioner (or %%LOCALAPPDATA%%, "
+                                                "~/Library/Caches), unless --cache-dir was given.")
+    report.add_argument("--clips", type=int, default=10, help="Clips to break down, most recent last.")
+    report.add_argument("--json", action="store_true", help="Print the numbers as one JSON object.")
+    report.set_defaults(func=cmd_report)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except FileNotFoundError as e:
+        # A mistyped store path must not read as an empty store
+        print(f"{e.filename}: {e.strerror}", file=sys.stderr)
+        return 2
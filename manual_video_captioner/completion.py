@@ -0,0 +1,215 @@
+"""Which clips are done, and where each annotator left off.
+
+The caption stores key videos by the path they were captioned under, as a
+Path when read from a JSON document and as a str when just captioned, while
+the scanner hands out str paths. CompletionIndex matches a scanned clip to
+the key the store knows it by: first by its resolved, case-normalized path,
+then by the identity (device and inode) of its directory, which catches a
+tree reached through another drive letter or mount point with one stat per
+directory, and only then by the identity of the file itself, for hard links.
+"""
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .journal import write_atomically
+
+
+def resolved_path(path, _directories=None):
+    """normcase(realpath(path)), resolving each directory only once when given a dict to cache them in."""
+    directory, name = os.path.split(os.path.abspath(str(path)))
+    if _directories is None:
+        directory = os.path.realpath(directory)
+    else:
+        resolved = _directories.get(directory)
+        if resolved is None:
+            resolved = _directories[directory] = os.path.realpath(directory)
+        directory = resolved
+    return os.path.normcase(os.path.join(directory, name))
+
+
+def inode_of(path):
+    """(st_dev, st_ino) of path, or None when it cannot be stat'ed or the file system has no inode numbers."""
+    try:
+        st = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    if not st.st_ino:
+        return None
+    return st.st_dev, st.st_ino
+
+
+class CompletionIndex:
+    """The captioned clips of a store, for O(1) "already done?" checks on scanned paths.
+
+    Built once from the store's items when it is loaded and kept up to date
+    with mark_done()/discard() as clips are captioned or junked. The file
+    identities of the captioned clips are only collected the first time a
+    path does not match by name. Safe to share between threads.
+    """
+
+    def __init__(self):
+        self._keys = {}  # resolved path -> the store's key
+        self._done = set()  # resolved paths of the captioned clips
+        self._inodes = None  # (st_dev, st_ino) -> the store's key, built on first use
+        self._inode_cache = {}  # resolved path -> inode_of() of a scanned clip
+        self._directory_inodes = None  # (st_dev, st_ino) of a captioned clip's directory -> its resolved path
+        self._matched_directories = {}  # resolved directory of a scanned clip -> the captioned one it is, or None
+        self._directories = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._done)
+
+    def build(self, video_files):
+        """Index the captioned videos of a store, given as the keys the store has them under."""
+        with self._lock:
+            for video_file in video_files:
+                path = resolved_path(video_file, self._directories)
+                self._keys[path] = video_file
+                self._done.add(path)
+            self._inodes = None
+            self._directory_inodes = None
+            self._matched_directories.clear()
+
+    def canonical(self, video_file):
+        """The key the store has video_file under, or video_file itself when the store does not know it."""
+        with self._lock:
+            return self._canonical(video_file)
+
+    def canonical_many(self, video_files):
+        with self._lock:
+            return [self._canonical(video_file) for video_file in video_files]
+
+    def is_done(self, video_file):
+        with self._lock:
+            return resolved_path(self._canonical(video_file), self._directories) in self._done
+
+    def mark_done(self, video_file):
+        with self._lock:
+            path = resolved_path(video_file, self._directories)
+            self._keys.setdefault(path, video_file)
+            self._done.add(path)
+            if self._inodes is not None:
+                inode = inode_of(video_file)
+                if inode is not None:
+                    self._inodes.setdefault(inode, self._keys[path])
+            directory = os.path.dirname(path)
+            if self._directory_inodes is not None and directory not in self._directory_inodes.values():
+                inode = inode_of(directory)
+                if inode is not None:
+                    self._directory_inodes.setdefault(inode, directory)
+                    self._matched_directories.clear()  # Directories that matched nothing may match this one
+
+    def discard(self, video_file):
+        # A junked clip that comes back uncaptioned is to do again
+        with self._lock:
+            self._done.discard(resolved_path(video_file, self._directories))
+
+    def unfinished_first(self, video_files):
+        """video_files with the clips still to caption first, each part in its original order."""
+        with self._lock:
+            done = [resolved_path(video_file, self._directories) in self._done for video_file in video_files]
+        return ([video_file for video_file, finished in zip(video_files, done) if not finished]
+                + [video_file for video_file, finished in zip(video_files, done) if finished])
+
+    def _canonical(self, video_file):
+        path = resolved_path(video_file, self._directories)
+        key = self._keys.get(path)
+        if key is not None or not self._keys:
+            return video_file if key is None else key
+
+        directory, name = os.path.split(path)
+        if directory not in self._matched_directories:
+            self._matched_directories[directory] = self._captioned_directory(directory)
+        matched = self._matched_directories[directory]
+        if matched is not None:
+            # The same directory under another name: the clip's name there decides, no need to stat it
+            key = self._keys.get(os.path.join(matched, name)) if matched != directory else None
+            if key is None:
+                return video_file
+            self._keys[path] = key
+            return key
+
+        if self._inodes is None:
+            self._inodes = {}
+            for key in set(self._keys.values()):
+                inode = inode_of(key)
+                if inode is not None:
+                    self._inodes.setdefault(inode, key)
+        if path not in self._inode_cache:
+            self._inode_cache[path] = inode_of(video_file)
+        key = self._inodes.get(self._inode_cache[path])
+        if key is None:
+            return video_file
+        # Remembered under this name too, so the next lookup is a plain dictionary hit
+        self._keys[path] = key
+        return key
+
+    def _captioned_directory(self, directory):
+        # The resolved directory of captioned clips that is the same directory as this one, if any
+        if self._directory_inodes is None:
+            self._directory_inodes = {}
+            for resolved in {os.path.dirname(path) for path in self._keys}:
+                inode = inode_of(resolved)
+                if inode is not None:
+                    self._directory_inodes.setdefault(inode, resolved)
+        inode = inode_of(directory)
+        if inode is None:
+            return None
+        return self._directory_inodes.get(inode)
+
+
+class SessionFile:
+    """Last clip on screen per scanned directory, in a small JSON file, so a session can pick up where it ended.
+
+    save() only updates the state; the file is written on a background
+    thread, and positions saved while a write is waiting go out with it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.state = {"last_directory": None, "positions": {}}
+        self._lock = threading.Lock()
+        self._write_queued = False
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.state.update(json.load(f))
+        except (OSError, ValueError):
+            pass  # No earlier session, or a broken file: start from the top
+
+    @property
+    def last_directory(self):
+        return self.state["last_directory"]
+
+    def position(self, directory):
+        """The clip last shown from directory, if it is still there."""
+        video_file = self.state["positions"].get(os.path.normcase(os.path.abspath(directory)))
+        if video_file is None or not os.path.isfile(video_file):
+            return None
+        return video_file
+
+    def save(self, directory, video_file):
+        directory = os.path.abspath(directory)
+        with self._lock:
+            self.state["last_directory"] = directory
+            self.state["positions"][os.path.normcase(directory)] = str(video_file)
+            if self._write_queued:
+                return
+            self._write_queued = True
+        self._executor.submit(self._write)
+
+    def _write(self):
+        with self._lock:
+            self._write_queued = False
+            payload = json.dumps(self.state, indent=4).encode("utf-8")
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            write_atomically(self.path, payload)
+        except OSError:
+            pass  # Resuming is a convenience; the captions themselves are safe
+
+    def close(self):
+        self._executor.shutdown(wait=True)  # The last position is written before the app exits
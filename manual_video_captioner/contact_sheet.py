@@ -0,0 +1,105 @@
+"""Contact sheets: a grid of evenly spaced thumbnails per clip, generated ahead of the annotator."""
+import hashlib
+import os
+
+from .filecache import file_identity
+from .workers import ClipJobs
+
+THUMBNAILS = 12
+COLUMNS = 4
+THUMB_WIDTH = 160
+
+
+def build_contact_sheet(media_path, out_path, count=THUMBNAILS, columns=COLUMNS, thumb_width=THUMB_WIDTH):
+    """Write a PNG grid of count frames spread over the video to out_path. Returns False if it cannot be read."""
+    import cv2
+    import numpy as np
+
+    cap = cv2.VideoCapture(str(media_path))
+    if not cap.isOpened():
+        return False
+    thumbs = []
+    try:
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if frame_count <= 0:
+            return False
+        for position in np.linspace(0, frame_count - 1, count).astype(int):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(position))
+            ok, frame = cap.read()
+            if not ok:
+                continue
+            height = max(1, frame.shape[0] * thumb_width // frame.shape[1])
+            thumbs.append(cv2.resize(frame, (thumb_width, height), interpolation=cv2.INTER_AREA))
+    except cv2.error:
+        return False
+    finally:
+        cap.release()
+    if not thumbs:
+        return False
+
+    thumb_height = thumbs[0].shape[0]
+    rows = (len(thumbs) + columns - 1) // columns
+    sheet = np.zeros((rows * thumb_height, columns * thumb_width, 3), dtype=np.uint8)
+    for i, thumb in enumerate(thumbs):
+        row, column = divmod(i, columns)
+        thumb = thumb[:thumb_height]  # Frames of a clip can differ in height after a mid-stream resolution change
+        sheet[row * thumb_height:row * thumb_height + thumb.shape[0],
+              column * thumb_width:(column + 1) * thumb_width] = thumb
+
+    # Written next to the final name and moved into place, so a half-written sheet is never shown
+    tmp_path = out_path + ".tmp.png"
+    if not cv2.imwrite(tmp_path, sheet):
+        return False
+    os.replace(tmp_path, out_path)
+    return True
+
+
+class ContactSheetCache:
+    """PNG contact sheets on disk, one per file version, built in worker processes.
+
+    A sheet's file name is a hash of the video's file identity and the sheet
+    layout, so a changed or replaced video simply gets a new sheet.
+    """
+
+    def __init__(self, cache_dir, workers=2, count=THUMBNAILS, columns=COLUMNS, thumb_width=THUMB_WIDTH):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.params = (count, columns, thumb_width)
+        self._jobs = ClipJobs(workers)
+
+    def path_for(self, media_path):
+        identity = file_identity(media_path)
+        key = hashlib.sha1(repr((identity, self.params)).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + ".png")
+
+    def sheet(self, media_path):
+        """Path of the finished sheet for media_path as it is now, or None."""
+        try:
+            path = self.path_for(media_path)
+        except OSError:
+            return None
+        return path if os.path.exists(path) else None
+
+    def pending(self, media_path):
+        return self._jobs.pending(media_path)
+
+    def schedule(self, media_paths):
+        """Build the missing sheets of media_paths in the background, dropping queued work for other clips."""
+        if self.workers <= 0:
+            return
+        wanted = [str(media_path) for media_path in media_paths]
+        self._jobs.retain(wanted)
+        for key in wanted:
+            if key in self._jobs:
+                continue
+            try:
+                out_path = self.path_for(key)
+            except OSError:
+                continue
+            if os.path.exists(out_path):
+                continue
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._jobs.submit(key, build_contact_sheet, key, out_path, *self.params)
+
+    def shutdown(self):
+        self._jobs.shutdown()
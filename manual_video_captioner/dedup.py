@@ -0,0 +1,195 @@
+"""Find re-encoded or trimmed copies of the same clip with perceptual hashes of sampled keyframes."""
+import os
+import threading
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from .filecache import FileCache
+from .workers import process_pool
+
+KEYFRAMES = 8
+# How often a hashing pass waiting on its workers checks whether it was asked to stop
+STOP_POLL_SECONDS = 0.2
+# Keyframes whose 64-bit hashes differ in at most this many bits count as the same picture
+DEFAULT_DISTANCE = 6
+# Share of a clip's keyframes that must match another clip for it to count as a near-duplicate
+MIN_MATCH = 0.5
+# Frames this flat (black, white, title cards) hash alike in every clip, so they are left out
+_MIN_CONTRAST = 2.0
+
+
+def dhash(frames):
+    """64-bit difference hashes of a (frames, 8, 9) uint8 array of tiny greyscale frames."""
+    import numpy as np
+
+    # Each bit says whether a pixel is brighter than its right-hand neighbour
+    bits = frames[:, :, 1:] > frames[:, :, :-1]
+    packed = np.packbits(bits.reshape(len(frames), 64), axis=1)
+    return [int(value) for value in packed.view(">u8").ravel()]
+
+
+def keyframe_hashes(media_path, count=KEYFRAMES):
+    """dHashes of count frames spread evenly over a video, or None when it cannot be read."""
+    import cv2
+    import numpy as np
+
+    cap = cv2.VideoCapture(str(media_path))
+    if not cap.isOpened():
+        return None
+    try:
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if frame_count <= 0:
+            return None
+        # Skip the very first and last frames, which are often black or part of a fade
+        positions = sorted({int(p) for p in np.linspace(0, frame_count - 1, count + 2)[1:-1]})
+        frames = []
+        for position in positions:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, position)
+            ok, frame = cap.read()
+            if not ok:
+                continue
+            grey = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if grey.std() < _MIN_CONTRAST:
+                continue
+            frames.append(cv2.resize(grey, (9, 8), interpolation=cv2.INTER_AREA))
+    except cv2.error:
+        return None
+    finally:
+        cap.release()
+    return dhash(np.stack(frames)) if frames else []
+
+
+def _path_key(media_path):
+    return os.path.normcase(os.path.abspath(str(media_path)))
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """Metric tree over 64-bit hashes; finds every hash within a Hamming radius without a full scan."""
+
+    def __init__(self):
+        self._root = None  # [hash, items, {distance: child}]
+        self._lock = threading.Lock()
+
+    def add(self, hash_value, item):
+        with self._lock:
+            if self._root is None:
+                self._root = [hash_value, [item], {}]
+                return
+            node = self._root
+            while True:
+                distance = hamming(hash_value, node[0])
+                if distance == 0:
+                    node[1].append(item)
+                    return
+                child = node[2].get(distance)
+                if child is None:
+                    node[2][distance] = [hash_value, [item], {}]
+                    return
+                node = child
+
+    def search(self, hash_value, radius):
+        """(distance, item) for every item stored under a hash within radius of hash_value."""
+        with self._lock:
+            found = []
+            stack = [self._root] if self._root is not None else []
+            while stack:
+                node = stack.pop()
+                distance = hamming(hash_value, node[0])
+                if distance <= radius:
+                    found.extend((distance, item) for item in node[1])
+                # By the triangle inequality only these children can hold matches
+                for child_distance, child in node[2].items():
+                    if distance - radius <= child_distance <= distance + radius:
+                        stack.append(child)
+        return found
+
+
+class DuplicateIndex:
+    """Keyframe hashes of many clips, cached per file and indexed for near-duplicate lookups."""
+
+    def __init__(self, db_path, distance=DEFAULT_DISTANCE, min_match=MIN_MATCH, workers=None):
+        self.distance = distance
+        self.min_match = min_match
+        self.workers = workers
+        self._cache = FileCache(db_path, "keyframe_hashes")
+        self._tree = BKTree()
+        self._indexed = set()
+
+    def hash_files(self, media_paths, stop=None):
+        """Yield (path, hashes) for media_paths, hashing the ones not cached yet in worker processes.
+
+        Results are cached as each clip finishes, so an interrupted pass picks
+        up where it stopped. Unreadable files are skipped. Cached clips come
+        first; the rest follow in the order they finish. Setting the stop
+        event ends the pass without waiting for the clips being hashed.
+        """
+        missing = []
+        for media_path in media_paths:
+            if stop is not None and stop.is_set():
+                return
+            hashes = self._cache.peek(media_path)
+            if hashes is None:
+                missing.append(media_path)
+            else:
+                yield media_path, hashes
+        if not missing:
+            return
+
+        executor = process_pool(self.workers)
+        try:
+            futures = {executor.submit(keyframe_hashes, str(media_path)): media_path for media_path in missing}
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=None if stop is None else STOP_POLL_SECONDS,
+                                     return_when=FIRST_COMPLETED)
+                for future in done:
+                    if stop is not None and stop.is_set():
+                        return
+                    media_path = futures[future]
+                    hashes = future.result()
+                    if hashes is None:
+                        continue
+                    try:
+                        self._cache.put(media_path, hashes)
+                    except OSError:
+                        continue  # Gone in the meantime
+                    yield media_path, hashes
+                if stop is not None and stop.is_set():
+                    return
+        finally:
+            # Also reached when the caller stops early; whatever has not started is dropped
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def hashes(self, media_path):
+        """Cached keyframe hashes of media_path, or None when it has not been hashed as it is now."""
+        return self._cache.peek(media_path)
+
+    def add(self, media_path, hashes):
+        key = _path_key(media_path)
+        if key in self._indexed:
+            return
+        self._indexed.add(key)
+        for hash_value in set(hashes):
+            self._tree.add(hash_value, media_path)
+
+    def find(self, media_path, hashes):
+        """The indexed clip that shares at least min_match of the keyframes in hashes, or None."""
+        if not hashes:
+            return None
+        key = _path_key(media_path)
+        matches = Counter()
+        for hash_value in set(hashes):
+            # Count each other clip at most once per keyframe
+            matches.update({other for _, other in self._tree.search(hash_value, self.distance)
+                            if _path_key(other) != key})
+        if not matches:
+            return None
+        other, count = matches.most_common(1)[0]
+        return other if count >= self.min_match * len(set(hashes)) else None
+
+    def close(self):
+        self._cache.close()
@@ -0,0 +1,181 @@
+import os
+import queue
+import shutil
+import threading
+import time
+
+_CHUNK = 8 * 1024 * 1024
+
+
+class FileOperation:
+    """A queued move of one file; the worker updates it as it goes."""
+
+    QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+    def __init__(self, source, destination_dir, undo_of=None):
+        self.source = str(source)
+        self.destination_dir = str(destination_dir)
+        self.destination = None  # Picked by the worker, so names never clash between queued moves
+        self.copied = False  # The file is complete at destination and only the source is left to remove
+        self.undo_of = undo_of
+        self.state = self.QUEUED
+        self.bytes_done = 0
+        self.bytes_total = 0
+        self.attempts = 0
+        self.error = None
+
+    @property
+    def progress(self):
+        return self.bytes_done / self.bytes_total if self.bytes_total else 0.0
+
+    def __repr__(self):
+        return f"FileOperation({self.source!r} -> {self.destination_dir!r}, {self.state})"
+
+
+def unique_destination(destination_dir, filename):
+    """A path in destination_dir for filename, adding _1, _2, ... to the stem when the name is taken."""
+    taken = set(os.listdir(destination_dir))
+    stem, suffix = os.path.splitext(filename)
+    candidate = filename
+    file_number = 1
+    while candidate in taken:
+        candidate = f"{stem}_{file_number}{suffix}"
+        file_number += 1
+    return os.path.join(destination_dir, candidate)
+
+
+class FileOperationQueue:
+    """Moves files on a background thread so the UI never waits for them.
+
+    The queue is bounded: move() raises queue.Full when `maxsize` moves are
+    already waiting. A move that fails with an OSError (for example a file
+    still held open by the player on Windows) is retried with a growing
+    delay, to the same destination; once the copy is complete only removing
+    the source is retried. on_update(operation, state) is called from the worker thread
+    every time the operation's state or progress changes; the final call,
+    with DONE or FAILED, is made exactly once.
+    """
+
+    def __init__(self, maxsize=32, retries=3, retry_delay=0.5, on_update=None):
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.on_update = on_update
+        self._queue = queue.Queue(maxsize)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="file-ops", daemon=True)
+        self._worker.start()
+
+    @property
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def move(self, source, destination_dir):
+        return self._submit(FileOperation(source, destination_dir))
+
+    def undo(self, operation):
+        """Queue a move that puts a finished move's file back where it came from."""
+        if operation.state != FileOperation.DONE:
+            raise ValueError(f"Only finished moves can be undone: {operation!r}")
+        undo = FileOperation(operation.destination, os.path.dirname(operation.source), undo_of=operation)
+        undo.destination = operation.source
+        return self._submit(undo)
+
+    def shutdown(self, wait=True):
+        self._queue.put(None)
+        if wait:
+            self._worker.join()
+
+    def _submit(self, operation):
+        with self._lock:
+            self._pending += 1
+        try:
+            self._queue.put_nowait(operation)
+        except queue.Full:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return operation
+
+    def _run(self):
+        while True:
+            operation = self._queue.get()
+            if operation is None:
+                return
+            try:
+                self._execute(operation)
+            finally:
+                # Report before lowering the count, so pending == 0 means every final update is out
+                self._notify(operation)
+                with self._lock:
+                    self._pending -= 1
+
+    def _execute(self, operation):
+        operation.state = FileOperation.RUNNING
+        while True:
+            operation.attempts += 1
+            try:
+                self._move(operation)
+                operation.state = FileOperation.DONE
+                return
+            except OSError as e:
+                if operation.attempts > self.retries:
+                    operation.state = FileOperation.FAILED
+                    operation.error = e
+                    self._discard_copy(operation)
+                    return
+                time.sleep(self.retry_delay * operation.attempts)
+
+    def _move(self, operation):
+        if operation.copied:
+            os.remove(operation.source)  # A retry after the copy went through but the source was held open
+            return
+        os.makedirs(operation.destination_dir, exist_ok=True)
+        if operation.destination is None:
+            operation.destination = unique_destination(operation.destination_dir, os.path.basename(operation.source))
+        elif os.path.exists(operation.destination):
+            raise FileExistsError(f"{operation.destination} already exists")
+
+        operation.bytes_total = os.path.getsize(operation.source)
+        self._notify(operation)
+        if os.stat(operation.source).st_dev == os.stat(operation.destination_dir).st_dev:
+            os.rename(operation.source, operation.destination)  # Same drive: just a rename
+        else:
+            self._copy_then_remove(operation)
+        operation.bytes_done = operation.bytes_total
+
+    def _copy_then_remove(self, operation):
+        # Copy into a temporary name first so a half copied file never looks like a finished one
+        partial = operation.destination + ".partial"
+        try:
+            with open(operation.source, "rb") as src, open(partial, "wb") as dst:
+                operation.bytes_done = 0
+                while True:
+                    chunk = src.read(_CHUNK)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    operation.bytes_done += len(chunk)
+                    self._notify(operation)
+            shutil.copystat(operation.source, partial)
+            os.replace(partial, operation.destination)
+        except OSError:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        operation.copied = True
+        os.remove(operation.source)
+
+    def _discard_copy(self, operation):
+        # The source could not be removed in the end, so it stays where it was and the copy goes
+        if operation.copied:
+            try:
+                os.remove(operation.destination)
+                operation.copied = False
+            except OSError:
+                pass
+
+    def _notify(self, operation):
+        if self.on_update is not None:
+            self.on_update(operation, operation.state)
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+
+
+def user_cache_dir():
+    """This machine's cache directory for the app: under %LOCALAPPDATA%, ~/Library/Caches or $XDG_CACHE_HOME."""
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), "AppData", "Local")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "manual_video_captioner")
+
+
+def cache_dir_for(store_path, root=None):
+    """Where the caches that go with store_path live on this machine (under root, or user_cache_dir()).
+
+    Caches are SQLite databases in WAL mode, which does not work on network
+    file systems, so they stay local even when the store is on a shared drive.
+    """
+    store_path = os.path.abspath(str(store_path)).rstrip("/\\")
+    digest = hashlib.sha1(os.path.normcase(store_path).encode("utf-8")).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(store_path))[0] or "store"
+    return os.path.join(root or user_cache_dir(), f"{name}-{digest}")
+
+
+def file_identity(path):
+    """(absolute path, size, mtime in ns): changes whenever the file is replaced or rewritten."""
+    st = os.stat(path)
+    return os.path.abspath(str(path)), st.st_size, st.st_mtime_ns
+
+
+class FileCache:
+    """Per-file results kept in an in-process LRU and in an SQLite table on disk.
+
+    Entries are keyed by file_identity(), so a cached value is ignored (and
+    recomputed) as soon as the file's size or modification time changes.
+    Values must be JSON serialisable. Safe to share between threads. A
+    database error counts as a miss, and a value that cannot be written is
+    only kept in memory.
+    """
+
+    def __init__(self, db_path, table, maxsize=1024):
+        self.table = table
+        self.maxsize = maxsize
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                " path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, value TEXT NOT NULL)"
+            )
+
+    def peek(self, path):
+        """Cached value for path, or None when there is none for the file as it is now."""
+        try:
+            identity = file_identity(path)
+        except OSError:
+            return None
+        return self._lookup(identity)
+
+    def get(self, path, compute):
+        """Cached value for path, calling compute(path) and caching the result on a miss."""
+        identity = file_identity(path)
+        value = self._lookup(identity)
+        if value is None:
+            value = compute(path)
+            if value is not None:
+                self._store(identity, value)
+        return value
+
+    def put(self, path, value):
+        self._store(file_identity(path), value)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _lookup(self, identity):
+        with self._lock:
+            if identity in self._lru:
+                self._lru.move_to_end(identity)
+                return self._lru[identity]
+            try:
+                row = self._conn.execute(
+                    f"SELECT value FROM {self.table} WHERE path = ? AND size = ? AND mtime_ns = ?", identity
+                ).fetchone()
+            except sqlite3.Error:
+                return None
+            if row is None:
+                return None
+            value = json.loads(row[0])
+            self._remember(identity, value)
+            return value
+
+    def _store(self, identity, value):
+        with self._lock:
+            try:
+                with self._conn:
+                    # Keyed by path alone, so the entry for an older version of the file is replaced
+                    self._conn.execute(
+                        f"INSERT OR REPLACE INTO {self.table} (path, size, mtime_ns, value) VALUES (?, ?, ?, ?)",
+                        identity + (json.dumps(value),),
+                    )
+            except sqlite3.Error:
+                pass
+            self._remember(identity, value)
+
+    def _remember(self, identity, value):
+        self._lru[identity] = value
+        self._lru.move_to_end(identity)
+        while len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
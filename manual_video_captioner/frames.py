@@ -0,0 +1,151 @@
+"""Decoded frames for the frame stepper and scrubber."""
+import threading
+from collections import OrderedDict
+
+# Displayed frames are scaled down to this width, which is plenty to judge where a caption starts
+FRAME_WIDTH = 320
+# Roughly 170 frames at 320x180
+MAX_CACHE_BYTES = 32 * 1024 * 1024
+# How far before the requested frame decoding starts after a seek. cv2 lands on the keyframe before that
+# position and decodes forward, and every frame on the way is cached, so stepping back within a GOP is free.
+GOP_FRAMES = 30
+# Frames decoded past the requested one while nothing else is asked for
+READAHEAD_FRAMES = 30
+
+
+class FrameCache:
+    """LRU of encoded frames bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes=MAX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, frame_index):
+        with self._lock:
+            return frame_index in self._frames
+
+    def get(self, frame_index):
+        with self._lock:
+            data = self._frames.get(frame_index)
+            if data is not None:
+                self._frames.move_to_end(frame_index)
+            return data
+
+    def put(self, frame_index, data):
+        with self._lock:
+            old = self._frames.pop(frame_index, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self._frames[frame_index] = data
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes and len(self._frames) > 1:
+                _, evicted = self._frames.popitem(last=False)
+                self.bytes -= len(evicted)
+
+
+def encode_ppm(frame, width=FRAME_WIDTH):
+    """Scale a BGR frame down to width and encode it as binary PPM, which Tk's PhotoImage reads directly."""
+    import cv2
+
+    height = max(1, frame.shape[0] * width // frame.shape[1])
+    small = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    rgb = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+    return b"P6 %d %d 255\n" % (width, height) + rgb.tobytes()
+
+
+class FrameDecoder:
+    """Decodes the frames of one video on a background thread.
+
+    show() returns a cached frame straight away, or asks the thread for it and
+    returns None; the thread calls on_frame(frame_index, ppm_bytes) once the
+    frame is decoded. Only the latest request matters, so dragging a
+    scrubber does not queue up work. Frame numbers are 1-based.
+    """
+
+    def __init__(self, media_path, on_frame, width=FRAME_WIDTH, max_bytes=MAX_CACHE_BYTES, gop=GOP_FRAMES,
+                 readahead=READAHEAD_FRAMES):
+        self.media_path = media_path
+        self.on_frame = on_frame
+        self.width = width
+        self.gop = gop
+        self.readahead = readahead
+        self.cache = FrameCache(max_bytes)
+        self._target = None
+        self._closed = False
+        self._wakeup = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="frame-decoder")
+        self._thread.start()
+
+    def show(self, frame_index):
+        data = self.cache.get(frame_index)
+        with self._wakeup:
+            # Also wakes the thread when the frame is cached, so it reads ahead from there
+            self._target = frame_index
+            self._wakeup.notify()
+        return data
+
+    def close(self):
+        with self._wakeup:
+            self._closed = True
+            self._wakeup.notify()
+
+    def _next_target(self):
+        with self._wakeup:
+            while self._target is None and not self._closed:
+                self._wakeup.wait()
+            if self._closed:
+                return None
+            target, self._target = self._target, None
+            return target
+
+    def _run(self):
+        import cv2
+
+        cap = cv2.VideoCapture(str(self.media_path))
+        try:
+            if not cap.isOpened():
+                return
+            next_frame = 1  # The frame the next cap.read() returns
+            while True:
+                target = self._next_target()
+                if target is None:
+                    return
+                if target < next_frame and target in self.cache:
+                    continue  # Stepping back over frames decoded on the way here
+                if not (next_frame <= target <= next_frame + self.gop):
+                    next_frame = max(1, target - self.gop)
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, next_frame - 1)
+                next_frame = self._decode_forward(cap, next_frame, target)
+        except cv2.error:
+            pass  # The frame view just stays empty for a clip OpenCV cannot read
+        finally:
+            cap.release()
+
+    def _decode_forward(self, cap, next_frame, target):
+        # Decode from next_frame through target plus the read-ahead, unless a request for a frame outside
+        # that window comes in. Returns the position the capture ends up at.
+        while next_frame <= target + self.readahead:
+            with self._wakeup:
+                if self._closed:
+                    return next_frame
+                if self._target is not None:
+                    if not (next_frame <= self._target <= next_frame + self.gop):
+                        return next_frame  # Leave it to _run, which seeks
+                    target = self._target  # Still ahead of us: keep going towards it
+                    self._target = None
+            if next_frame in self.cache:
+                ok = cap.grab()  # Already have it; skip the colour conversion and scaling
+            else:
+                ok, frame = cap.read()
+                if ok:
+                    self.cache.put(next_frame, encode_ppm(frame, self.width))
+            if not ok:
+                return next_frame  # Past the end of the clip
+            if next_frame == target:
+                data = self.cache.get(target)
+                if data is not None:
+                    self.on_frame(target, data)
+            next_frame += 1
+        return next_frame
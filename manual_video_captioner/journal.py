@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+
+from .captions import CaptionRanges, CustomPathEncoder, item_from_ranges, prompts_to_document
+from .tags import TAG_SCHEMA_VERSION, convert_mask, split_legacy_prompt
+
+
+class CaptionJournal:
+    """Append-only log of the caption edits made since the master JSON was last written.
+
+    Every record is one JSON line carrying an increasing "seq" number and is
+    fsynced before append() returns, so a crash loses at most the edit being
+    written. The master JSON remembers the last seq it contains; replay()
+    hands back everything after that.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.last_seq = 0
+        self.pending = 0  # Records not yet folded into the master JSON
+        self._file = None
+        self._lock = threading.Lock()
+
+    def replay(self, after_seq=0, repair=True):
+        """Return the records newer than after_seq, ignoring a torn last line left by a crash.
+
+        With repair, the torn line is also cut off the file so new records start on a clean line.
+        """
+        records = []
+        self.last_seq = max(self.last_seq, after_seq)
+        if not os.path.exists(self.path):
+            return records
+
+        with self._lock, open(self.path, "rb+" if repair else "rb") as f:
+            valid_end = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                valid_end += len(line)
+                self.last_seq = max(self.last_seq, record["seq"])
+                if record["seq"] > after_seq:
+                    records.append(record)
+            if repair:
+                f.truncate(valid_end)
+
+        self.pending = len(records)
+        return records
+
+    def append(self, record):
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = open(self.path, "ab")
+            self.last_seq += 1
+            record = dict(record, seq=self.last_seq)
+            self._file.write(json.dumps(record, cls=CustomPathEncoder).encode("utf-8") + b"\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.pending += 1
+            return self.last_seq
+
+    def discard_through(self, seq):
+        """Drop the records up to and including seq once they are safely in the master JSON."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if not os.path.exists(self.path):
+                return
+
+            with open(self.path, "rb") as f:
+                kept = [line for line in f if json.loads(line)["seq"] > seq]
+            write_atomically(self.path, b"".join(kept))
+            self.pending = len(kept)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def journal_path_for(master_json_path):
+    return os.path.splitext(master_json_path)[0] + ".journal"
+
+
+def journal_record(op, video_file, start_frame, end_frame, prompt, tags=0):
+    return {
+        "op": op,
+        "video_path": str(video_file),
+        "start_frame": start_frame,
+        "end_frame": end_frame,
+        "prompt": prompt,
+        "tags": tags,
+        "tag_schema": TAG_SCHEMA_VERSION,
+    }
+
+
+def apply_record(prompts, record, video_file=None):
+    """Apply one journal record to a {video_path: CaptionRanges} mapping."""
+    if video_file is None:
+        video_file = record["video_path"]
+    if video_file not in prompts:
+        prompts[video_file] = CaptionRanges()
+    ranges = prompts[video_file]
+    if record.get("tags") is None:
+        # Journals written before tag masks kept the tags in the prompt text
+        prompt, tags = split_legacy_prompt(record["prompt"])
+    else:
+        prompt, tags = record["prompt"], convert_mask(record["tags"], record.get("tag_schema", TAG_SCHEMA_VERSION))
+    if record["op"] == "assign":
+        ranges.assign(record["start_frame"], record["end_frame"], prompt, tags)
+    elif record["op"] == "fill":
+        ranges.fill(record["start_frame"], record["end_frame"], prompt, tags)
+    else:
+        raise ValueError(f"Unknown journal operation {record['op']!r}")
+
+
+def write_snapshot(path, document):
+    """Write the master JSON through a temporary file so a crash never leaves it half written."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    write_atomically(path, json.dumps(document, indent=4, cls=CustomPathEncoder).encode("utf-8"))
+
+
+def write_document(path, items, name="My Videos", journal_seq=None, legacy_prompts=False):
+    """Stream (video_path, CaptionRanges) pairs into a master JSON, one video per line.
+
+    With legacy_prompts the tags are written into the prompt text, for tools that predate tag masks.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    header = prompts_to_document({}, name, journal_seq, legacy_prompts)
+    del header["data"]
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(header)[:-1] + (', ' if header else '') + '"data": [\n')
+        for count, (video_file, ranges) in enumerate(items):
+            if count:
+                f.write(",\n")
+            f.write(json.dumps(item_from_ranges(video_file, ranges, legacy_prompts), cls=CustomPathEncoder))
+        f.write("\n]}\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_atomically(path, payload):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,201 @@
+"""Advisory file locks and clip leases, so several annotators can work on one tree over a shared drive.
+
+Locks are taken with flock() on POSIX and msvcrt.locking() on Windows. Both
+are advisory: they only keep out other processes that take the same lock,
+which every caption store in this package does before writing.
+
+A lease is a small JSON file per clip, created with O_EXCL so only one
+annotator can create it. It names its holder and expires unless renewed,
+so a clip claimed by an annotator whose machine crashed frees up again.
+"""
+import getpass
+import hashlib
+import json
+import os
+import socket
+import time
+
+from .journal import write_atomically
+
+# A lease left behind by a crashed session blocks its clip for at most this long
+LEASE_SECONDS = 15 * 60
+
+
+class FileLock:
+    """Exclusive advisory lock on path (created if missing), usable as a context manager.
+
+    acquire() waits up to timeout seconds (forever for None, not at all for
+    0) and raises TimeoutError if the lock is still held elsewhere.
+    """
+
+    def __init__(self, path, timeout=10.0, poll=0.05):
+        self.path = path
+        self.timeout = timeout
+        self.poll = poll
+        self._file = None
+
+    def acquire(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        f = open(self.path, "a+b")
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            try:
+                _lock(f)
+                break
+            except OSError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    f.close()
+                    raise TimeoutError(f"{self.path} is locked by another process")
+                time.sleep(self.poll)
+        self._file = f
+        return self
+
+    def release(self):
+        if self._file is not None:
+            try:
+                _unlock(self._file)
+            finally:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+if os.name == "nt":
+    import msvcrt
+
+    def _lock(f):
+        # msvcrt locks byte ranges; everyone locks the first byte
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+
+    def _unlock(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _unlock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def lease_dir_for(store_path):
+    """Where the leases of the clips captioned into store_path live: a "leases" directory next to it."""
+    return os.path.join(os.path.dirname(os.path.abspath(store_path)), "leases")
+
+
+def default_annotator():
+    return f"{getpass.getuser()}@{socket.gethostname()}"
+
+
+def video_key(video_file):
+    """The form of a video path used to name its shard and lease files."""
+    return os.path.normcase(os.path.abspath(str(video_file)))
+
+
+def key_digest(video_file):
+    return hashlib.sha1(video_key(video_file).encode("utf-8")).hexdigest()
+
+
+class LeaseManager:
+    """Claims clips for one annotator through lease files in lease_dir.
+
+    claim() succeeds when the clip is unclaimed, already ours, or its lease
+    has expired; it also renews our own lease. Taking over an expired lease,
+    renewing and releasing happen under a lock on the lease directory, so
+    two annotators never both end up holding a clip.
+    """
+
+    def __init__(self, lease_dir, annotator=None, lease_seconds=LEASE_SECONDS):
+        self.lease_dir = lease_dir
+        self.annotator = annotator or default_annotator()
+        self.lease_seconds = lease_seconds
+        self._dir_lock_path = os.path.join(lease_dir, ".lock")
+
+    def path_for(self, video_file):
+        return os.path.join(self.lease_dir, key_digest(video_file) + ".lease")
+
+    def _lease(self, video_file):
+        return {
+            "video_path": str(video_file),
+            "annotator": self.annotator,
+            "pid": os.getpid(),
+            "expires": time.time() + self.lease_seconds,
+        }
+
+    def _read(self, path):
+        # None when there is no lease. A lease being written right now reads as empty; it is treated as a
+        # fresh claim by someone else that expires lease_seconds after the file was created.
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            mtime = os.path.getmtime(path)
+        except FileNotFoundError:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            return {"video_path": None, "annotator": None, "expires": mtime + self.lease_seconds}
+
+    def holder(self, video_file):
+        """The lease on video_file if someone holds it and it has not expired, else None."""
+        lease = self._read(self.path_for(video_file))
+        if lease is None or lease["expires"] <= time.time():
+            return None
+        return lease
+
+    def claim(self, video_file):
+        """Claim or renew video_file. Returns None on success, else the lease of the annotator holding it."""
+        path = self.path_for(video_file)
+        os.makedirs(self.lease_dir, exist_ok=True)
+        payload = json.dumps(self._lease(video_file)).encode("utf-8")
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            return None
+
+        with FileLock(self._dir_lock_path):
+            lease = self._read(path)
+            if lease is not None and lease["annotator"] != self.annotator and lease["expires"] > time.time():
+                return lease
+            write_atomically(path, payload)
+        return None
+
+    def release(self, video_file):
+        path = self.path_for(video_file)
+        with FileLock(self._dir_lock_path):
+            lease = self._read(path)
+            if lease is not None and lease["annotator"] == self.annotator:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def active(self):
+        """{video_key: lease} of every unexpired lease, for the work queue view."""
+        leases = {}
+        now = time.time()
+        try:
+            entries = list(os.scandir(self.lease_dir))
+        except FileNotFoundError:
+            return leases
+        for entry in entries:
+            if not entry.name.endswith(".lease"):
+                continue
+            lease = self._read(entry.path)
+            if lease is not None and lease["video_path"] is not None and lease["expires"] > now:
+                leases[video_key(lease["video_path"])] = lease
+        return leases
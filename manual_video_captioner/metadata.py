@@ -0,0 +1,60 @@
+from collections import namedtuple
+
+from .filecache import FileCache
+
+VideoMetadata = namedtuple("VideoMetadata", ["frame_count", "fps", "width", "height", "duration", "codec"])
+
+EMPTY_METADATA = VideoMetadata(0, 0.0, 0, 0, 0.0, "")
+
+
+def probe_video(media_path):
+    """Read everything we need about a video with a single cv2.VideoCapture open."""
+    import cv2
+
+    try:
+        cap = cv2.VideoCapture(str(media_path))
+        if not cap.isOpened():
+            return EMPTY_METADATA
+        try:
+            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            fps = float(cap.get(cv2.CAP_PROP_FPS))
+            fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+            return VideoMetadata(
+                frame_count=frame_count,
+                fps=fps,
+                width=int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                height=int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                duration=frame_count / fps if fps > 0 else 0.0,
+                codec="".join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4)).strip("\x00"),
+            )
+        finally:
+            cap.release()
+    except cv2.error:
+        return EMPTY_METADATA
+
+
+class MetadataCache:
+    """One probe per file: results are kept in memory and on disk until the file changes."""
+
+    def __init__(self, db_path, maxsize=1024):
+        self._cache = FileCache(db_path, "video_metadata", maxsize)
+
+    def get(self, media_path):
+        try:
+            value = self._cache.get(media_path, self._probe)
+        except OSError:
+            return EMPTY_METADATA
+        return VideoMetadata(*value) if value is not None else EMPTY_METADATA
+
+    def peek(self, media_path):
+        value = self._cache.peek(media_path)
+        return VideoMetadata(*value) if value is not None else None
+
+    def close(self):
+        self._cache.close()
+
+    @staticmethod
+    def _probe(media_path):
+        metadata = probe_video(media_path)
+        # Failed probes are not cached, the file may just not be readable yet
+        return list(metadata) if metadata != EMPTY_METADATA else None
@@ -0,0 +1,68 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# How much of the start of each upcoming clip is read into the OS page cache
+WARM_BYTES = 32 * 1024 * 1024
+_CHUNK = 1024 * 1024
+
+
+def warm_page_cache(media_path, nbytes=WARM_BYTES):
+    """Pull the start of a file into the OS page cache and hint the kernel about the rest."""
+    with open(media_path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        remaining = nbytes
+        while remaining > 0:
+            chunk = f.read(min(_CHUNK, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+
+
+class Prefetcher:
+    """Read-ahead for the next clips while the current one is being captioned.
+
+    For each scheduled clip a worker warms the page cache, fills the metadata
+    cache and builds the player's media object with media_factory, so moving
+    on to the clip only has to hand that object to the player.
+    """
+
+    def __init__(self, depth=3, metadata_cache=None, media_factory=None, warm_bytes=WARM_BYTES):
+        self.depth = depth
+        self.metadata_cache = metadata_cache
+        self.media_factory = media_factory
+        self.warm_bytes = warm_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max(1, depth), thread_name_prefix="prefetch")
+        self._jobs = {}  # str(path) -> Future resolving to the prepared media (or None)
+
+    def schedule(self, media_paths):
+        """Prefetch the first `depth` of media_paths and forget about anything else."""
+        wanted = [str(media_path) for media_path in list(media_paths)[:self.depth]]
+        for key in list(self._jobs):
+            if key not in wanted:
+                self._jobs.pop(key).cancel()
+        for key in wanted:
+            if key not in self._jobs:
+                self._jobs[key] = self._executor.submit(self._prepare, key)
+
+    def take_media(self, media_path):
+        """The prepared media for media_path if it is ready, else None. Never blocks."""
+        future = self._jobs.pop(str(media_path), None)
+        if future is None or not future.done() or future.cancelled() or future.exception() is not None:
+            return None
+        return future.result()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._jobs.clear()
+
+    def _prepare(self, media_path):
+        try:
+            warm_page_cache(media_path, self.warm_bytes)
+        except OSError:
+            return None  # Gone or unreadable, the UI reports it when the clip comes up
+        if self.metadata_cache is not None:
+            self.metadata_cache.get(media_path)
+        if self.media_factory is not None:
+            return self.media_factory(media_path)
+        return None
@@ -0,0 +1,48 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupProfile:
+    """Wall-clock breakdown of the application start, shown with --profile-startup.
+
+    Phases can be recorded from any thread. Once every phase named in
+    `expect` has been recorded, the report is written to `output` (nothing is
+    written when output is None).
+    """
+
+    def __init__(self, started=None, expect=(), output=None):
+        self.started = time.perf_counter() if started is None else started
+        self.phases = {}
+        self.output = output
+        self._pending = set(expect)
+        self._reported = False
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.phases[name] = seconds
+            self._pending.discard(name)
+            ready = not self._pending and not self._reported and self.output is not None
+            if ready:
+                self._reported = True
+        if ready:
+            print(self.report(), file=self.output)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def mark(self, name):
+        """Record how long after the start of the process `name` happened."""
+        self.add(name, time.perf_counter() - self.started)
+
+    def report(self):
+        lines = ["Startup profile:"]
+        for name, seconds in self.phases.items():
+            lines.append(f"  {name:<28}{seconds * 1000:9.1f} ms")
+        return "\n".join(lines)
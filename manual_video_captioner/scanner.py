@@ -0,0 +1,134 @@
+import json
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .journal import write_atomically
+
+DEFAULT_EXTENSIONS = (".mp4", ".avi")
+DEFAULT_WORKERS = 8
+
+
+def parse_extensions(text):
+    """Turn "mp4, .AVI,mov" into (".mp4", ".avi", ".mov")."""
+    extensions = []
+    for extension in text.split(","):
+        extension = extension.strip().lower()
+        if extension:
+            extensions.append(extension if extension.startswith(".") else "." + extension)
+    return tuple(extensions)
+
+
+class DirectoryIndex:
+    """The video files and subdirectories of every scanned directory, saved between runs.
+
+    A directory's mtime changes whenever an entry is added, removed or renamed
+    in it, so while the mtime is unchanged its saved listing is used instead
+    of listing it again. The index is tied to an extension list and starts
+    over when that list changes.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, extensions=DEFAULT_EXTENSIONS):
+        self.path = path
+        self.extensions = sorted(extensions)
+        self._dirs = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION and data.get("extensions") == self.extensions:
+                self._dirs = data["dirs"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def get(self, directory, mtime_ns):
+        with self._lock:
+            entry = self._dirs.get(directory)
+        if entry is not None and entry["mtime_ns"] == mtime_ns:
+            return entry["files"], entry["dirs"]
+        return None
+
+    def put(self, directory, mtime_ns, files, dirs):
+        with self._lock:
+            self._dirs[directory] = {"mtime_ns": mtime_ns, "files": files, "dirs": dirs}
+
+    def prune(self, root, seen):
+        """Forget directories under root that the last scan of root no longer reached."""
+        prefix = os.path.join(root, "")
+        with self._lock:
+            for directory in [d for d in self._dirs if (d == root or d.startswith(prefix)) and d not in seen]:
+                del self._dirs[directory]
+
+    def save(self):
+        with self._lock:
+            payload = json.dumps({"version": self.VERSION, "extensions": self.extensions, "dirs": self._dirs})
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        write_atomically(self.path, payload.encode("utf-8"))
+
+
+def _list_directory(directory, extensions, index):
+    try:
+        mtime_ns = os.stat(directory).st_mtime_ns
+    except OSError:
+        return [], []
+    if index is not None:
+        cached = index.get(directory, mtime_ns)
+        if cached is not None:
+            return cached
+
+    files, dirs = [], []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.name)
+                    elif entry.name.lower().endswith(extensions):
+                        files.append(entry.name)
+                except OSError:
+                    pass
+    except OSError:
+        return [], []  # Unreadable directories are skipped, like os.walk does
+
+    if index is not None:
+        index.put(directory, mtime_ns, files, dirs)
+    return files, dirs
+
+
+def scan_videos(directory, extensions=DEFAULT_EXTENSIONS, index=None, workers=DEFAULT_WORKERS, on_found=None):
+    """All video files below directory, sorted by path.
+
+    Subdirectories are listed in parallel on `workers` threads. on_found, if
+    given, is called from the calling thread with each directory's videos as
+    soon as they are found, before the scan is finished. With an index,
+    directories that have not changed since the last scan are not listed again.
+    """
+    directory = os.path.abspath(directory)
+    extensions = tuple(extension.lower() for extension in extensions)
+    video_files = []
+    seen = set()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan") as executor:
+        pending = {executor.submit(_list_directory, directory, extensions, index): directory}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                parent = pending.pop(future)
+                seen.add(parent)
+                files, dirs = future.result()
+                for name in dirs:
+                    subdirectory = os.path.join(parent, name)
+                    pending[executor.submit(_list_directory, subdirectory, extensions, index)] = subdirectory
+                if files:
+                    found = [os.path.join(parent, name) for name in files]
+                    video_files.extend(found)
+                    if on_found is not None:
+                        on_found(sorted(found))
+
+    if index is not None:
+        index.prune(directory, seen)
+        index.save()
+    video_files.sort()
+    return video_files
@@ -0,0 +1,155 @@
+"""Scene-cut detection, so a clip with several shots can be captioned one shot at a time."""
+from .filecache import FileCache
+from .workers import ClipJobs
+
+# A frame starts a new scene when its change score against the previous frame is above this
+DEFAULT_THRESHOLD = 0.2
+# Shorter scenes are folded into the one before them, so flashes and fades do not split a shot
+MIN_SCENE_FRAMES = 15
+# Frames are compared at this width; cuts are obvious at thumbnail size and it keeps the arrays small
+DOWNSCALE_WIDTH = 64
+BATCH_SIZE = 64
+HISTOGRAM_BINS = 32
+
+
+def change_scores(frames, previous=None):
+    """Change score of every frame in a (frames, height, width) uint8 batch against the frame before it.
+
+    The score is the mean of the absolute pixel difference and the distance
+    between grey-level histograms, both scaled to [0, 1]. previous is the last
+    frame of the batch before; without it the first frame scores 0.
+    """
+    import numpy as np
+
+    if previous is not None:
+        frames = np.concatenate([previous[None], frames])
+    count = len(frames)
+    if count < 2:
+        return np.zeros(len(frames) - (previous is not None))
+
+    pixels = frames.astype(np.int16)
+    pixel_change = np.abs(pixels[1:] - pixels[:-1]).mean(axis=(1, 2)) / 255.0
+
+    # One bincount for the whole batch: every frame gets its own block of bins
+    shift = 8 - (HISTOGRAM_BINS.bit_length() - 1)
+    bins = (frames.reshape(count, -1) >> shift).astype(np.intp) + (np.arange(count) * HISTOGRAM_BINS)[:, None]
+    histograms = np.bincount(bins.ravel(), minlength=count * HISTOGRAM_BINS).reshape(count, HISTOGRAM_BINS)
+    histograms = histograms / frames[0].size
+    histogram_change = 0.5 * np.abs(histograms[1:] - histograms[:-1]).sum(axis=1)
+
+    scores = (pixel_change + histogram_change) / 2
+    if previous is None:
+        scores = np.concatenate([[0.0], scores])
+    return scores
+
+
+def scenes_from_cuts(cuts, frame_count, min_scene_frames=MIN_SCENE_FRAMES):
+    """[start_frame, end_frame] pairs (1-based, inclusive) covering frames 1..frame_count, split at cuts."""
+    scenes = []
+    start_frame = 1
+    for cut in cuts:
+        if cut - start_frame >= min_scene_frames:
+            scenes.append([start_frame, cut - 1])
+            start_frame = cut
+    if start_frame <= frame_count:
+        if scenes and frame_count - start_frame + 1 < min_scene_frames:
+            scenes[-1][1] = frame_count
+        else:
+            scenes.append([start_frame, frame_count])
+    return scenes
+
+
+def detect_scenes(media_path, threshold=DEFAULT_THRESHOLD, min_scene_frames=MIN_SCENE_FRAMES,
+                  width=DOWNSCALE_WIDTH, batch_size=BATCH_SIZE):
+    """Decode a video once and return its scenes, or None when it cannot be read."""
+    import cv2
+    import numpy as np
+
+    cap = cv2.VideoCapture(str(media_path))
+    if not cap.isOpened():
+        return None
+    cuts = []
+    frame_count = 0
+    previous = None
+    batch = []
+    try:
+        while True:
+            ok, frame = cap.read()
+            if ok:
+                height = max(1, frame.shape[0] * width // frame.shape[1])
+                small = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+                batch.append(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY))
+            if batch and (len(batch) >= batch_size or not ok):
+                frames = np.stack(batch)
+                first_frame = frame_count + 1
+                for offset in np.flatnonzero(change_scores(frames, previous) > threshold):
+                    cuts.append(first_frame + int(offset))
+                previous = frames[-1]
+                frame_count += len(batch)
+                batch = []
+            if not ok:
+                break
+    except cv2.error:
+        return None
+    finally:
+        cap.release()
+    return scenes_from_cuts(cuts, frame_count, min_scene_frames)
+
+
+def _detect_in_worker(media_path, params):
+    # Runs in a worker process
+    return detect_scenes(media_path, *params)
+
+
+class SceneDetector:
+    """Runs detect_scenes in worker processes ahead of the annotator and caches the results per file.
+
+    Results are kept in a FileCache together with the detection settings, so
+    a clip is only decoded again when the file or the settings change.
+    """
+
+    def __init__(self, db_path, workers=2, threshold=DEFAULT_THRESHOLD, min_scene_frames=MIN_SCENE_FRAMES,
+                 width=DOWNSCALE_WIDTH):
+        self.workers = workers
+        self.params = [threshold, min_scene_frames, width]
+        self._cache = FileCache(db_path, "scenes")
+        self._jobs = ClipJobs(workers)
+        self._closed = False
+
+    def scenes(self, media_path):
+        """Cached scenes of media_path, or None when they are not known (yet)."""
+        value = self._cache.peek(media_path)
+        if value is None or value["params"] != self.params:
+            return None
+        return value["scenes"]
+
+    def pending(self, media_path):
+        return self._jobs.pending(media_path)
+
+    def schedule(self, media_paths):
+        """Detect scenes for media_paths in the background, dropping queued work for any other clip."""
+        if self.workers <= 0:
+            return
+        wanted = [str(media_path) for media_path in media_paths]
+        self._jobs.retain(wanted)
+        for key in wanted:
+            if key in self._jobs or self.scenes(key) is not None:
+                continue
+            future = self._jobs.submit(key, _detect_in_worker, key, self.params)
+            future.add_done_callback(lambda future, key=key: self._finished(key, future))
+
+    def shutdown(self):
+        self._closed = True
+        self._jobs.shutdown()
+        self._cache.close()
+
+    def _finished(self, media_path, future):
+        if self._closed or future.cancelled() or future.exception() is not None:
+            return
+        scenes = future.result()
+        if scenes is None:
+            return  # Unreadable, not cached so it is tried again next time
+        try:
+            self._cache.put(media_path, {"params": self.params, "scenes": scenes})
+        except OSError:
+            pass  # The file went away in the meantime
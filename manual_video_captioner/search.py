@@ -0,0 +1,270 @@
+"""Autocomplete and search over the captions already written."""
+import heapq
+import re
+import threading
+from collections import Counter, defaultdict
+
+from .tags import mask_to_tags
+
+_WORD = re.compile(r"\w+")
+
+COMPLETIONS = 8
+# Texts a trie node keeps in a plain set before it gets a child node per next character
+BUCKET_SIZE = 32
+
+
+def tokenize(text):
+    return [word.lower() for word in _WORD.findall(text)]
+
+
+class _TrieNode:
+    __slots__ = ("children", "texts", "top", "stale", "bucket")
+
+    def __init__(self, bucket=None):
+        self.children = {}
+        self.texts = set()  # Texts ending at this node (several when they differ only in case)
+        self.top = []  # Up to COMPLETIONS (-count, text) pairs for everything below this node, best first
+        self.stale = False
+        # Instead of children, top and texts: every text below this node, while there are only a few
+        self.bucket = bucket
+
+
+class PrefixTrie:
+    """Case-insensitive prefix lookup of strings ranked by how often they are used.
+
+    Inner nodes cache the best completions below them, so a lookup only walks
+    the typed prefix. A node with few texts below it keeps them in a bucket
+    that is scanned when asked, and is split into children once it holds more
+    than twice BUCKET_SIZE, so there is no node for every character of every
+    text. Raising a count updates the caches on the way down; lowering one
+    marks them stale, and a stale node is recomputed the next time it is
+    asked. build() fills a new trie in one bottom-up pass.
+    """
+
+    def __init__(self, limit=COMPLETIONS):
+        self.limit = limit
+        self.counts = Counter()
+        self._root = _TrieNode(bucket=set())
+
+    def add(self, text, delta=1):
+        count = self.counts[text] + delta
+        if count > 0:
+            self.counts[text] = count
+        else:
+            del self.counts[text]
+
+        key = text.lower()
+        node = self._root
+        depth = 0
+        inner = []
+        while node.bucket is None:
+            inner.append(node)
+            if depth == len(key):
+                break
+            child = node.children.get(key[depth])
+            if child is None:
+                child = node.children[key[depth]] = _TrieNode(bucket=set())
+            node = child
+            depth += 1
+        texts = node.texts if node.bucket is None else node.bucket
+        if count > 0:
+            texts.add(text)
+        else:
+            texts.discard(text)
+        for below in inner:
+            if delta < 0:
+                if any(entry[1] == text for entry in below.top):
+                    below.stale = True
+            elif not below.stale:
+                self._promote(below, text, count)
+        if node.bucket is not None and len(node.bucket) > 2 * BUCKET_SIZE:
+            self._fill(node, depth, node.bucket)
+
+    def build(self, counts):
+        """Replace the contents with the texts and counts of a Counter."""
+        self.counts = Counter({text: count for text, count in counts.items() if count > 0})
+        self._root = _TrieNode(bucket=set(self.counts))
+        if len(self.counts) > BUCKET_SIZE:
+            self._fill(self._root, 0, list(self.counts))
+
+    def complete(self, prefix, limit=None):
+        key = prefix.lower()
+        node = self._root
+        depth = 0
+        while node.bucket is None and depth < len(key):
+            node = node.children.get(key[depth])
+            if node is None:
+                return []
+            depth += 1
+        limit = limit or self.limit
+        if node.bucket is not None:
+            return [text for _, text in self._best([text for text in node.bucket if text.lower().startswith(key)],
+                                                    limit)]
+        if node.stale:
+            self._refresh(node)
+        return [text for _, text in node.top[:limit]]
+
+    def _fill(self, node, depth, texts):
+        # Turn node into an inner node over texts (all sharing its depth-character prefix), splitting the
+        # children that get more than BUCKET_SIZE texts in turn; each cache is filled once, bottom up
+        node.bucket = None
+        node.children = {}
+        node.texts = set()
+        groups = {}
+        for text in texts:
+            key = text.lower()
+            if len(key) == depth:
+                node.texts.add(text)
+            else:
+                groups.setdefault(key[depth], []).append(text)
+        for char, group in groups.items():
+            child = node.children[char] = _TrieNode(bucket=set(group))
+            if len(group) > BUCKET_SIZE:
+                self._fill(child, depth + 1, group)
+        self._refresh(node)
+
+    def _best(self, texts, limit=None):
+        return heapq.nsmallest(limit or self.limit, ((-self.counts[text], text) for text in texts))
+
+    def _promote(self, node, text, count):
+        top = [entry for entry in node.top if entry[1] != text]
+        top.append((-count, text))
+        top.sort()
+        node.top = top[:self.limit]
+
+    def _refresh(self, node):
+        candidates = [(-self.counts[text], text) for text in node.texts]
+        for child in node.children.values():
+            if child.bucket is not None:
+                candidates.extend(self._best(child.bucket))
+            else:
+                if child.stale:
+                    self._refresh(child)
+                candidates.extend(child.top)
+        candidates.sort()
+        node.top = candidates[:self.limit]
+        node.stale = False
+
+
+def prompt_terms(prompts):
+    """(words, tags, completion texts) of a set of (prompt, tag mask) captions."""
+    words, tags, texts = set(), set(), set()
+    for text, mask in prompts:
+        words.update(tokenize(text))
+        tags.update(mask_to_tags(mask))
+        if text.strip():
+            texts.add(text.strip())
+    return words, tags, texts
+
+
+class CaptionIndex:
+    """Inverted index from prompt words and tags to videos, plus a prefix trie for autocomplete.
+
+    update() replaces what one video contributes, so the index follows every
+    submit without being rebuilt. Safe to share between threads.
+    """
+
+    def __init__(self):
+        self._words = defaultdict(set)  # word -> video keys
+        self._tags = defaultdict(set)  # tag -> video keys
+        self._prompts = {}  # video key -> set of the video's distinct (prompt, tags) captions
+        self.trie = PrefixTrie()
+        self._lock = threading.Lock()
+        self._pending = None  # video key -> prompts of the updates made while build() runs
+
+    def __len__(self):
+        return len(self._prompts)
+
+    def update(self, video_file, ranges):
+        """Index the current captions of one video, replacing what was indexed for it before."""
+        key = str(video_file)
+        prompts = {(caption_range.prompt, caption_range.tags) for caption_range in ranges}
+        with self._lock:
+            if self._pending is not None:
+                self._pending[key] = prompts
+                return
+            self._replace(key, prompts)
+
+    def build(self, items):
+        """Index many (video, ranges) at once, replacing everything indexed before.
+
+        The new index is put together without holding the lock, so complete()
+        and search() keep answering from the old one meanwhile; update()s made
+        in the meantime are applied once it is in place.
+        """
+        with self._lock:
+            self._pending = {}
+        prompts_by_key = {}
+        for video_file, ranges in items:
+            prompts = {(caption_range.prompt, caption_range.tags) for caption_range in ranges}
+            if prompts:
+                prompts_by_key[str(video_file)] = prompts
+            else:
+                prompts_by_key.pop(str(video_file), None)
+        words, tags, counts = defaultdict(set), defaultdict(set), Counter()
+        for key, prompts in prompts_by_key.items():
+            video_words, video_tags, texts = prompt_terms(prompts)
+            for word in video_words:
+                words[word].add(key)
+            for tag in video_tags:
+                tags[tag].add(key)
+            counts.update(texts | video_tags)
+        trie = PrefixTrie(self.trie.limit)
+        trie.build(counts)
+        with self._lock:
+            self._words, self._tags, self._prompts, self.trie = words, tags, prompts_by_key, trie
+            pending, self._pending = self._pending, None
+            for key, prompts in pending.items():
+                self._replace(key, prompts)
+
+    def complete(self, prefix, limit=None):
+        """Prompts and tags starting with prefix, most used first."""
+        if not prefix.strip():
+            return []
+        with self._lock:
+            return self.trie.complete(prefix, limit)
+
+    def search(self, tags=(), text=None):
+        """Keys of the videos carrying all of tags and all words of text, sorted."""
+        with self._lock:
+            sets = [self._tags.get(tag, set()) for tag in tags]
+            sets += [self._words.get(word, set()) for word in tokenize(text or "")]
+            if not sets:
+                return sorted(self._prompts)
+            sets.sort(key=len)  # Intersect starting from the rarest term
+            result = set(sets[0])
+            for videos in sets[1:]:
+                result &= videos
+                if not result:
+                    break
+            return sorted(result)
+
+    def _replace(self, key, prompts):
+        old_prompts = self._prompts.pop(key, set())
+        if prompts == old_prompts:
+            self._prompts[key] = prompts
+            return
+        self._remove(key, old_prompts)
+        if prompts:
+            self._prompts[key] = prompts
+            self._add(key, prompts)
+
+    def _add(self, key, prompts):
+        words, tags, texts = prompt_terms(prompts)
+        for word in words:
+            self._words[word].add(key)
+        for tag in tags:
+            self._tags[tag].add(key)
+        # Completions count the videos a text or tag is used in
+        for completion in texts | tags:
+            self.trie.add(completion)
+
+    def _remove(self, key, prompts):
+        words, tags, texts = prompt_terms(prompts)
+        for postings, terms in ((self._words, words), (self._tags, tags)):
+            for term in terms:
+                postings[term].discard(key)
+                if not postings[term]:
+                    del postings[term]
+        for completion in texts | tags:
+            self.trie.add(completion, -1)
@@ -0,0 +1,133 @@
+"""Export captions as sharded JSONL or WebDataset-style tar files for training loaders."""
+import hashlib
+import io
+import json
+import os
+import tarfile
+
+from .tags import legacy_prompt, mask_to_tags
+
+FORMATS = ("jsonl", "tar")
+
+
+class _HashingWriter:
+    # Counts and hashes the bytes on their way to the file, so shards never have to be read back
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+        self.bytes = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.bytes += len(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+def iter_records(items, collapse=False):
+    """Turn (video_path, CaptionRanges) pairs into training records.
+
+    By default there is one record per frame, like the old master JSON. With
+    collapse, each clip becomes one record: "prompt" is the caption covering
+    the most frames, and "ranges" lists them all. Prompts carry their tags
+    at the end as they always did; "tags" lists them separately as well.
+    """
+    for video_path, ranges in items:
+        video_path = str(video_path)
+        if collapse:
+            if not len(ranges):
+                continue
+            main = max(ranges, key=lambda r: r.end_frame - r.start_frame)
+            yield {
+                "video_path": video_path,
+                "num_frames": ranges.num_frames,
+                "prompt": legacy_prompt(main.prompt, main.tags),
+                "tags": mask_to_tags(main.tags),
+                "ranges": [{"start_frame": r.start_frame, "end_frame": r.end_frame,
+                            "prompt": legacy_prompt(r.prompt, r.tags), "tags": mask_to_tags(r.tags)}
+                           for r in ranges],
+            }
+        else:
+            for caption_range in ranges:
+                prompt = legacy_prompt(caption_range.prompt, caption_range.tags)
+                tags = mask_to_tags(caption_range.tags)
+                for frame_index in range(caption_range.start_frame, caption_range.end_frame + 1):
+                    yield {"video_path": video_path, "frame_index": frame_index, "prompt": prompt, "tags": tags}
+
+
+class _Shard:
+    def __init__(self, path, fmt):
+        self.name = os.path.basename(path)
+        self.fmt = fmt
+        self.records = 0
+        self._file = open(path, "wb")
+        self._writer = _HashingWriter(self._file)
+        self._tar = tarfile.open(fileobj=self._writer, mode="w|") if fmt == "tar" else None
+
+    def write(self, key, record):
+        payload = json.dumps(record, ensure_ascii=False).encode("utf-8")
+        if self._tar is None:
+            self._writer.write(payload + b"\n")
+        else:
+            # One WebDataset sample: <key>.json with the record and <key>.txt with the caption alone
+            self._add_member(f"{key}.json", payload)
+            self._add_member(f"{key}.txt", record["prompt"].encode("utf-8"))
+        self.records += 1
+
+    def _add_member(self, name, payload):
+        info = tarfile.TarInfo(name)
+        info.size = len(payload)
+        self._tar.addfile(info, io.BytesIO(payload))
+
+    def close(self):
+        if self._tar is not None:
+            self._tar.close()
+        self._file.close()
+        return {"name": self.name, "records": self.records, "bytes": self._writer.bytes,
+                "sha256": self._writer.sha256.hexdigest()}
+
+
+def export_shards(items, out_dir, fmt="jsonl", shard_size=10000, collapse=False, prefix="captions"):
+    """Stream (video_path, CaptionRanges) pairs into shards of shard_size records plus a manifest.json.
+
+    Only the shard being written is open, so memory does not depend on the
+    size of the dataset. Returns the manifest.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown shard format {fmt!r}, expected one of {FORMATS}")
+    os.makedirs(out_dir, exist_ok=True)
+
+    shards = []
+    shard = None
+    records = 0
+    videos = [0]
+
+    def counted(items):
+        for item in items:
+            videos[0] += 1
+            yield item
+
+    for record in iter_records(counted(items), collapse):
+        if shard is None or shard.records >= shard_size:
+            if shard is not None:
+                shards.append(shard.close())
+            shard = _Shard(os.path.join(out_dir, f"{prefix}-{len(shards):05d}.{fmt}"), fmt)
+        shard.write(f"{records:09d}", record)
+        records += 1
+    if shard is not None:
+        shards.append(shard.close())
+
+    manifest = {
+        "format": fmt,
+        "collapse": collapse,
+        "shard_size": shard_size,
+        "videos": videos[0],
+        "records": records,
+        "shards": shards,
+    }
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4)
+    return manifest
@@ -0,0 +1,627 @@
+import errno
+import itertools
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .captions import (
+    CaptionRange,
+    CaptionRanges,
+    dict_to_object,
+    document_to_prompts,
+    iter_document,
+    prompts_to_document,
+    ranges_from_item,
+)
+from .journal import (
+    CaptionJournal,
+    apply_record,
+    journal_path_for,
+    journal_record,
+    write_document,
+    write_snapshot,
+)
+from .locking import FileLock, key_digest
+from .search import COMPLETIONS, prompt_terms
+from .tags import TAG_SCHEMA_VERSION, convert_mask, split_legacy_prompt
+
+SQLITE_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+SHARDED_SUFFIX = ".shards"
+# Shard files read at once when loading; on a network share reading them one by one is latency bound
+SHARD_READERS = 8
+
+
+class CaptionStore(MutableMapping):
+    """Maps a video path to its CaptionRanges.
+
+    The ranges handed out are for reading; edits go through record() or
+    update_many() so the store can persist them its own way.
+    """
+
+    # True when complete() is answered by the store itself, so there is no need to keep a CaptionIndex
+    completes = False
+
+    def load(self, progress=None):
+        """Read the stored captions. Returns False when there was nothing stored yet.
+
+        progress, if given, is called now and then with the number of videos read so far.
+        """
+        return True
+
+    def record(self, op, video_file, start_frame, end_frame, prompt, tags=0):
+        """Apply one "fill" or "assign" edit (see CaptionRanges) and persist it. tags is a tag bit mask."""
+        raise NotImplementedError
+
+    def refresh(self, video_file):
+        """Pick up changes another annotator made to video_file's captions since they were read.
+
+        Returns True when there were any.
+        """
+        return False
+
+    def update_many(self, items):
+        """Replace the captions of many (video_path, CaptionRanges) pairs at once."""
+        for video_file, ranges in items:
+            self[video_file] = ranges
+
+    def captioned(self):
+        """The videos that have at least one caption range."""
+        return [video_file for video_file, ranges in self.items() if len(ranges)]
+
+    def complete(self, prefix, limit=None):
+        """Prompts and tags starting with prefix, most used first; only for stores with completes set."""
+        raise NotImplementedError
+
+    def flush(self, wait=False):
+        pass
+
+    def close(self):
+        pass
+
+
+class JsonCaptionStore(CaptionStore):
+    """All captions in memory, persisted as the master JSON plus an edit journal (see CaptionJournal)."""
+
+    def __init__(self, master_json_path, compact_every=200):
+        self.master_json_path = master_json_path
+        self.compact_every = compact_every
+        self.journal = CaptionJournal(journal_path_for(master_json_path))
+        self._prompts = {}
+        self._compaction_executor = ThreadPoolExecutor(max_workers=1)
+        self._compaction = None
+        self._file_lock = None
+
+    def __getitem__(self, video_file):
+        return self._prompts[video_file]
+
+    def __setitem__(self, video_file, ranges):
+        self._prompts[video_file] = ranges
+
+    def __delitem__(self, video_file):
+        del self._prompts[video_file]
+
+    def __iter__(self):
+        return iter(self._prompts)
+
+    def __len__(self):
+        return len(self._prompts)
+
+    def __contains__(self, video_file):
+        return video_file in self._prompts
+
+    def load(self, progress=None):
+        """See CaptionStore.load. Raises TimeoutError when another process has the master JSON open.
+
+        The master JSON is rewritten as a whole, so only one process may have it
+        open at a time; annotators sharing a tree use a ShardedCaptionStore.
+        """
+        if self._file_lock is None:
+            self._file_lock = FileLock(self.master_json_path + ".lock", timeout=0).acquire()
+        header = {}
+        error = None
+        found = os.path.exists(self.journal.path)
+        if os.path.exists(self.master_json_path):
+            found = True
+            with open(self.master_json_path, 'r', encoding='utf-8') as f:
+                try:
+                    for count, item in enumerate(iter_document(f, header, object_hook=dict_to_object), start=1):
+                        # Entries in the old one-entry-per-frame layout are converted to ranges here
+                        self._prompts[item["video_path"]] = ranges_from_item(item, header.get("tag_schema"))
+                        if progress is not None and count % 1000 == 0:
+                            progress(count)
+                except json.JSONDecodeError as e:
+                    error = e
+
+        # Replay the edits made after the last snapshot, e.g. before a crash
+        for record in self.journal.replay(header.get("journal_seq", 0)):
+            apply_record(self._prompts, record, Path(record["video_path"]))
+
+        if error is not None:
+            raise error
+        return found
+
+    def record(self, op, video_file, start_frame, end_frame, prompt, tags=0):
+        # Apply the edit in memory and journal it; only the journal record is written right away
+        record = journal_record(op, video_file, start_frame, end_frame, prompt, tags)
+        apply_record(self._prompts, record, video_file)
+        self.journal.append(record)
+        if self.journal.pending >= self.compact_every:
+            self.flush()
+
+    def flush(self, wait=False):
+        """Fold the journal into the master JSON on the compaction thread.
+
+        Raises the error of a previous compaction that failed; its edits are still in the journal.
+        """
+        if self._compaction is not None and self._compaction.done():
+            compaction, self._compaction = self._compaction, None
+            compaction.result()
+        if self._compaction is not None:
+            if not wait:
+                return  # The running compaction is picked up again on the next flush
+            self._compaction.result()
+
+        # Only a copy of the ranges is taken on the calling thread, so it is a consistent snapshot; encoding
+        # and writing the document happen on the compaction thread.
+        snapshot = [(video_file, ranges.copy()) for video_file, ranges in self._prompts.items()]
+        self._compaction = self._compaction_executor.submit(self._compact, snapshot, self.journal.last_seq)
+        if wait:
+            self._compaction.result()
+
+    def _compact(self, snapshot, journal_seq):
+        write_document(self.master_json_path, snapshot, journal_seq=journal_seq)
+        self.journal.discard_through(journal_seq)
+
+    def close(self, compact=True):
+        try:
+            if self._compaction is not None:
+                self._compaction.result()
+            if compact and self.journal.pending:
+                self.flush(wait=True)
+        finally:
+            self.journal.close()
+            self._compaction_executor.shutdown()
+            if self._file_lock is not None:
+                self._file_lock.release()
+
+
+class SqliteCaptionStore(CaptionStore):
+    """Captions in an SQLite database (WAL mode), indexed by video path and frame range.
+
+    Nothing is read up front, so opening a large project is instant; every
+    lookup is an indexed query. Video paths are stored as strings, so str and
+    Path keys find the same video. Autocomplete is a query too, on a table
+    counting the videos each prompt and tag is used in.
+    """
+
+    completes = True
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._existed = os.path.exists(db_path)
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS videos ("
+                " id INTEGER PRIMARY KEY,"
+                " video_path TEXT NOT NULL UNIQUE,"
+                " num_frames INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS captions ("
+                " video_id INTEGER NOT NULL REFERENCES videos(id) ON DELETE CASCADE,"
+                " start_frame INTEGER NOT NULL,"
+                " end_frame INTEGER NOT NULL,"
+                " prompt TEXT NOT NULL,"
+                " tags INTEGER NOT NULL DEFAULT 0,"
+                " PRIMARY KEY (video_id, start_frame)) WITHOUT ROWID"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS captions_end_frame ON captions (video_id, end_frame)")
+            self._migrate_tags()
+            # Databases from before autocomplete get the table filled in by load(), off the Tk thread
+            self._has_completions = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'completions'").fetchone() is not None
+            if not self._has_completions and not self._existed:
+                self._create_completions()
+
+    def _migrate_tags(self):
+        # user_version holds the tag schema the masks are written in; 0 means a database from before
+        # tag masks, where the tags are still at the end of the prompts
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version == TAG_SCHEMA_VERSION:
+            return
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(captions)")]
+        if "tags" not in columns:
+            self._conn.execute("ALTER TABLE captions ADD COLUMN tags INTEGER NOT NULL DEFAULT 0")
+        rows = self._conn.execute("SELECT video_id, start_frame, prompt, tags FROM captions").fetchall()
+        updates = []
+        for video_id, start_frame, prompt, tags in rows:
+            if version == 0:
+                prompt, tags = split_legacy_prompt(prompt)
+            else:
+                tags = convert_mask(tags, version)
+            updates.append((prompt, tags, video_id, start_frame))
+        self._conn.executemany("UPDATE captions SET prompt = ?, tags = ? WHERE video_id = ? AND start_frame = ?",
+                               updates)
+        self._conn.execute(f"PRAGMA user_version = {TAG_SCHEMA_VERSION}")
+
+    def __getitem__(self, video_file):
+        with self._lock:
+            video_id = self._video_id(video_file)
+            if video_id is None:
+                raise KeyError(video_file)
+            return self._read_ranges(video_id)
+
+    def __setitem__(self, video_file, ranges):
+        self.update_many([(video_file, ranges)])
+
+    def __delitem__(self, video_file):
+        with self._lock, self._conn:
+            cursor = self._conn.execute("DELETE FROM videos WHERE video_path = ?", (str(video_file),))
+            if cursor.rowcount == 0:
+                raise KeyError(video_file)
+
+    def __iter__(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT video_path FROM videos ORDER BY video_path").fetchall()
+        return (video_path for video_path, in rows)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+
+    def __contains__(self, video_file):
+        with self._lock:
+            return self._video_id(video_file) is not None
+
+    def items(self):
+        """Yield (video_path, CaptionRanges) for every video using a single ordered query."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT v.video_path, c.start_frame, c.end_frame, c.prompt, c.tags FROM videos v"
+                " JOIN captions c ON c.video_id = v.id ORDER BY v.video_path, c.start_frame"
+            ).fetchall()
+        for video_path, group in itertools.groupby(rows, key=lambda row: row[0]):
+            ranges = CaptionRanges()
+            for _, start_frame, end_frame, prompt, tags in group:
+                ranges.append(CaptionRange(start_frame, end_frame, prompt, tags))
+            yield video_path, ranges
+
+    def load(self, progress=None):
+        if not self._has_completions:
+            with self._lock, self._conn:
+                self._create_completions()
+        return self._existed
+
+    def captioned(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT video_path FROM videos v WHERE EXISTS (SELECT 1 FROM captions c WHERE c.video_id = v.id)"
+            ).fetchall()
+        return [video_path for video_path, in rows]
+
+    def complete(self, prefix, limit=None):
+        # NOCASE folds ASCII letters only, where CaptionIndex folds all of them
+        if not prefix.strip() or not self._has_completions:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT text FROM completions WHERE text >= ? COLLATE NOCASE AND text < ? COLLATE NOCASE"
+                " ORDER BY videos DESC, text LIMIT ?",
+                (prefix, prefix + "\U0010ffff", limit or COMPLETIONS),
+            ).fetchall()
+        return [text for text, in rows]
+
+    def _create_completions(self):
+        self._conn.execute("CREATE TABLE IF NOT EXISTS completions (text TEXT PRIMARY KEY, videos INTEGER NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_nocase ON completions (text COLLATE NOCASE)")
+        counts = {}
+        rows = self._conn.execute("SELECT video_id, prompt, tags FROM captions ORDER BY video_id")
+        for _, group in itertools.groupby(rows, key=lambda row: row[0]):
+            for text in _completion_texts((prompt, tags) for _, prompt, tags in group):
+                counts[text] = counts.get(text, 0) + 1
+        self._conn.executemany("INSERT INTO completions (text, videos) VALUES (?, ?)", counts.items())
+        self._has_completions = True
+
+    def _update_completions(self, video_file, ranges):
+        # Count the video in for the texts it gains and out for the ones it loses
+        video_id = self._video_id(video_file)
+        old = set()
+        if video_id is not None:
+            old = _completion_texts(self._conn.execute("SELECT prompt, tags FROM captions WHERE video_id = ?",
+                                                       (video_id,)))
+        new = _completion_texts((r.prompt, r.tags) for r in ranges)
+        self._conn.executemany("INSERT INTO completions (text, videos) VALUES (?, 1)"
+                               " ON CONFLICT (text) DO UPDATE SET videos = videos + 1",
+                               ((text,) for text in new - old))
+        gone = [(text,) for text in old - new]
+        self._conn.executemany("UPDATE completions SET videos = videos - 1 WHERE text = ?", gone)
+        self._conn.executemany("DELETE FROM completions WHERE text = ? AND videos <= 0", gone)
+
+    def record(self, op, video_file, start_frame, end_frame, prompt, tags=0):
+        with self._lock, self._conn:
+            video_id = self._video_id(video_file)
+            ranges = self._read_ranges(video_id) if video_id is not None else CaptionRanges()
+            prompts = {video_file: ranges}
+            apply_record(prompts, journal_record(op, video_file, start_frame, end_frame, prompt, tags))
+            self._write_ranges(video_file, ranges)
+
+    def update_many(self, items):
+        # One transaction for the whole batch
+        with self._lock, self._conn:
+            for video_file, ranges in items:
+                self._write_ranges(video_file, ranges)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _video_id(self, video_file):
+        row = self._conn.execute("SELECT id FROM videos WHERE video_path = ?", (str(video_file),)).fetchone()
+        return row[0] if row else None
+
+    def _read_ranges(self, video_id):
+        ranges = CaptionRanges()
+        for row in self._conn.execute(
+            "SELECT start_frame, end_frame, prompt, tags FROM captions WHERE video_id = ? ORDER BY start_frame",
+            (video_id,),
+        ):
+            ranges.append(CaptionRange(*row))
+        return ranges
+
+    def _write_ranges(self, video_file, ranges):
+        if self._has_completions:
+            self._update_completions(video_file, ranges)
+        self._conn.execute(
+            "INSERT INTO videos (video_path, num_frames) VALUES (?, ?)"
+            " ON CONFLICT (video_path) DO UPDATE SET num_frames = excluded.num_frames",
+            (str(video_file), ranges.num_frames),
+        )
+        video_id = self._video_id(video_file)
+        self._conn.execute("DELETE FROM captions WHERE video_id = ?", (video_id,))
+        self._conn.executemany(
+            "INSERT INTO captions (video_id, start_frame, end_frame, prompt, tags) VALUES (?, ?, ?, ?, ?)",
+            ((video_id, r.start_frame, r.end_frame, r.prompt, r.tags) for r in ranges),
+        )
+
+
+class ShardedCaptionStore(CaptionStore):
+    """One small JSON document per video in a directory, for several annotators sharing a tree.
+
+    Each shard is a master JSON document holding a single video, stored
+    under a name derived from the video path (see locking.key_digest) in one
+    of 256 bucket directories. A submit rewrites only that shard, atomically
+    and under an advisory lock on its bucket, after re-reading it if another
+    annotator changed it in the meantime, so concurrent edits are never lost.
+    """
+
+    def __init__(self, shard_dir, annotator=None):
+        self.shard_dir = shard_dir
+        self.annotator = annotator
+        self._prompts = {}
+        self._versions = {}  # video -> (mtime_ns, size) of its shard when last read or written
+        self._lock = threading.RLock()
+
+    def shard_path(self, video_file):
+        digest = key_digest(video_file)
+        return os.path.join(self.shard_dir, digest[:2], digest + ".json")
+
+    def __getitem__(self, video_file):
+        return self._prompts[video_file]
+
+    def __setitem__(self, video_file, ranges):
+        self.update_many([(video_file, ranges)])
+
+    def __delitem__(self, video_file):
+        with self._lock, FileLock(self._bucket_lock(video_file)):
+            del self._prompts[video_file]
+            self._versions.pop(video_file, None)
+            try:
+                os.remove(self.shard_path(video_file))
+            except FileNotFoundError:
+                pass
+
+    def __iter__(self):
+        return iter(self._prompts)
+
+    def __len__(self):
+        return len(self._prompts)
+
+    def __contains__(self, video_file):
+        return video_file in self._prompts
+
+    def load(self, progress=None):
+        if not os.path.isdir(self.shard_dir):
+            return False
+        error = None
+        with ThreadPoolExecutor(max_workers=SHARD_READERS) as executor:
+            for count, result in enumerate(executor.map(_read_shard, iter_shard_files(self.shard_dir)), start=1):
+                if isinstance(result, json.JSONDecodeError):
+                    error = result  # Reported once the readable shards are in
+                    continue
+                version, prompts = result
+                with self._lock:
+                    for video_file, ranges in prompts.items():
+                        self._prompts[video_file] = ranges
+                        self._versions[video_file] = version
+                if progress is not None and count % 1000 == 0:
+                    progress(count)
+        if error is not None:
+            raise error
+        return True
+
+    def refresh(self, video_file):
+        with self._lock:
+            return self._refresh(video_file)
+
+    def record(self, op, video_file, start_frame, end_frame, prompt, tags=0):
+        record = journal_record(op, video_file, start_frame, end_frame, prompt, tags)
+        with self._lock, FileLock(self._bucket_lock(video_file)):
+            # Apply the edit on top of whatever is on disk now, including other annotators' edits. Read even
+            # when mtime and size look unchanged: a share with coarse mtimes can hide a same-size rewrite.
+            self._refresh(video_file, force=True)
+            apply_record(self._prompts, record, video_file)
+            self._write(video_file)
+
+    def update_many(self, items):
+        for video_file, ranges in items:
+            with self._lock, FileLock(self._bucket_lock(video_file)):
+                self._prompts[video_file] = ranges
+                self._write(video_file)
+
+    def _bucket_lock(self, video_file):
+        return os.path.join(os.path.dirname(self.shard_path(video_file)), ".lock")
+
+    def _refresh(self, video_file, force=False):
+        path = self.shard_path(video_file)
+        version = _shard_version(path)
+        if version is None and force and video_file in self._prompts:
+            # Deleted by someone else since it was read
+            del self._prompts[video_file]
+            self._versions.pop(video_file, None)
+            return True
+        if version is None or (version == self._versions.get(video_file) and not force):
+            return False
+        result = _read_shard(path)
+        if isinstance(result, json.JSONDecodeError):
+            raise result
+        version, prompts = result
+        # The path as written may differ in form from video_file; the shard name says it is the same video
+        self._prompts[video_file] = next(iter(prompts.values()), CaptionRanges())
+        self._versions[video_file] = version
+        return True
+
+    def _write(self, video_file):
+        path = self.shard_path(video_file)
+        document = prompts_to_document({video_file: self._prompts[video_file]})
+        if self.annotator:
+            document["annotator"] = self.annotator
+        write_snapshot(path, document)
+        self._versions[video_file] = _shard_version(path)
+
+
+def _completion_texts(prompts):
+    # What a video adds to autocomplete, as in CaptionIndex: its distinct prompts and tags
+    _, tags, texts = prompt_terms(set(prompts))
+    return texts | tags
+
+
+def iter_shard_files(shard_dir):
+    """Paths of the shard files of a ShardedCaptionStore directory."""
+    try:
+        buckets = sorted(entry.path for entry in os.scandir(shard_dir) if entry.is_dir())
+    except FileNotFoundError:
+        return
+    for bucket in buckets:
+        for entry in sorted(os.scandir(bucket), key=lambda entry: entry.name):
+            if entry.name.endswith(".json"):
+                yield entry.path
+
+
+def _shard_version(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _read_shard(path):
+    # Returns ((mtime_ns, size), {video_path: CaptionRanges}), or the JSONDecodeError for a broken shard.
+    # Shards are replaced atomically, so a reader sees the old or the new one, never half of one.
+    version = _shard_version(path)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return version, document_to_prompts(json.load(f, object_hook=dict_to_object))
+    except FileNotFoundError:
+        return version, {}  # Deleted while listing
+    except json.JSONDecodeError as e:
+        return e
+
+
+def is_sharded(path):
+    return os.path.splitext(path.rstrip("/\\"))[1].lower() == SHARDED_SUFFIX
+
+
+def open_store(path, annotator=None):
+    """Open the caption store at path.
+
+    SQLite for .sqlite/.sqlite3/.db files, a ShardedCaptionStore for .shards
+    directories, the master JSON otherwise. annotator is recorded in the
+    shards written.
+    """
+    if os.path.splitext(path)[1].lower() in SQLITE_SUFFIXES:
+        return SqliteCaptionStore(path)
+    if is_sharded(path):
+        return ShardedCaptionStore(path, annotator)
+    return JsonCaptionStore(path)
+
+
+def store_exists(path):
+    """Whether there is a caption store at path; a master JSON counts as there once it has a journal."""
+    if os.path.splitext(path)[1].lower() in SQLITE_SUFFIXES:
+        return os.path.isfile(path)
+    if is_sharded(path):
+        return os.path.isdir(path)
+    return os.path.exists(path) or os.path.exists(journal_path_for(path))
+
+
+def iter_captions(path):
+    """Stream (video_path, CaptionRanges) out of any caption store without loading all of it.
+
+    For a master JSON the journal is replayed on the fly: its records are
+    read up front (they are few) and applied as each video streams past.
+    Raises FileNotFoundError when there is no store at path, rather than
+    reading it as empty (or creating an empty SQLite database there).
+    """
+    if not store_exists(path):
+        raise FileNotFoundError(errno.ENOENT, "No caption store", path)
+    if os.path.splitext(path)[1].lower() in SQLITE_SUFFIXES:
+        store = SqliteCaptionStore(path)
+        try:
+            yield from store.items()
+        finally:
+            store.close()
+        return
+    if is_sharded(path):
+        for shard_path in iter_shard_files(path):
+            result = _read_shard(shard_path)
+            if isinstance(result, json.JSONDecodeError):
+                raise result
+            yield from result[1].items()
+        return
+
+    # Journal records hold str(Path(...)) of the path while a snapshot has it as it was first written (e.g.
+    # with mixed separators), so both are matched by str(Path(...)), like the Path keys of JsonCaptionStore.load
+    journal_records = {}
+    for record in CaptionJournal(journal_path_for(path)).replay(repair=False):
+        journal_records.setdefault(str(Path(record["video_path"])), []).append(record)
+
+    header = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for item in iter_document(f, header):
+                ranges = ranges_from_item(item, header.get("tag_schema"))
+                for record in journal_records.pop(str(Path(item["video_path"])), ()):
+                    if record["seq"] > header.get("journal_seq", 0):
+                        apply_record({item["video_path"]: ranges}, record, item["video_path"])
+                yield item["video_path"], ranges
+
+    # Videos that were only captioned after the last snapshot
+    for video_path, records in journal_records.items():
+        prompts = {}
+        for record in records:
+            if record["seq"] > header.get("journal_seq", 0):
+                apply_record(prompts, record)
+        if prompts:
+            yield video_path, prompts[video_path]
+
@@ -0,0 +1,152 @@
+"""The checkbox options offered next to the prompt entry (the tag vocabulary) and how tags are stored.
+
+A caption range keeps its ticked options as an integer bit mask: bit i is
+set when TAG_VOCABULARY[i] was ticked. Older saves (and the "legacy"
+prompt form used by exports) append the tag names to the prompt text
+instead, separated by ", "; split_prompt_tags() and legacy_prompt() convert
+between the two.
+"""
+
+MOTION_OPTIONS = [
+    "Zooming In", "Zooming Out", "Panning Left", "Panning Right", "Tilting Up", "Tilting Down",
+    "Steady Shot", "Handheld Camera", "Fast Motion", "Slow Motion", "Time-lapse",
+    "Fade In", "Fade Out", "Split Screen", "Visual Effects",
+    "CGI/3D Animation", "Stop Motion",
+]
+
+CATEGORIES_OPTIONS = [
+    "People", "Landscapes", "Characters", "Animals", "Food", "Travel", "Sports", "Music", "Documentary",
+    "News", "Fashion", "Comedy", "Art", "Nature", "Science", "Technology",
+    "Architecture", "Transportation",
+]
+
+OTHER_OPTIONS = [
+    "Underwater Footage", "Aerial Footage", "Low Light Conditions", "Night Scene", "Day Scene", "Indoor",
+    "Outdoor", "Close-up Shots", "Wide-angle Shots", "High-speed Action", "Slow-paced Scenes",
+    "B-roll Footage", "Crowd Shots", "Product Shots",
+]
+
+OPTION_GROUPS = (("Motion:", MOTION_OPTIONS), ("Categories:", CATEGORIES_OPTIONS), ("Other:", OTHER_OPTIONS))
+
+ALL_TAGS = frozenset(MOTION_OPTIONS + CATEGORIES_OPTIONS + OTHER_OPTIONS)
+
+# Bumped whenever the vocabulary changes. Tags may only ever be appended, but the old vocabularies are kept
+# here anyway so masks written under another version can be translated by name.
+TAG_SCHEMA_VERSION = 1
+TAG_SCHEMAS = {
+    1: tuple(MOTION_OPTIONS + CATEGORIES_OPTIONS + OTHER_OPTIONS),
+}
+TAG_VOCABULARY = TAG_SCHEMAS[TAG_SCHEMA_VERSION]
+TAG_BITS = {tag: 1 << bit for bit, tag in enumerate(TAG_VOCABULARY)}
+
+CHECKBOX_COLUMNS = 8
+
+TAG_SEPARATOR = ", "
+
+
+def checkbox_order(options, num_columns=CHECKBOX_COLUMNS):
+    """options in the order the checkbox grid lists them, which is also the order they are joined into prompts."""
+    num_rows = (len(options) + num_columns - 1) // num_columns
+    return [options[column + row * num_rows]
+            for column in range(num_rows) for row in range(num_columns) if column + row * num_rows < len(options)]
+
+
+# The order of tags in legacy prompts: group by group, in checkbox order
+_PROMPT_ORDER = [tag for _, options in OPTION_GROUPS for tag in checkbox_order(options)]
+
+
+def tags_to_mask(tags):
+    mask = 0
+    for tag in tags:
+        mask |= TAG_BITS[tag]
+    return mask
+
+
+def mask_to_tags(mask):
+    """The tags set in mask, in the order the old prompts listed them."""
+    return [tag for tag in _PROMPT_ORDER if mask & TAG_BITS[tag]]
+
+
+def convert_mask(mask, from_version):
+    """Translate a mask written under another schema version to the current one."""
+    if from_version == TAG_SCHEMA_VERSION:
+        return mask
+    if from_version not in TAG_SCHEMAS:
+        raise ValueError(f"Unknown tag schema version {from_version!r}")
+    vocabulary = TAG_SCHEMAS[from_version]
+    return tags_to_mask(tag for bit, tag in enumerate(vocabulary) if mask >> bit & 1 and tag in TAG_BITS)
+
+
+def join_prompt_tags(text, tags):
+    """The prompt as _submit writes it: the typed text followed by the ticked options."""
+    if tags:
+        return text + TAG_SEPARATOR + TAG_SEPARATOR.join(tags)
+    return text
+
+
+def split_prompt_tags(prompt):
+    """Split a stored prompt back into (typed text, [tags]).
+
+    Only known options at the end of the prompt count as tags, so commas in
+    the typed text are left alone.
+    """
+    parts = prompt.split(TAG_SEPARATOR)
+    tags = []
+    while len(parts) > 1 and parts[-1] in ALL_TAGS:
+        tags.append(parts.pop())
+    tags.reverse()
+    return TAG_SEPARATOR.join(parts), tags
+
+
+def split_legacy_prompt(prompt):
+    """(prompt text, tag mask) of a prompt that may end in tag names."""
+    text, tags = split_prompt_tags(prompt)
+    return text, tags_to_mask(tags)
+
+
+def legacy_prompt(prompt, mask):
+    """The prompt text with the tags of mask appended, as older versions stored it."""
+    return join_prompt_tags(prompt, mask_to_tags(mask))
+
+
+def tag_counts(masks, weights=None):
+    """{tag: total weight} over a sequence of masks (weight 1 each by default), for tags that occur.
+
+    Uses NumPy when it is installed and a plain loop over the set bits otherwise.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+
+    if np is not None and len(TAG_VOCABULARY) <= 64:
+        masks = np.asarray(masks, dtype=np.uint64)
+        weights = np.ones(len(masks), dtype=np.int64) if weights is None else np.asarray(weights, dtype=np.int64)
+        bits = np.arange(len(TAG_VOCABULARY), dtype=np.uint64)
+        # (ranges, tags) matrix of 0/1, weighted and summed per tag in one go
+        present = ((masks[:, None] >> bits) & np.uint64(1)).astype(np.int64)
+        totals = weights @ present if len(masks) else np.zeros(len(bits), dtype=np.int64)
+        return {tag: int(total) for tag, total in zip(TAG_VOCABULARY, totals) if total}
+
+    totals = [0] * len(TAG_VOCABULARY)
+    for index, mask in enumerate(masks):
+        weight = 1 if weights is None else weights[index]
+        while mask:
+            low_bit = mask & -mask
+            totals[low_bit.bit_length() - 1] += weight
+            mask ^= low_bit
+    return {tag: total for tag, total in zip(TAG_VOCABULARY, totals) if total}
+
+
+def filter_masks(masks, all_of=0, none_of=0):
+    """Indexes of the masks that carry every bit of all_of and no bit of none_of."""
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+
+    if np is not None:
+        masks = np.asarray(masks, dtype=np.uint64)
+        keep = ((masks & np.uint64(all_of)) == np.uint64(all_of)) & ((masks & np.uint64(none_of)) == 0)
+        return np.flatnonzero(keep).tolist()
+    return [index for index, mask in enumerate(masks) if mask & all_of == all_of and not mask & none_of]
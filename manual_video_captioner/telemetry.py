@@ -0,0 +1,248 @@
+"""Always-on timing of the captioning hot paths, for finding where an annotator's time goes.
+
+Spans (name, clip, start time, duration) go into a fixed-size ring buffer
+and, if a log path is given, are appended to a tab separated log in
+batches from a background thread:
+
+    <start, unix seconds>\t<name>\t<seconds>\t<clip path or empty>
+
+The "ui heartbeats" lines are counters: their seconds column is the number
+of heartbeats since the previous one (see StallMonitor).
+"""
+import os
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+Span = namedtuple("Span", ["time", "name", "seconds", "clip"])
+
+RING_SIZE = 20000
+# The log is moved to <log>.1 once it grows past this, so it never takes more than twice this much space
+MAX_LOG_BYTES = 32 * 1024 * 1024
+
+# The Tk heartbeat: how often it is scheduled, which delays count as a stall worth logging, and how often
+# the heartbeat count and pending spans are written out
+HEARTBEAT_MS = 100
+STALL_FLOOR = 0.010
+FLUSH_SECONDS = 10
+
+# Where the time of a clip goes. Spans nested in "display" are split out of it, and the rest of the
+# clip's time is the annotator's.
+CLIP_SPANS = ("clip", "skipped clip")
+BREAKDOWN = ("probe", "media load", "display", "save")
+
+
+class Telemetry:
+    """Ring buffer of timing spans, optionally mirrored to a log file. Safe to use from any thread."""
+
+    def __init__(self, log_path=None, capacity=RING_SIZE, max_log_bytes=MAX_LOG_BYTES):
+        self.log_path = log_path
+        self.max_log_bytes = max_log_bytes
+        self.spans = deque(maxlen=capacity)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._writer = None  # Started on the first flush with something to write
+
+    @contextmanager
+    def span(self, name, clip=None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started, clip)
+
+    def record(self, name, seconds, clip=None):
+        span = Span(time.time() - seconds, name, seconds, None if clip is None else str(clip))
+        self.spans.append(span)
+        if self.log_path is not None:
+            with self._lock:
+                self._pending.append(span)
+
+    def snapshot(self):
+        # list() copies the deque in one go, while other threads keep appending
+        return list(self.spans)
+
+    def flush(self):
+        """Hand the spans recorded since the last flush to the writer thread."""
+        with self._lock:
+            spans, self._pending = self._pending, []
+        if not spans:
+            return
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="telemetry")
+        self._writer.submit(self._write, spans)
+
+    def close(self):
+        self.flush()
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+
+    def _write(self, spans):
+        lines = "".join(format_span(span) for span in spans)
+        try:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > self.max_log_bytes:
+                os.replace(self.log_path, self.log_path + ".1")
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(lines)
+        except OSError:
+            pass  # Timing data is not worth interrupting the annotator for
+
+
+def format_span(span):
+    clip = "" if span.clip is None else span.clip.replace("\t", " ").replace("\n", " ")
+    return f"{span.time:.3f}\t{span.name}\t{span.seconds:.6f}\t{clip}\n"
+
+
+def read_log(path):
+    """The spans in a telemetry log, skipping lines that do not parse (e.g. one cut off by a crash)."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t", 3)
+            if len(fields) != 4:
+                continue
+            try:
+                yield Span(float(fields[0]), fields[1], float(fields[2]), fields[3] or None)
+            except ValueError:
+                continue
+
+
+class StallMonitor:
+    """Measures how late a Tk after() callback runs, i.e. how long the UI could not respond.
+
+    root only needs after() and after_cancel(). Delays of STALL_FLOOR and
+    more are recorded as "ui stall" spans; the total number of heartbeats is
+    recorded every FLUSH_SECONDS, which is also when the telemetry is flushed.
+    """
+
+    def __init__(self, root, telemetry, interval_ms=HEARTBEAT_MS):
+        self.root = root
+        self.telemetry = telemetry
+        self.interval = interval_ms / 1000
+        self._beats = 0
+        self._after_id = None
+        self._expected = None
+        self._last_flush = None
+
+    def start(self):
+        self._last_flush = time.perf_counter()
+        self._schedule()
+
+    def stop(self):
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+        self._record_beats()
+
+    def _schedule(self):
+        self._expected = time.perf_counter() + self.interval
+        self._after_id = self.root.after(int(self.interval * 1000), self._tick)
+
+    def _tick(self):
+        now = time.perf_counter()
+        self._beats += 1
+        late = now - self._expected
+        if late >= STALL_FLOOR:
+            self.telemetry.record("ui stall", late)
+        if now - self._last_flush >= FLUSH_SECONDS:
+            self._last_flush = now
+            self._record_beats()
+            self.telemetry.flush()
+        self._schedule()
+
+    def _record_beats(self):
+        if self._beats:
+            self.telemetry.record("ui heartbeats", self._beats)
+            self._beats = 0
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list, 0.0 when it is empty."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(spans, clips=10):
+    """Numbers for the stats panel and the report command, from an iterable of Spans.
+
+    Returns {"spans": {name: {count, total, p50, p95, max}}, "stall": {p50, p95, max, heartbeats},
+    "clips_per_hour", "clips": [per-clip breakdowns of the last `clips` clips]}.
+    """
+    durations = {}
+    heartbeats = 0
+    by_clip = {}  # clip -> {span name: seconds} of the spans since the clip was last finished
+    finished = []
+    # In order of when they ended, so a clip's span comes after the spans nested in it
+    for span in sorted(spans, key=lambda span: span.time + span.seconds):
+        if span.name == "ui heartbeats":
+            heartbeats += int(span.seconds)
+            continue
+        durations.setdefault(span.name, []).append(span.seconds)
+        if span.clip is None:
+            continue
+        totals = by_clip.setdefault(span.clip, {})
+        if span.name in CLIP_SPANS:
+            finished.append(_breakdown(span, by_clip.pop(span.clip)))
+        elif span.name in BREAKDOWN:
+            totals[span.name] = totals.get(span.name, 0.0) + span.seconds
+
+    names = {}
+    for name, values in durations.items():
+        values.sort()
+        names[name] = {"count": len(values), "total": sum(values), "p50": percentile(values, 0.5),
+                       "p95": percentile(values, 0.95), "max": values[-1]}
+
+    # Heartbeats that were not late enough to be logged count as no stall at all
+    stalls = sorted(durations.get("ui stall", []))
+    stalls = [0.0] * max(0, heartbeats - len(stalls)) + stalls
+    stall = {"p50": percentile(stalls, 0.5), "p95": percentile(stalls, 0.95), "max": stalls[-1] if stalls else 0.0,
+             "heartbeats": heartbeats}
+
+    captioned = [clip for clip in finished if clip["outcome"] == "clip"]
+    clips_per_hour = 0.0
+    if captioned:
+        # Over the time spent in clips, so breaks between sessions do not count against the annotator
+        hours = sum(clip["total"] for clip in finished) / 3600
+        clips_per_hour = len(captioned) / hours if hours > 0 else 0.0
+    return {"spans": names, "stall": stall, "clips_per_hour": clips_per_hour, "clips": finished[-clips:]}
+
+
+def _breakdown(clip_span, totals):
+    probe = totals.get("probe", 0.0)
+    media_load = totals.get("media load", 0.0)
+    display = totals.get("display", 0.0)
+    save = totals.get("save", 0.0)
+    return {
+        "clip": clip_span.clip,
+        "outcome": clip_span.name,
+        "total": clip_span.seconds,
+        "probe": probe,
+        "media load": media_load,
+        "other display": max(0.0, display - probe - media_load),
+        "save": save,
+        "annotator": max(0.0, clip_span.seconds - display - save),
+    }
+
+
+def format_summary(summary):
+    lines = [f"Clips per hour: {summary['clips_per_hour']:.1f}"]
+    stall = summary["stall"]
+    lines.append(f"UI stalls: p50 {stall['p50'] * 1000:.0f} ms, p95 {stall['p95'] * 1000:.0f} ms, "
+                 f"max {stall['max'] * 1000:.0f} ms over {stall['heartbeats']} heartbeats")
+    lines.append("")
+    lines.append(f"{'span':<16}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'total s':>9}")
+    for name, numbers in sorted(summary["spans"].items(), key=lambda item: -item[1]["total"]):
+        lines.append(f"{name:<16}{numbers['count']:>7}{numbers['p50'] * 1000:>9.1f}{numbers['p95'] * 1000:>9.1f}"
+                     f"{numbers['total']:>9.1f}")
+    if summary["clips"]:
+        lines.append("")
+        lines.append("Recent clips (seconds): " + ", ".join(BREAKDOWN[:2]) + ", other display, save, annotator")
+        for clip in summary["clips"]:
+            skipped = " (skipped)" if clip["outcome"] != "clip" else ""
+            lines.append(f"  {os.path.basename(clip['clip'])}{skipped}: {clip['total']:.1f} = "
+                         f"{clip['probe']:.2f} + {clip['media load']:.2f} + {clip['other display']:.2f} + "
+                         f"{clip['save']:.2f} + {clip['annotator']:.1f}")
+    return "\n".join(lines)
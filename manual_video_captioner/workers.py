@@ -0,0 +1,53 @@
+"""Worker processes for the OpenCV work done ahead of the annotator: scene cuts, contact sheets and keyframe hashes.
+
+The workers are spawned rather than forked: the GUI starts them with Tk and
+VLC threads already running, and a forked child would inherit the locks of
+those threads in whatever state they happened to be in.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def process_pool(workers):
+    """A ProcessPoolExecutor with spawned workers."""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+class ClipJobs:
+    """At most one job per clip, run in a process pool that is started on first use.
+
+    Starting the pool lazily keeps the workers from slowing down the start of
+    the app. Jobs are keyed by str(path); retain() drops the ones for clips
+    the annotator has moved away from.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._executor = None
+        self._jobs = {}  # str(path) -> Future of a job that is queued, running or done
+
+    def __contains__(self, key):
+        return key in self._jobs
+
+    def pending(self, media_path):
+        future = self._jobs.get(str(media_path))
+        return future is not None and not future.done()
+
+    def retain(self, keys):
+        """Forget the jobs of every clip but keys; the ones that have not started are cancelled."""
+        keys = set(keys)
+        for key in list(self._jobs):
+            if key not in keys:
+                self._jobs.pop(key).cancel()
+
+    def submit(self, key, fn, *args):
+        if self._executor is None:
+            self._executor = process_pool(self.workers)
+        future = self._executor.submit(fn, *args)
+        self._jobs[key] = future
+        return future
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._jobs.clear()